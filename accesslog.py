@@ -0,0 +1,221 @@
+"""
+Structured access and event log written off the request path
+
+    data/logs/access.jsonl      one JSON object per line
+    data/logs/access.jsonl.1    the previous file, up to `backups` of them
+
+Requests only put a small dict (or an already serialized event line) into
+a bounded queue; a background thread (one per process, started on first
+use) serializes what has queued up and writes it with a single append. If
+the queue is full the record is dropped and counted instead of making the
+request wait; the writer reports drops as a "log_dropped" record.
+
+Noisy routes can be sampled: with `sample: {"client_heartbeat": 0.1}` only
+one in ten of its successful requests is logged, and each record that is
+kept carries "sample": 0.1. Errors (status >= 400) are always logged.
+
+Every worker appends to the same file (O_APPEND). The file is rotated when
+it grows beyond `max_bytes`, or when its first record is older than the
+current `rotate_interval` period. Rotation happens under a FileLock and is
+re-checked there, so only one worker does it. The others notice that the
+path now points to a new inode and reopen it.
+"""
+
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from pathlib import Path
+
+from storage import FileLock
+
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+DEFAULT_ROTATE_INTERVAL = 24 * 60 * 60
+DEFAULT_BACKUPS = 5
+DEFAULT_QUEUE_SIZE = 10_000
+FLUSH_INTERVAL = 0.5
+BATCH = 1000
+
+
+class LogHandler(logging.Handler):
+    """Sends records of a logger (already JSON, see timing.log_event) to an AccessLog"""
+
+    def __init__(self, access_log):
+        super().__init__()
+        self.access_log = access_log
+
+    def emit(self, record):
+        try:
+            self.access_log.write(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+
+class AccessLog:
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, rotate_interval=DEFAULT_ROTATE_INTERVAL,
+                 backups=DEFAULT_BACKUPS, queue_size=DEFAULT_QUEUE_SIZE, sample=None, clock=time.time):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backups = backups
+        self.queue_size = queue_size
+        self.sample = dict(sample or {})    # endpoint -> share of requests to keep
+        self.clock = clock
+        self._rotate_lock = FileLock(self.path.with_name(self.path.name + '.lock'))
+        self._reset_process_state()
+
+    def _reset_process_state(self):
+        self._queue = queue.Queue(self.queue_size)
+        self._lock = threading.Lock()
+        self._writer_pid = None
+        self._stop = threading.Event()
+        self._file = None
+        self._current_period = None
+        self.written = 0
+        self.dropped = 0
+        self.reported_dropped = 0
+        self.sampled_out = 0
+
+    # ----- the request path -----
+
+    def keep(self, endpoint, status):
+        """Whether to log a request of `endpoint`; returns its sample rate or None"""
+        rate = self.sample.get(endpoint)
+        if rate is None or status >= 400:
+            return 1
+        if random.random() < rate:
+            return rate
+        self.sampled_out += 1
+        return None
+
+    def write(self, record):
+        """Queue a dict (or a ready JSON line); never blocks"""
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    # ----- the writer -----
+
+    def _ensure_writer(self):
+        """Start this process's writer thread (threads don't survive a fork)"""
+        if self._writer_pid == os.getpid():
+            return
+        with self._lock:
+            if self._writer_pid == os.getpid():
+                return
+            self._writer_pid = os.getpid()
+        threading.Thread(target=self._write_loop, name='access-log', daemon=True).start()
+
+    def _write_loop(self):
+        while not self._stop.is_set():
+            try:
+                records = [self._queue.get(timeout=FLUSH_INTERVAL)]
+            except queue.Empty:
+                records = []
+            while len(records) < BATCH:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if self.dropped > self.reported_dropped:
+                dropped = self.dropped
+                records.append({'ts': round(self.clock(), 3), 'event': 'log_dropped',
+                                'count': dropped - self.reported_dropped})
+                self.reported_dropped = dropped
+            if records:
+                try:
+                    self._flush(records)
+                except OSError:
+                    self.dropped += len(records)  # e.g. disk full; try again with the next batch
+
+    def _flush(self, records):
+        lines = [record if isinstance(record, str) else
+                 json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=str)
+                 for record in records]
+        data = ('\n'.join(lines) + '\n').encode('utf-8')
+        self._maybe_rotate()
+        os.write(self._fileno(), data)
+        self.written += len(records)
+
+    def _fileno(self):
+        """The open log file, reopened if another worker rotated it away"""
+        try:
+            current = os.stat(self.path)
+        except FileNotFoundError:
+            current = None
+        if self._file is not None and (current is None or current.st_ino != os.fstat(self._file).st_ino):
+            os.close(self._file)
+            self._file = None
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        return self._file
+
+    # ----- rotation -----
+
+    def _due(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        if self.max_bytes and st.st_size >= self.max_bytes:
+            return True
+        if self.rotate_interval and st.st_size:
+            period_start = self.clock() // self.rotate_interval * self.rotate_interval
+            if self._current_period == (st.st_ino, period_start):
+                return False  # this file was already found to start in this period
+            if self._first_ts() < period_start:
+                return True
+            self._current_period = (st.st_ino, period_start)
+        return False
+
+    def _first_ts(self):
+        with open(self.path, 'rb') as f:
+            first = f.readline(4096)
+        try:
+            return float(json.loads(first).get('ts', 0))
+        except (ValueError, AttributeError, TypeError):
+            return 0.0
+
+    def _maybe_rotate(self):
+        if not self._due():
+            return
+        with self._rotate_lock:
+            if not self._due():
+                return  # another worker just did it
+            for n in range(self.backups - 1, 0, -1):
+                older = self.path.with_name(f'{self.path.name}.{n}')
+                if older.exists():
+                    os.replace(older, self.path.with_name(f'{self.path.name}.{n + 1}'))
+            if self.backups:
+                os.replace(self.path, self.path.with_name(f'{self.path.name}.1'))
+            else:
+                os.unlink(self.path)
+
+    # ----- stats -----
+
+    def stats(self):
+        return {
+            'written': self.written,
+            'queued': self._queue.qsize(),
+            'dropped': self.dropped,
+            'sampled_out': self.sampled_out,
+        }
+
+    def close(self, timeout=2.0):
+        """Write out what is queued (e.g. at shutdown) and stop the writer"""
+        deadline = time.monotonic() + timeout
+        while not self._queue.empty() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self._stop.set()
+
+    def after_fork(self):
+        """In a forked child: an empty queue, no writer thread and no open file"""
+        if self._file is not None:
+            os.close(self._file)
+        self._reset_process_state()
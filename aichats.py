@@ -0,0 +1,315 @@
+"""
+AI chat history kept on the server, per user (/api/ai/chats)
+
+    data/ai_chats/<user>/chats.jsonl        the chat list, one line per change
+    data/ai_chats/<user>/<chat>.jsonl       a chat's messages, one per line
+    data/ai_chats/<user>/<chat>.idx         8-byte offsets of those lines
+
+<user> is a hash of the username. The chat list works like tokens.jsonl:
+later lines for a chat replace earlier ones (title, created, updated) and
+{"id": ..., "deleted": 1} removes it. It is read into memory per user on
+first use (the most recent `cache_users` users are kept) and afterwards
+only the bytes other processes appended are applied. It is rewritten once
+most of its lines are dead.
+
+The chat list carries titles only, and is paged newest-updated first with
+an opaque cursor. Messages are loaded in windows: the .idx file gives the
+offset of message n directly, so a window costs one small read wherever it
+is in the chat, and the message count is the .idx size / 8. Messages are
+written before their offsets, so a crash between the two leaves at most a
+line that no offset points to, which the next append writes past.
+
+Writers serialize per user through a lock file in the user's directory.
+"""
+
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+
+from storage import FileLock
+
+DEFAULT_CACHE_USERS = 1000
+DEFAULT_PAGE = 20
+DEFAULT_WINDOW = 50
+MAX_PAGE = 100
+MAX_TITLE = 100
+MAX_CONTENT = 100_000
+MAX_APPEND = 100
+ROLES = ('system', 'user', 'assistant')
+COMPACT_MIN_LINES = 64
+OFFSET = struct.Struct('>Q')
+
+
+def _encode(record):
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+def clean_title(title):
+    title = ' '.join(str(title or '').split())[:MAX_TITLE]
+    return title or 'Новый разговор'
+
+
+def valid_messages(messages):
+    """Whether `messages` is a non-empty list of {"role", "content"} that may be stored"""
+    return (isinstance(messages, list) and 0 < len(messages) <= MAX_APPEND
+            and all(isinstance(m, dict) and m.get('role') in ROLES and isinstance(m.get('content'), str)
+                    and len(m['content']) <= MAX_CONTENT for m in messages))
+
+
+class UserChats:
+    """One user's chat list as read from chats.jsonl"""
+
+    __slots__ = ('chats', 'inode', 'offset', 'lines', 'ordered')
+
+    def __init__(self):
+        self.chats = {}         # chat id -> {"id", "title", "created", "updated"}
+        self.inode = None
+        self.offset = 0         # bytes of chats.jsonl applied so far
+        self.lines = 0
+        self.ordered = None     # chats newest-updated first, until the next change
+
+    def apply(self, record):
+        chat_id = record.get('id')
+        if not chat_id:
+            return
+        if record.get('deleted'):
+            self.chats.pop(chat_id, None)
+        else:
+            self.chats[chat_id] = record
+        self.ordered = None
+
+    def newest_first(self):
+        if self.ordered is None:
+            self.ordered = sorted(self.chats.values(), key=lambda c: (c['updated'], c['id']), reverse=True)
+        return self.ordered
+
+
+class ChatHistory:
+    def __init__(self, directory, cache_users=DEFAULT_CACHE_USERS, clock=time.time):
+        self.directory = Path(directory)
+        self.cache_users = cache_users
+        self.clock = clock
+        self._reset_process_state()
+
+    def _reset_process_state(self):
+        self._lock = threading.Lock()
+        self._users = OrderedDict()     # user directory -> UserChats, least recently used first
+
+    def user_dir(self, username):
+        return self.directory / hashlib.blake2b(username.encode('utf-8'), digest_size=10).hexdigest()
+
+    # ----- the chat list -----
+
+    def _state(self, user_dir):
+        """The user's chat list, with whatever other processes appended applied"""
+        with self._lock:
+            state = self._users.get(user_dir)
+            if state is None:
+                state = self._users[user_dir] = UserChats()
+                if len(self._users) > self.cache_users:
+                    self._users.popitem(last=False)
+            else:
+                self._users.move_to_end(user_dir)
+            self._refresh(user_dir, state)
+            return state
+
+    def _refresh(self, user_dir, state):
+        path = user_dir / 'chats.jsonl'
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            if state.inode is not None:
+                state.__init__()
+            return
+        if st.st_ino != state.inode or st.st_size < state.offset:
+            state.__init__()  # rewritten elsewhere
+            state.inode = st.st_ino
+        if st.st_size == state.offset:
+            return
+        with open(path, 'rb') as f:
+            f.seek(state.offset)
+            data = f.read(st.st_size - state.offset)
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            if line:
+                try:
+                    state.apply(json.loads(line))
+                except ValueError:
+                    pass
+                state.lines += 1
+        state.offset += end
+
+    def _write_records(self, user_dir, records):
+        """Append chat list records (caller holds the user's lock file)"""
+        state = self._state(user_dir)
+        path = user_dir / 'chats.jsonl'
+        data = b''.join(_encode(record) for record in records)
+        with self._lock:
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                if state.inode is None:
+                    state.inode = os.fstat(fd).st_ino
+                os.ftruncate(fd, state.offset)  # a torn line from a crashed writer
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+            state.offset += len(data)
+            state.lines += len(records)
+            for record in records:
+                state.apply(record)
+            if state.lines > 2 * len(state.chats) + COMPACT_MIN_LINES:
+                self._rewrite(path, state)
+
+    def _rewrite(self, path, state):
+        tmp = path.with_name(f'chats.{os.getpid()}.tmp')
+        data = b''.join(_encode(chat) for chat in state.chats.values())
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        state.inode = os.stat(path).st_ino
+        state.offset = len(data)
+        state.lines = len(state.chats)
+
+    def list_chats(self, username, limit=DEFAULT_PAGE, cursor=None):
+        """(a page of chats newest-updated first, cursor of the next page or None)"""
+        limit = max(1, min(limit, MAX_PAGE))
+        chats = self._state(self.user_dir(username)).newest_first()
+        start = 0
+        if cursor:
+            try:
+                updated, chat_id = cursor.split(':', 1)
+                after = (float(updated), chat_id)
+            except ValueError:
+                after = None
+            if after is not None:
+                # Binary search in the descending (updated, id) order
+                lo, hi = 0, len(chats)
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    if (chats[mid]['updated'], chats[mid]['id']) >= after:
+                        lo = mid + 1
+                    else:
+                        hi = mid
+                start = lo
+        page = chats[start:start + limit]
+        user_dir = self.user_dir(username)
+        page = [{**chat, 'count': self._count(user_dir, chat['id'])} for chat in page]
+        more = start + limit < len(chats)
+        return page, f"{page[-1]['updated']!r}:{page[-1]['id']}" if more else None
+
+    def get(self, username, chat_id):
+        chat = self._state(self.user_dir(username)).chats.get(chat_id)
+        if chat is None:
+            return None
+        return {**chat, 'count': self._count(self.user_dir(username), chat_id)}
+
+    def create(self, username, title=None):
+        user_dir = self.user_dir(username)
+        now = round(self.clock(), 3)
+        chat = {'id': uuid.uuid4().hex, 'title': clean_title(title), 'created': now, 'updated': now}
+        user_dir.mkdir(parents=True, exist_ok=True)
+        with FileLock(user_dir / '.lock'):
+            self._write_records(user_dir, [chat])
+        return {**chat, 'count': 0}
+
+    def rename(self, username, chat_id, title):
+        """Set a chat's title; None if there is no such chat"""
+        user_dir = self.user_dir(username)
+        with FileLock(user_dir / '.lock'):
+            chat = self._state(user_dir).chats.get(chat_id)
+            if chat is None:
+                return None
+            chat = {**chat, 'title': clean_title(title)}
+            self._write_records(user_dir, [chat])
+        return self.get(username, chat_id)
+
+    def delete(self, username, chat_id):
+        user_dir = self.user_dir(username)
+        with FileLock(user_dir / '.lock'):
+            if chat_id not in self._state(user_dir).chats:
+                return False
+            self._write_records(user_dir, [{'id': chat_id, 'deleted': 1}])
+            for suffix in ('.jsonl', '.idx'):
+                (user_dir / f'{chat_id}{suffix}').unlink(missing_ok=True)
+        return True
+
+    # ----- messages -----
+
+    @staticmethod
+    def _count(user_dir, chat_id):
+        try:
+            return os.stat(user_dir / f'{chat_id}.idx').st_size // OFFSET.size
+        except FileNotFoundError:
+            return 0
+
+    def append(self, username, chat_id, messages):
+        """Add messages to a chat; return its new message count (None if no such chat)"""
+        user_dir = self.user_dir(username)
+        now = round(self.clock(), 3)
+        lines = [_encode({'role': m['role'], 'content': m['content'], 'ts': now}) for m in messages]
+        with FileLock(user_dir / '.lock'):
+            chat = self._state(user_dir).chats.get(chat_id)
+            if chat is None:
+                return None
+            count = self._count(user_dir, chat_id)
+            with open(user_dir / f'{chat_id}.jsonl', 'ab') as log:
+                position = log.tell()
+                log.write(b''.join(lines))
+            offsets = []
+            for line in lines:
+                offsets.append(OFFSET.pack(position))
+                position += len(line)
+            with open(user_dir / f'{chat_id}.idx', 'r+b' if count else 'wb') as idx:
+                idx.truncate(count * OFFSET.size)  # drop a torn offset
+                idx.seek(count * OFFSET.size)
+                idx.write(b''.join(offsets))
+            self._write_records(user_dir, [{**chat, 'updated': now}])
+        return count + len(lines)
+
+    def messages(self, username, chat_id, before=None, limit=DEFAULT_WINDOW):
+        """(up to `limit` messages before index `before` (default: the end), index of the first, count)
+
+        None if there is no such chat.
+        """
+        user_dir = self.user_dir(username)
+        if chat_id not in self._state(user_dir).chats:
+            return None
+        limit = max(1, min(limit, MAX_PAGE))
+        try:
+            with open(user_dir / f'{chat_id}.idx', 'rb') as idx:
+                total = os.fstat(idx.fileno()).st_size // OFFSET.size
+                end = total if before is None else max(0, min(before, total))
+                start = max(0, end - limit)
+                if start == end:
+                    return [], start, total
+                idx.seek(start * OFFSET.size)
+                offsets = idx.read((end - start + 1) * OFFSET.size)
+        except FileNotFoundError:
+            return [], 0, 0
+        first = OFFSET.unpack_from(offsets, 0)[0]
+        with open(user_dir / f'{chat_id}.jsonl', 'rb') as log:
+            log.seek(first)
+            if end < total:
+                data = log.read(OFFSET.unpack_from(offsets, (end - start) * OFFSET.size)[0] - first)
+            else:
+                data = log.read()
+        # Each line from its own offset: a torn append may have left one no offset points to
+        window = []
+        for i in range(end - start):
+            at = OFFSET.unpack_from(offsets, i * OFFSET.size)[0] - first
+            stop = data.find(b'\n', at)
+            window.append(json.loads(data[at:stop if stop >= 0 else len(data)]))
+        return window, start, total
+
+    def stats(self):
+        with self._lock:
+            return {'cached_users': len(self._users)}
+
+    def after_fork(self):
+        self._reset_process_state()
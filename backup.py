@@ -0,0 +1,326 @@
+"""
+Scheduled backups of users and messages (data.auto_backup, backup_interval)
+
+    data/backups/backup-000001-full.tar.gz
+    data/backups/backup-000002-incr.tar.gz
+    data/backups/state.json      where the last backup ended in every log
+
+Message logs are append-only, so a consistent snapshot is just a position:
+under a log's lock file (the one its writers use) the sizes of its segments
+are read, which takes a few milliseconds, and the bytes up to there are
+copied afterwards while writers go on appending after them. users.json is
+replaced atomically, so one read of it is a snapshot too.
+
+A full backup holds every log from the start; an incremental one only what
+was appended since the previous backup (new messages and tombstones), plus
+the small users.json and tokens.jsonl whole. If a log was rewritten in the
+meantime (cleared or compacted: a segment vanished, shrank or its last
+backed-up bytes changed) that log is copied whole and marked "reset".
+AI chat histories (data/ai_chats/<user>/, many small files) are copied per
+file: a file goes into a backup if its size or mtime changed since the
+previous one, read under the user's lock file, and every archive lists
+all the files present so a restore drops deleted chats. Every `full_every`-th backup is a full
+one; archives are gzip-compressed tars, and only the newest `keep_full`
+chains (a full backup and the incrementals after it) are kept.
+
+Workers each run a scheduler thread (started on first request), but a
+backup is taken under an exclusive lock and only if state.json says it is
+due, so exactly one of them does it each interval. restore() replays a
+chain into a data directory (with the server stopped).
+"""
+
+import hashlib
+import io
+import json
+import os
+import shutil
+import tarfile
+import threading
+import time
+from pathlib import Path
+
+from storage import SEGMENT_PREFIX, SEGMENT_SUFFIX, FileLock, write_json_atomic
+
+DEFAULT_INTERVAL = 60 * 60
+DEFAULT_FULL_EVERY = 24
+DEFAULT_KEEP_FULL = 3
+CHECK_INTERVAL = 60
+COPY_CHUNK = 1024 * 1024
+FINGERPRINT_BYTES = 256
+WHOLE_FILES = ('users.json', 'tokens.jsonl')
+TREES = ('ai_chats',)
+
+
+def _fingerprint(path, end):
+    """Digest of the last bytes before `end`: unchanged if the file was only appended to"""
+    try:
+        with open(path, 'rb') as f:
+            f.seek(max(0, end - FINGERPRINT_BYTES))
+            return hashlib.blake2b(f.read(min(end, FINGERPRINT_BYTES)), digest_size=8).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def _line_end(path, end):
+    """`end` moved back to just after the last complete line (a write may be under way)"""
+    with open(path, 'rb') as f:
+        pos = end
+        while pos > 0:
+            start = max(0, pos - 64 * 1024)
+            f.seek(start)
+            newline = f.read(pos - start).rfind(b'\n')
+            if newline >= 0:
+                return start + newline + 1
+            pos = start
+    return 0
+
+
+class BackupManager:
+    def __init__(self, data_dir, backup_dir=None, interval=DEFAULT_INTERVAL, full_every=DEFAULT_FULL_EVERY,
+                 keep_full=DEFAULT_KEEP_FULL, compresslevel=6, clock=time.time):
+        self.data_dir = Path(data_dir)
+        self.backup_dir = Path(backup_dir) if backup_dir else self.data_dir / 'backups'
+        self.interval = interval
+        self.full_every = full_every
+        self.keep_full = keep_full
+        self.compresslevel = compresslevel
+        self.clock = clock
+        self.state_file = self.backup_dir / 'state.json'
+        self._reset_process_state()
+
+    def _reset_process_state(self):
+        self._lock = threading.Lock()
+        self._scheduler_pid = None
+        self._stop = threading.Event()
+        self.last_error = None
+
+    # ----- what is backed up -----
+
+    def logs(self):
+        """name -> directory of every message log ("messages" is "general")"""
+        logs = {'messages': self.data_dir / 'messages'}
+        rooms = self.data_dir / 'rooms'
+        if rooms.is_dir():
+            for room in sorted(p for p in rooms.iterdir() if p.is_dir()):
+                logs[f'rooms/{room.name}'] = room
+        return logs
+
+    @staticmethod
+    def _segments(directory):
+        return sorted(p for p in directory.glob(f'{SEGMENT_PREFIX}*{SEGMENT_SUFFIX}'))
+
+    def snapshot(self):
+        """{log: {segment file: size}}, each taken under that log's write lock"""
+        positions = {}
+        for name, directory in self.logs().items():
+            if not directory.is_dir():
+                continue
+            with FileLock(directory / '.lock'):
+                positions[name] = {p.name: p.stat().st_size for p in self._segments(directory)}
+        return positions
+
+    # ----- taking a backup -----
+
+    def load_state(self):
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {'seq': 0, 'last': 0, 'since_full': None, 'logs': {}, 'backups': []}
+
+    def due(self, state=None):
+        state = state or self.load_state()
+        return self.clock() - state.get('last', 0) >= self.interval
+
+    def run(self, full=False, only_if_due=False):
+        """Take a backup now; return its path (None if `only_if_due` and it isn't)"""
+        self.backup_dir.mkdir(parents=True, exist_ok=True)
+        with FileLock(self.backup_dir / '.lock'):
+            state = self.load_state()
+            if only_if_due and not self.due(state):
+                return None  # another worker just did it
+            full = full or state['since_full'] is None or state['since_full'] + 1 >= self.full_every
+            positions = self.snapshot()
+            whole = {}
+            for name in WHOLE_FILES:
+                try:
+                    whole[name] = (self.data_dir / name).read_bytes()
+                except FileNotFoundError:
+                    pass
+
+            seq = state['seq'] + 1
+            path = self.backup_dir / f"backup-{seq:06d}-{'full' if full else 'incr'}.tar.gz"
+            manifest = self._write_archive(path, full, positions, state['logs'], whole, state.get('trees', {}))
+
+            state.update(seq=seq, last=self.clock(), since_full=0 if full else state['since_full'] + 1,
+                         logs={name: {seg: (end, _fingerprint(self.data_dir / name / seg, end))
+                                      for seg, (_, end) in log['segments'].items()}
+                               for name, log in manifest['logs'].items()},
+                         trees={name: tree['files'] for name, tree in manifest['trees'].items()})
+            state['backups'].append(path.name)
+            self._prune(state)
+            write_json_atomic(self.state_file, state)
+            return path
+
+    def _write_archive(self, path, full, positions, previous, whole, previous_trees):
+        manifest = {'created': self.clock(), 'kind': 'full' if full else 'incr', 'logs': {},
+                    'files': sorted(whole), 'trees': {}}
+        tmp = path.with_name(path.name + '.tmp')
+        with tarfile.open(tmp, 'w:gz', compresslevel=self.compresslevel) as tar:
+            for name, data in whole.items():
+                self._add_bytes(tar, name, data)
+            for name, sizes in positions.items():
+                before = {} if full else previous.get(name, {})
+                # Rewritten since the last backup: start this log over
+                reset = full or any(seg not in sizes or sizes[seg] < end
+                                    or _fingerprint(self.data_dir / name / seg, end) != digest
+                                    for seg, (end, digest) in before.items())
+                if reset:
+                    before = {}
+                segments = {}
+                for seg, size in sizes.items():
+                    segment = self.data_dir / name / seg
+                    start = before.get(seg, (0, None))[0]
+                    end = _line_end(segment, size) if size > start else start
+                    segments[seg] = (start, end)
+                    if end > start:
+                        with open(segment, 'rb') as f:
+                            f.seek(start)
+                            info = tarfile.TarInfo(f'logs/{name}/{seg}')
+                            info.size = end - start  # tarfile copies exactly this much
+                            info.mtime = int(self.clock())
+                            tar.addfile(info, f)
+                manifest['logs'][name] = {'reset': reset, 'segments': segments}
+            for name in TREES:
+                manifest['trees'][name] = self._add_tree(tar, name, {} if full else previous_trees.get(name, {}))
+            self._add_bytes(tar, 'manifest.json', json.dumps(manifest, indent=2).encode('utf-8'))
+        os.replace(tmp, path)
+        return manifest
+
+    def _add_tree(self, tar, name, previous):
+        """Add the files of data/<name>/<user>/ changed since `previous`; return the listing"""
+        files = {}
+        changed = []
+        root = self.data_dir / name
+        if not root.is_dir():
+            return {'files': files, 'changed': changed}
+        for user_dir in sorted(p for p in root.iterdir() if p.is_dir()):
+            with FileLock(user_dir / '.lock'):
+                for path in sorted(user_dir.iterdir()):
+                    if path.name == '.lock' or path.suffix == '.tmp' or not path.is_file():
+                        continue
+                    relative = f'{user_dir.name}/{path.name}'
+                    st = path.stat()
+                    files[relative] = [st.st_size, st.st_mtime_ns]
+                    if previous.get(relative) != files[relative]:
+                        self._add_bytes(tar, f'trees/{name}/{relative}', path.read_bytes())
+                        changed.append(relative)
+        return {'files': files, 'changed': changed}
+
+    def _add_bytes(self, tar, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(self.clock())
+        tar.addfile(info, io.BytesIO(data))
+
+    def _prune(self, state):
+        """Keep the newest `keep_full` chains"""
+        fulls = [i for i, name in enumerate(state['backups']) if name.endswith('-full.tar.gz')]
+        if self.keep_full and len(fulls) > self.keep_full:
+            cut = fulls[-self.keep_full]
+            for name in state['backups'][:cut]:
+                (self.backup_dir / name).unlink(missing_ok=True)
+            state['backups'] = state['backups'][cut:]
+
+    # ----- schedule -----
+
+    def ensure_scheduler(self):
+        """Start this process's scheduler thread (threads don't survive a fork)"""
+        if self._scheduler_pid == os.getpid() or not self.interval:
+            return
+        with self._lock:
+            if self._scheduler_pid == os.getpid():
+                return
+            self._scheduler_pid = os.getpid()
+        threading.Thread(target=self._schedule_loop, name='backups', daemon=True).start()
+
+    def _schedule_loop(self):
+        while not self._stop.wait(min(CHECK_INTERVAL, self.interval)):
+            try:
+                if self.due():
+                    self.run(only_if_due=True)
+                self.last_error = None
+            except OSError as e:
+                self.last_error = str(e)  # e.g. disk full: try again next time
+            except Exception as e:
+                # e.g. a damaged state.json or archive: shown in stats(), and tried again
+                self.last_error = f'{type(e).__name__}: {e}'
+
+    def stats(self):
+        state = self.load_state()
+        return {
+            'backups': len(state['backups']),
+            'last': state['backups'][-1] if state['backups'] else None,
+            'last_at': state['last'] or None,
+            'error': self.last_error,
+        }
+
+    def close(self):
+        self._stop.set()
+
+    def after_fork(self):
+        self._reset_process_state()
+
+    # ----- restore -----
+
+    def chain(self, upto=None):
+        """Archives to replay for the backup `upto` (default the newest), full one first"""
+        names = sorted(p.name for p in self.backup_dir.glob('backup-*.tar.gz'))
+        if upto is not None:
+            if upto not in names:
+                raise FileNotFoundError(upto)
+            names = names[:names.index(upto) + 1]
+        fulls = [i for i, name in enumerate(names) if name.endswith('-full.tar.gz')]
+        if not fulls:
+            return []
+        return [self.backup_dir / name for name in names[fulls[-1]:]]
+
+    def restore(self, target_dir, upto=None):
+        """Rebuild users, tokens, every message log and AI chat in `target_dir`; return the archives used"""
+        target = Path(target_dir)
+        archives = self.chain(upto)
+        for path in archives:
+            with tarfile.open(path, 'r:gz') as tar:
+                manifest = json.load(tar.extractfile('manifest.json'))
+                for name in manifest['files']:
+                    target.mkdir(parents=True, exist_ok=True)
+                    write_bytes_atomic(target / name, tar.extractfile(name).read())
+                for name, log in manifest['logs'].items():
+                    directory = target / name
+                    if log['reset'] and directory.is_dir():
+                        shutil.rmtree(directory)
+                    directory.mkdir(parents=True, exist_ok=True)
+                    for seg, (start, end) in log['segments'].items():
+                        segment = directory / seg
+                        with open(segment, 'r+b' if segment.exists() else 'wb') as f:
+                            f.truncate(start)
+                            f.seek(start)
+                            if end > start:
+                                shutil.copyfileobj(tar.extractfile(f'logs/{name}/{seg}'), f, COPY_CHUNK)
+                for name, tree in manifest.get('trees', {}).items():
+                    root = target / name
+                    for relative in tree['changed']:
+                        (root / relative).parent.mkdir(parents=True, exist_ok=True)
+                        write_bytes_atomic(root / relative, tar.extractfile(f'trees/{name}/{relative}').read())
+                    if root.is_dir():
+                        # What the archive doesn't list was deleted before it was taken
+                        for path in root.glob('*/*'):
+                            if path.name != '.lock' and path.relative_to(root).as_posix() not in tree['files']:
+                                path.unlink()
+        return archives
+
+
+def write_bytes_atomic(path, data):
+    tmp = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест Ollama-прокси на Fake Ollama
+Запускает fake_ollama.py и server.py, гоняет одинаковую нагрузку напрямую
+в Fake Ollama и через /api/ollama/*, выводит накладные расходы прокси.
+
+    python bench_proxy.py --requests 500 --concurrency 16
+    python bench_proxy.py --stream --token-rate 200 --json bench_results/proxy.json
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+from fake_ollama import FakeOllamaConfig, FakeOllamaServer
+
+APP_DIR = Path(__file__).parent
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def start_proxy(ollama_url, port):
+    """Run server.py in a child process so the load generator doesn't share its GIL"""
+    env = dict(os.environ, OLLAMA_URL=ollama_url)
+    # Rate limits would throttle the load generator, which is all one IP, and
+    # injected errors (--error-rate) would eject the only backend
+    code = ("from server import create_app; "
+            "create_app({'rate_limits': {'enabled': False}, 'ai': {'eject_after': 0}})"
+            f".run(host='127.0.0.1', port={port}, threaded=True)")
+    process = subprocess.Popen(
+        [sys.executable, '-c', code],
+        cwd=APP_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            if requests.get(f'http://127.0.0.1:{port}/api/health', timeout=1).status_code == 200:
+                return process
+        except requests.exceptions.RequestException:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError('server.py не запустился за 15 секунд')
+
+
+class LoadRunner:
+    def __init__(self, concurrency, stream, model):
+        self.concurrency = concurrency
+        self.stream = stream
+        self.model = model
+        self.sessions = {}
+
+    def session(self):
+        # One keep-alive session per worker thread
+        key = threading.get_ident()
+        if key not in self.sessions:
+            self.sessions[key] = requests.Session()
+        return self.sessions[key]
+
+    def chat_once(self, url):
+        payload = {
+            'model': self.model,
+            'stream': self.stream,
+            'messages': [{'role': 'user', 'content': 'Привет, как дела?'}],
+        }
+        started = time.perf_counter()
+        ttfb = None
+        try:
+            response = self.session().post(url, json=payload, timeout=120, stream=self.stream)
+            if self.stream:
+                for line in response.iter_lines():
+                    if line and ttfb is None:
+                        ttfb = time.perf_counter() - started
+            else:
+                response.content
+                ttfb = time.perf_counter() - started
+            ok = response.status_code == 200
+        except requests.exceptions.RequestException:
+            ok = False
+        return ok, ttfb, time.perf_counter() - started
+
+    def tags_once(self, url):
+        started = time.perf_counter()
+        try:
+            ok = self.session().get(url, timeout=10).status_code == 200
+        except requests.exceptions.RequestException:
+            ok = False
+        return ok, None, time.perf_counter() - started
+
+    def run(self, fn, url, total):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            results = list(pool.map(lambda _: fn(url), range(total)))
+        elapsed = time.perf_counter() - started
+
+        totals = [r[2] * 1000 for r in results if r[0]]
+        ttfbs = [r[1] * 1000 for r in results if r[0] and r[1] is not None]
+        return {
+            'requests': total,
+            'errors': sum(1 for r in results if not r[0]),
+            'rps': round(total / elapsed, 1) if elapsed else 0.0,
+            'p50_ms': round(percentile(totals, 50), 2),
+            'p95_ms': round(percentile(totals, 95), 2),
+            'p99_ms': round(percentile(totals, 99), 2),
+            'mean_ms': round(statistics.mean(totals), 2) if totals else 0.0,
+            'ttfb_p50_ms': round(percentile(ttfbs, 50), 2),
+        }
+
+
+def overhead(direct, proxied):
+    return {
+        key: round(proxied[key] - direct[key], 2)
+        for key in ('p50_ms', 'p95_ms', 'p99_ms', 'mean_ms', 'ttfb_p50_ms')
+    }
+
+
+def print_block(title, stats):
+    print(f"\n  {title}")
+    print(f"    RPS: {stats['rps']}   ошибок: {stats['errors']}/{stats['requests']}")
+    print(f"    p50: {stats['p50_ms']} мс   p95: {stats['p95_ms']} мс   p99: {stats['p99_ms']} мс")
+    print(f"    TTFB p50: {stats['ttfb_p50_ms']} мс")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Proxy overhead benchmark against Fake Ollama')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--stream', action='store_true', help='use streaming /api/chat responses')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--token-rate', type=float, default=0.0)
+    parser.add_argument('--tokens', type=int, default=32)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--model', default='mistral')
+    parser.add_argument('--json', dest='json_path', help='save results to this file')
+    args = parser.parse_args(argv)
+
+    fake = FakeOllamaServer(port=0, config=FakeOllamaConfig(
+        latency=args.latency,
+        token_rate=args.token_rate,
+        tokens=args.tokens,
+        error_rate=args.error_rate,
+        models=[args.model],
+        seed=1,
+    )).start()
+    proxy_port = free_port()
+    proxy = start_proxy(fake.url, proxy_port)
+    proxy_url = f'http://127.0.0.1:{proxy_port}'
+
+    print("=" * 60)
+    print("🏁 НАГРУЗОЧНЫЙ ТЕСТ OLLAMA-ПРОКСИ")
+    print("=" * 60)
+    print(f"  Fake Ollama: {fake.url}")
+    print(f"  Прокси: {proxy_url}")
+    print(f"  Запросов: {args.requests}, параллельно: {args.concurrency}, stream: {args.stream}")
+
+    runner = LoadRunner(args.concurrency, args.stream, args.model)
+    try:
+        # Warm up connections and imports on both sides
+        runner.run(runner.chat_once, f'{proxy_url}/api/ollama/chat', args.concurrency)
+
+        results = {
+            'config': vars(args),
+            'chat': {
+                'direct': runner.run(runner.chat_once, f'{fake.url}/api/chat', args.requests),
+                'proxy': runner.run(runner.chat_once, f'{proxy_url}/api/ollama/chat', args.requests),
+            },
+            'tags': {
+                'direct': runner.run(runner.tags_once, f'{fake.url}/api/tags', args.requests),
+                'proxy': runner.run(runner.tags_once, f'{proxy_url}/api/ollama/tags', args.requests),
+            },
+        }
+        for name in ('chat', 'tags'):
+            results[name]['overhead'] = overhead(results[name]['direct'], results[name]['proxy'])
+    finally:
+        proxy.terminate()
+        proxy.wait(timeout=5)
+        fake.stop()
+
+    for name in ('chat', 'tags'):
+        print(f"\n📊 /api/{name}")
+        print_block('Напрямую:', results[name]['direct'])
+        print_block('Через прокси:', results[name]['proxy'])
+        extra = results[name]['overhead']
+        print(f"    ➕ Накладные расходы прокси: p50 {extra['p50_ms']} мс, p95 {extra['p95_ms']} мс")
+
+    if args.json_path:
+        path = Path(args.json_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding='utf-8')
+        print(f"\n💾 Результаты сохранены: {path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
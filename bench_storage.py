@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+Микро-бенчмарки слоя хранения
+Генерирует синтетические данные (1k / 100k / 1M сообщений, 100 / 10k / 100k
+пользователей), замеряет чтение, добавление, удаление, поиск токена и память
+для каждого бэкенда хранения и сохраняет результаты в JSON для сравнения
+между коммитами.
+
+    python bench_storage.py --quick
+    python bench_storage.py --json bench_results/storage.json
+    python bench_storage.py --quick --compare bench_results/storage.json
+"""
+
+import argparse
+import gc
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import server
+from storage import MessageStore, write_json_atomic
+
+APP_DIR = Path(__file__).parent
+
+MESSAGE_SIZES = [1_000, 100_000, 1_000_000]
+USER_SIZES = [100, 10_000, 100_000]
+QUICK_MESSAGE_SIZES = [1_000, 10_000]
+QUICK_USER_SIZES = [100, 1_000]
+
+# Hashing 100k real passwords would dominate setup time; lookups never check it
+FAKE_PASSWORD_HASH = 'scrypt:32768:8:1$bench$' + '0' * 64
+
+
+def make_users(count):
+    users = {}
+    for i in range(count):
+        username = f'user{i:06d}'
+        users[username] = {
+            'id': str(uuid.uuid4()),
+            'email': f'{username}@example.com',
+            'password': FAKE_PASSWORD_HASH,
+            'created_at': datetime(2025, 1, 1).isoformat(),
+            'avatar': 'U',
+        }
+    return users
+
+
+def make_messages(count, users=1000):
+    start = datetime(2025, 1, 1)
+    return [
+        {
+            'id': str(uuid.uuid4()),
+            'username': f'user{i % users:06d}',
+            'avatar': 'U',
+            'content': f'Тестовое сообщение номер {i}, немного текста для реалистичного размера.',
+            'timestamp': (start + timedelta(seconds=i)).isoformat(),
+        }
+        for i in range(count)
+    ]
+
+
+class JsonBackend:
+    """Legacy single-file JSON array (data/messages.json), kept as a baseline"""
+
+    name = 'json'
+
+    def __init__(self, data_dir):
+        self.data_dir = Path(data_dir)
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+        self.messages_file = self.data_dir / 'messages.json'
+        # Users live in users.json for every backend
+        self.app = server.create_app({'data': {'data_dir': str(self.data_dir)}})
+        self.context = self.app.app_context()
+        self.context.push()
+
+    def load(self):
+        with open(self.messages_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def populate_messages(self, messages):
+        write_json_atomic(self.messages_file, messages)
+
+    def populate_users(self, users):
+        """Save users and sign each one in once; return the tokens by username"""
+        server.save_users(users)
+        token_store = server.services().token_store
+        return {username: token_store.issue(username) for username in users}
+
+    def data_size(self):
+        return sum(f.stat().st_size for f in self.data_dir.rglob('*') if f.is_file())
+
+    def cold_open(self):
+        return len(self.load())
+
+    def read_messages(self):
+        return self.load()
+
+    def read_recent(self, limit=50):
+        return self.load()[-limit:]
+
+    def append_message(self, message):
+        # What send_message used to do: load everything, append, rewrite
+        messages = self.load()
+        messages.append(message)
+        write_json_atomic(self.messages_file, messages)
+
+    def delete_message(self, message_id):
+        # What delete_message used to do: scan, remove, rewrite
+        messages = self.load()
+        for i, msg in enumerate(messages):
+            if msg['id'] == message_id:
+                del messages[i]
+                break
+        write_json_atomic(self.messages_file, messages)
+
+    def read_users(self):
+        return server.load_users()
+
+    def lookup_token(self, token):
+        with self.app.test_request_context(headers={'Authorization': f'Bearer {token}'}):
+            return server.get_authenticated_username()
+
+    def close(self):
+        self.context.pop()
+
+
+class LogBackend(JsonBackend):
+    """storage.MessageStore, the append-only segment log server.py uses"""
+
+    name = 'log'
+
+    def __init__(self, data_dir):
+        super().__init__(data_dir)
+        self.store = MessageStore(self.data_dir / 'messages')
+
+    def populate_messages(self, messages):
+        for i in range(0, len(messages), 10_000):
+            self.store.append_many(messages[i:i + 10_000])
+
+    def cold_open(self):
+        # A fresh process has to index the segments before its first read
+        return MessageStore(self.store.directory).count()
+
+    def read_messages(self):
+        return list(self.store.iter_messages())
+
+    def read_recent(self, limit=50):
+        return self.store.tail(limit)
+
+    def append_message(self, message):
+        self.store.append(message)
+
+    def delete_message(self, message_id):
+        self.store.delete(message_id)
+
+    def close(self):
+        self.store.close()
+        super().close()
+
+
+BACKENDS = {
+    JsonBackend.name: JsonBackend,
+    LogBackend.name: LogBackend,
+}
+
+
+def timed(fn, repeat):
+    """Median wall time of `repeat` runs in milliseconds"""
+    samples = []
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return round(statistics.median(samples), 3)
+
+
+def peak_memory(fn):
+    """Peak Python heap allocated while running fn, in MiB"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return round(peak / (1024 * 1024), 2)
+
+
+def bench_messages(backend_cls, size, repeat, workdir):
+    backend = backend_cls(workdir / f'{backend_cls.name}-messages-{size}')
+    try:
+        messages = make_messages(size)
+        backend.populate_messages(messages)
+        # Delete from the middle so a scan can't get lucky at either end
+        victims = [messages[len(messages) // 2 + i]['id'] for i in range(repeat)]
+        del messages
+
+        extra = iter(make_messages(repeat))
+        victim_iter = iter(victims)
+        return {
+            'size': size,
+            'file_bytes': backend.data_size(),
+            'cold_open_ms': timed(backend.cold_open, repeat),
+            'read_all_ms': timed(backend.read_messages, repeat),
+            'read_recent_50_ms': timed(backend.read_recent, repeat),
+            'append_ms': timed(lambda: backend.append_message(next(extra)), repeat),
+            'delete_ms': timed(lambda: backend.delete_message(next(victim_iter)), repeat),
+            'read_all_peak_mib': peak_memory(backend.read_messages),
+        }
+    finally:
+        backend.close()
+
+
+def bench_users(backend_cls, size, repeat, workdir):
+    backend = backend_cls(workdir / f'{backend_cls.name}-users-{size}')
+    try:
+        users = make_users(size)
+        tokens = backend.populate_users(users)
+        # Worst case for a linear scan: the most recently registered user
+        last_token = tokens[f'user{size - 1:06d}']
+        del users, tokens
+
+        return {
+            'size': size,
+            'file_bytes': backend.data_size(),
+            'read_users_ms': timed(backend.read_users, repeat),
+            'token_lookup_ms': timed(lambda: backend.lookup_token(last_token), repeat),
+            'token_miss_ms': timed(lambda: backend.lookup_token('missing-token'), repeat),
+            'read_users_peak_mib': peak_memory(backend.read_users),
+        }
+    finally:
+        backend.close()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=APP_DIR, text=True,
+            stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, previous_path):
+    """Print per-metric ratios against an earlier results file"""
+    previous = json.loads(Path(previous_path).read_text(encoding='utf-8'))
+    print(f"\n📈 Сравнение с {previous_path} (коммит {previous.get('commit')}):")
+
+    for backend, groups in current['backends'].items():
+        old_groups = previous.get('backends', {}).get(backend)
+        if not old_groups:
+            continue
+        for group, rows in groups.items():
+            old_rows = {row['size']: row for row in old_groups.get(group, [])}
+            for row in rows:
+                old = old_rows.get(row['size'])
+                if not old:
+                    continue
+                for metric, value in row.items():
+                    if not metric.endswith(('_ms', '_mib')) or not old.get(metric):
+                        continue
+                    ratio = value / old[metric]
+                    marker = '🔴' if ratio > 1.2 else '🟢' if ratio < 0.8 else '  '
+                    print(f"  {marker} {backend}/{group}[{row['size']}] {metric}: "
+                          f"{old[metric]} → {value} (x{ratio:.2f})")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Storage layer micro-benchmarks')
+    parser.add_argument('--backend', action='append', choices=sorted(BACKENDS),
+                        help='backend to measure (default: all)')
+    parser.add_argument('--messages', type=int, nargs='+', help='message dataset sizes')
+    parser.add_argument('--users', type=int, nargs='+', help='user dataset sizes')
+    parser.add_argument('--quick', action='store_true', help='small datasets for a fast check')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', dest='json_path', help='save results to this file')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    args = parser.parse_args(argv)
+
+    message_sizes = args.messages or (QUICK_MESSAGE_SIZES if args.quick else MESSAGE_SIZES)
+    user_sizes = args.users or (QUICK_USER_SIZES if args.quick else USER_SIZES)
+    backends = args.backend or sorted(BACKENDS)
+
+    results = {
+        'commit': git_commit(),
+        'created_at': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': args.repeat,
+        'backends': {},
+    }
+
+    print("=" * 60)
+    print("⏱️  БЕНЧМАРК ХРАНИЛИЩА")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory(prefix='alit-bench-') as tmp:
+        workdir = Path(tmp)
+        for name in backends:
+            backend_cls = BACKENDS[name]
+            groups = results['backends'][name] = {'messages': [], 'users': []}
+
+            for size in message_sizes:
+                print(f"  💬 {name}: {size} сообщений...", flush=True)
+                row = bench_messages(backend_cls, size, args.repeat, workdir)
+                groups['messages'].append(row)
+                print(f"     открытие {row['cold_open_ms']} мс, чтение {row['read_all_ms']} мс, "
+                      f"последние 50 {row['read_recent_50_ms']} мс, "
+                      f"добавление {row['append_ms']} мс, удаление {row['delete_ms']} мс, "
+                      f"пик {row['read_all_peak_mib']} MiB")
+
+            for size in user_sizes:
+                print(f"  👥 {name}: {size} пользователей...", flush=True)
+                row = bench_users(backend_cls, size, args.repeat, workdir)
+                groups['users'].append(row)
+                print(f"     чтение {row['read_users_ms']} мс, токен {row['token_lookup_ms']} мс, "
+                      f"промах {row['token_miss_ms']} мс, пик {row['read_users_peak_mib']} MiB")
+
+    if args.compare:
+        compare(results, args.compare)
+
+    if args.json_path:
+        path = Path(args.json_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding='utf-8')
+        print(f"\n💾 Результаты сохранены: {path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
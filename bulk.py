@@ -0,0 +1,173 @@
+"""
+Bulk NDJSON export/import of users and chat history
+
+One JSON object per line, each tagged with "type":
+
+    {"type":"meta","format":"alit-ndjson","version":1,"exported_at":"..."}
+    {"type":"user","username":"john","id":"...","email":"...",...}
+    {"type":"message","room":"general","id":"...","username":"john",...}
+
+Every room is exported, "general" first, and each message names its room;
+a message without "room" (an export made before rooms) goes to "general",
+and import creates a room that doesn't exist yet.
+
+Export parses users.json incrementally and passes message lines from the
+memory-mapped log through without re-encoding them. Import reads line by
+line and writes messages in batches (per room) through
+MessageStore.append_many, so memory use stays flat no matter how large
+the history is.
+"""
+
+import json
+from datetime import datetime
+from pathlib import Path
+
+from rooms import GENERAL
+from storage import FileLock, iter_json_object_items, write_json_atomic
+
+EXPORT_FORMAT = 'alit-ndjson'
+EXPORT_VERSION = 1
+IMPORT_BATCH = 1000
+MAX_REPORTED_ERRORS = 20
+
+
+def _dumps(record):
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+def export_lines(users_file, rooms):
+    """Yield the NDJSON export as bytes lines; `rooms` yields (room name, MessageStore)"""
+    yield _dumps({
+        'type': 'meta',
+        'format': EXPORT_FORMAT,
+        'version': EXPORT_VERSION,
+        'exported_at': datetime.now().isoformat()
+    })
+
+    users_file = Path(users_file)
+    if users_file.exists():
+        with open(users_file, 'rb') as f:
+            for username, info in iter_json_object_items(f):
+                info.pop('token', None)  # auth tokens aren't part of an export
+                record = {'type': 'user', 'username': username}
+                record.update(info)
+                yield _dumps(record)
+
+    for room, store in rooms:
+        # '{"id":...}' -> '{"type":"message","room":"...","id":...}' without decoding
+        prefix = b'{"type":"message","room":' + json.dumps(room).encode('utf-8') + b','
+        for line in store.iter_raw():
+            yield prefix + line[1:] + b'\n'
+
+
+class ImportReport:
+    def __init__(self):
+        self.users_added = 0
+        self.users_skipped = 0
+        self.messages_added = 0
+        self.messages_skipped = 0
+        self.errors = []
+        self.error_count = 0
+
+    def error(self, line_no, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f'строка {line_no}: {message}')
+
+    def to_dict(self):
+        return {
+            'users_added': self.users_added,
+            'users_skipped': self.users_skipped,
+            'messages_added': self.messages_added,
+            'messages_skipped': self.messages_skipped,
+            'error_count': self.error_count,
+            'errors': self.errors
+        }
+
+
+def _valid_message(record):
+    return (isinstance(record.get('id'), str) and record['id']
+            and isinstance(record.get('username'), str)
+            and isinstance(record.get('content'), str))
+
+
+def import_lines(lines, users_file, room_store, users_lock=None, batch_size=IMPORT_BATCH):
+    """Import an NDJSON export; existing users and message ids are kept as they are
+
+    `room_store(name)` returns the room's MessageStore, creating the room if
+    needed, or None if `name` can't be a room.
+    """
+    report = ImportReport()
+    batches = {}                # room name -> messages not written yet
+    stores = {}
+    new_users = {}
+
+    def flush(room):
+        batch = batches.pop(room, None)
+        if batch:
+            written = stores[room].append_many(batch, skip_existing=True)
+            report.messages_added += written
+            report.messages_skipped += len(batch) - written
+
+    for line_no, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            report.error(line_no, 'некорректный JSON')
+            continue
+        if not isinstance(record, dict):
+            report.error(line_no, 'ожидался объект')
+            continue
+
+        kind = record.pop('type', None)
+        if kind == 'message':
+            if not _valid_message(record):
+                report.error(line_no, 'сообщению нужны id, username и content')
+                continue
+            room = record.pop('room', GENERAL)
+            if room not in stores:
+                store = room_store(room) if isinstance(room, str) else None
+                if store is None:
+                    report.error(line_no, f'недопустимая комната {room!r}')
+                    continue
+                stores[room] = store
+            record.setdefault('avatar', record['username'][:1].upper())
+            record.setdefault('timestamp', datetime.now().isoformat())
+            batch = batches.setdefault(room, [])
+            batch.append(record)
+            if len(batch) >= batch_size:
+                flush(room)
+        elif kind == 'user':
+            username = record.pop('username', None)
+            if not isinstance(username, str) or not username or 'password' not in record:
+                report.error(line_no, 'пользователю нужны username и password')
+                continue
+            record.pop('token', None)  # exports made before the token store
+            new_users[username] = record
+        elif kind == 'meta':
+            if record.get('format') != EXPORT_FORMAT:
+                report.error(line_no, f"неизвестный формат {record.get('format')!r}")
+        else:
+            report.error(line_no, f'неизвестный тип {kind!r}')
+    for room in list(batches):
+        flush(room)
+    for store in stores.values():
+        store.sync()
+
+    if new_users:
+        users_file = Path(users_file)
+        # Same lock file as the server, so a running server's writes aren't lost
+        with users_lock or FileLock(users_file.with_name(users_file.name + '.lock')):
+            users = json.loads(users_file.read_text(encoding='utf-8') or '{}') if users_file.exists() else {}
+            for username, info in new_users.items():
+                if username in users:
+                    report.users_skipped += 1
+                else:
+                    users[username] = info
+                    report.users_added += 1
+            write_json_atomic(users_file, users)
+
+    return report
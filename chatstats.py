@@ -0,0 +1,293 @@
+"""
+Chat analytics for /api/admin/stats, maintained incrementally
+
+    data/stats/<room>.json    the aggregates and the log position they cover
+
+Per room: live messages per user, per hour of the day and per day (the
+last `days` days). The aggregates follow the room's message log from a
+position (MessageStore.read_since): a message line adds one, a tombstone
+subtracts one for the author and time it carries (a repeated tombstone,
+left by an older writer, is ignored: the ids of applied tombstones are kept,
+and saved, until the log is compacted; no count goes below zero). Following the log,
+rather than hooking the routes of one process, counts every send and
+delete exactly once whichever worker handled it; each catch-up only reads
+the lines added since.
+
+A background thread per process catches up every `interval` seconds and
+writes the aggregates every `persist_interval` seconds, and a query catches
+up first, so answers are current and cost what was appended since the last
+catch-up, not the size of the history. At startup (or the first query of a
+room; "general" is loaded by the thread right away) the saved file is loaded and followed from its position; if it is
+missing, or the log was compacted or cleared past that position, the room
+is recounted from the live messages once.
+"""
+
+import heapq
+import json
+import os
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+from rooms import GENERAL
+from storage import DECODE_CHUNK, write_json_atomic
+
+DEFAULT_INTERVAL = 5
+DEFAULT_PERSIST_INTERVAL = 60
+DEFAULT_DAYS = 90
+DEFAULT_TOP = 10
+MAX_TOP = 100
+
+
+def _hour(timestamp):
+    """Hour of an ISO timestamp ("2025-01-31T14:05:00") without parsing it"""
+    try:
+        hour = int(timestamp[11:13])
+    except (TypeError, ValueError):
+        return None
+    return hour if 0 <= hour < 24 else None
+
+
+class RoomStats:
+    """The aggregates of one room's log"""
+
+    def __init__(self, name, store, path, days=DEFAULT_DAYS):
+        self.name = name
+        self.store = store
+        self.path = Path(path)
+        self.days = days
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._reset()
+
+    def _reset(self):
+        self.position = (0, 0)
+        self.messages = 0
+        self.by_user = Counter()
+        self.by_hour = [0] * 24
+        self.by_day = Counter()
+        self.deleted = set()        # ids of the tombstones applied since the last recount
+        self.version = 0
+        self.saved_version = 0
+        self._top = None            # (version, limit, top posters)
+
+    # ----- keeping up -----
+
+    def _count(self, record, sign):
+        username = record.get('username')
+        if not isinstance(username, str):
+            return  # a tombstone older than this module, or a malformed record
+        timestamp = record.get('timestamp')
+        self.messages = max(0, self.messages + sign)
+        self.by_user[username] += sign
+        if self.by_user[username] <= 0:
+            del self.by_user[username]
+        hour = _hour(timestamp)
+        if hour is not None:
+            self.by_hour[hour] = max(0, self.by_hour[hour] + sign)
+        if isinstance(timestamp, str) and len(timestamp) >= 10:
+            day = timestamp[:10]
+            self.by_day[day] += sign
+            if self.by_day[day] <= 0:
+                del self.by_day[day]
+
+    def _prune_days(self):
+        if len(self.by_day) > self.days:
+            for day in sorted(self.by_day)[:len(self.by_day) - self.days]:
+                del self.by_day[day]
+
+    def rebuild(self):
+        """Recount from the live messages"""
+        with self._lock:
+            self._reset()
+            position, lines = self.store.scan_live()
+            chunk = []
+            for line in lines:
+                chunk.append(line)
+                if len(chunk) >= DECODE_CHUNK:
+                    for message in json.loads(b'[' + b','.join(chunk) + b']'):
+                        self._count(message, 1)
+                    chunk.clear()
+            if chunk:
+                for message in json.loads(b'[' + b','.join(chunk) + b']'):
+                    self._count(message, 1)
+            self._prune_days()
+            self.position = position
+            self.version += 1
+            self._loaded = True
+
+    def follow(self):
+        """Apply what was appended to the log since the last call"""
+        if not self._loaded:
+            self.load()
+        with self._lock:
+            records, position = self.store.read_since(self.position)
+            if records:
+                for kind, record in records:
+                    if kind == 'message':
+                        self._count(record, 1)
+                        self.deleted.discard(record.get('id'))  # sent again (an import)
+                    elif record.get('deleted') not in self.deleted:
+                        self.deleted.add(record.get('deleted'))  # a repeated tombstone doesn't count twice
+                        self._count(record, -1)
+                self._prune_days()
+                self.version += 1
+            rewritten = not records and position != self.position and self.position != (0, 0)
+            self.position = position
+        if rewritten:
+            self.rebuild()  # compacted or cleared: our position means nothing now
+
+    # ----- persistence -----
+
+    def load(self):
+        """Pick up the saved aggregates, or recount if there are none"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.rebuild()
+            self.save()
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            self._reset()
+            self.position = tuple(saved['position'])
+            self.messages = saved['messages']
+            self.by_user = Counter(saved['by_user'])
+            self.by_hour = saved['by_hour']
+            self.by_day = Counter(saved['by_day'])
+            self.deleted = set(saved.get('deleted', ()))
+            self._loaded = True
+
+    def save(self):
+        with self._lock:
+            if self.saved_version == self.version and self.path.exists():
+                return
+            data = {
+                'room': self.name,
+                'position': list(self.position),
+                'messages': self.messages,
+                'by_user': dict(self.by_user),
+                'by_hour': list(self.by_hour),
+                'by_day': dict(self.by_day),
+                'deleted': list(self.deleted),
+                'saved_at': time.time(),
+            }
+            version = self.version
+        write_json_atomic(self.path, data)
+        self.saved_version = version
+
+    # ----- answers -----
+
+    def top_posters(self, limit=DEFAULT_TOP):
+        """Users with the most live messages (recomputed only after a change)"""
+        with self._lock:
+            if self._top is None or self._top[:2] != (self.version, limit):
+                top = heapq.nsmallest(limit, self.by_user.items(), key=lambda item: (-item[1], item[0]))
+                self._top = (self.version, limit, [{'username': name, 'messages': n} for name, n in top])
+            return self._top[2]
+
+    def summary(self, top=DEFAULT_TOP, days=30):
+        top_posters = self.top_posters(max(1, min(top, MAX_TOP)))
+        with self._lock:
+            recent_days = sorted(self.by_day.items())[-max(1, min(days, self.days)):]
+            return {
+                'room': self.name,
+                'messages': self.messages,
+                'users': len(self.by_user),
+                'top_posters': top_posters,
+                'by_hour': list(self.by_hour),
+                'by_day': dict(recent_days),
+            }
+
+    def user_messages(self, username):
+        with self._lock:
+            return self.by_user.get(username, 0)
+
+
+class ChatStats:
+    def __init__(self, rooms, directory, interval=DEFAULT_INTERVAL, persist_interval=DEFAULT_PERSIST_INTERVAL,
+                 days=DEFAULT_DAYS):
+        self.rooms = rooms              # rooms.RoomRegistry
+        self.directory = Path(directory)
+        self.interval = interval
+        self.persist_interval = persist_interval
+        self.days = days
+        self._reset_process_state()
+
+    def _reset_process_state(self):
+        self._lock = threading.Lock()
+        self._rooms = {}                # room name -> RoomStats
+        self._worker_pid = None
+        self._stop = threading.Event()
+        self.last_error = None
+
+    def room(self, name):
+        """The room's aggregates, caught up; None if there is no such room"""
+        self.ensure_worker()
+        chat_room = self.rooms.get(name)
+        if chat_room is None:
+            return None
+        with self._lock:
+            stats = self._rooms.get(name)
+            if stats is None:
+                stats = self._rooms[name] = RoomStats(name, chat_room.store, self.directory / f'{name}.json',
+                                                      days=self.days)
+            # A room evicted and loaded again has a new store over the same files
+            stats.store = chat_room.store
+        stats.follow()
+        return stats
+
+    # ----- background -----
+
+    def ensure_worker(self):
+        """Start this process's catch-up thread (threads don't survive a fork)"""
+        if self._worker_pid == os.getpid() or not self.interval:
+            return
+        with self._lock:
+            if self._worker_pid == os.getpid():
+                return
+            self._worker_pid = os.getpid()
+        threading.Thread(target=self._work_loop, name='chat-stats', daemon=True).start()
+
+    def _work_loop(self):
+        try:
+            self.room(GENERAL)  # load or recount "general" now rather than on the first query
+        except Exception as e:
+            self.last_error = f'{type(e).__name__}: {e}'
+        next_save = time.monotonic() + self.persist_interval
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                rooms = list(self._rooms.values())
+            save = time.monotonic() >= next_save
+            error = None
+            for stats in rooms:
+                try:
+                    if self.rooms.loaded(stats.name) is not None:
+                        stats.follow()  # an evicted room's log is caught up on its next query
+                    if save:
+                        stats.save()
+                except Exception as e:
+                    # One room's trouble (a full disk, a malformed record) must not stop the rest
+                    error = f'{type(e).__name__}: {e}'
+            self.last_error = error
+            if save:
+                next_save = time.monotonic() + self.persist_interval
+
+    def save(self):
+        with self._lock:
+            rooms = list(self._rooms.values())
+        for stats in rooms:
+            stats.save()
+
+    def stats(self):
+        with self._lock:
+            return {'rooms': len(self._rooms), 'error': self.last_error}
+
+    def close(self):
+        self._stop.set()
+
+    def after_fork(self):
+        self._reset_process_state()
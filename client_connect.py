@@ -1,216 +1,591 @@
 """
 Client script to connect to Alit Chat Server
 Используйте этот скрипт для подключения к удаленному серверу
+
+Также это асинхронная библиотека клиента (asyncio + aiohttp):
+
+    async with AitClient('http://192.168.1.100:5000', 'john', 'password123') as client:
+        await client.login()
+        await client.connect_client()      # heartbeat идёт в фоне сам
+        await client.send_message('Привет!')
+        async for event_type, data in client.subscribe():
+            print(event_type, data)
+
+И режим "swarm" - тысячи симулированных клиентов из одного процесса:
+
+    python client_connect.py swarm http://localhost:5000 --clients 2000 --duration 120
 """
 
-import requests
+import argparse
+import asyncio
 import json
+import random
+import statistics
 import sys
-from datetime import datetime
+import time
+
+import aiohttp
+
+DEFAULT_HEARTBEAT_INTERVAL = 30
+HEARTBEAT_JITTER = 0.2       # +-20% so thousands of clients don't beat in lockstep
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+REQUEST_TIMEOUT = 30
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_MAX):
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def jittered(interval, jitter=HEARTBEAT_JITTER):
+    return interval * random.uniform(1 - jitter, 1 + jitter)
+
+
+def new_http_session(pool_size=100):
+    """HTTP session for one or many clients.
+
+    Cookies are disabled so clients sharing the pool never see each
+    other's Flask sessions; every client authenticates with its own token.
+    """
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=pool_size),
+        cookie_jar=aiohttp.DummyCookieJar(),
+        timeout=aiohttp.ClientTimeout(total=None, sock_connect=REQUEST_TIMEOUT),
+    )
+
+
+class AitClientError(Exception):
+    def __init__(self, status, message, retry_after=None):
+        super().__init__(f'{status}: {message}')
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after  # seconds, from Retry-After on 429
 
-class AitClientConnector:
-    def __init__(self, server_url, username, password):
+
+class AitClient:
+    """Async client for one user. Pass `http` to share a connection pool."""
+
+    def __init__(self, server_url, username, password, http=None, stats=None):
         self.server_url = server_url.rstrip('/')
         self.username = username
         self.password = password
-        self.session = requests.Session()
+        self.stats = stats
+        self.token = None
+        self.user = None
         self.client_id = None
         self.session_id = None
-        
-    def login(self):
-        """Авторизоваться на сервере"""
+        self.heartbeat_interval = DEFAULT_HEARTBEAT_INTERVAL
+
+        self._http = http
+        self._owns_http = http is None
+        self._heartbeat_task = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    @property
+    def http(self):
+        if self._http is None:
+            self._http = new_http_session(pool_size=10)
+        return self._http
+
+    def _headers(self):
+        if self.token:
+            return {'Authorization': f'Bearer {self.token}'}
+        return {}
+
+    async def request(self, method, path, json=None, params=None, expected=(200,)):
+        """Call the API and return the decoded JSON body, raise AitClientError otherwise"""
+        started = time.perf_counter()
+        status = None
         try:
-            response = self.session.post(
-                f'{self.server_url}/api/auth/login',
-                json={'username': self.username, 'password': self.password}
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                print(f"✅ Успешный вход: {data['user']['username']}")
-                return True
-            else:
-                print(f"❌ Ошибка входа: {response.json()['error']}")
-                return False
-                
-        except Exception as e:
-            print(f"❌ Ошибка подключения: {str(e)}")
-            return False
-    
-    def register(self, email):
+            async with self.http.request(
+                method,
+                f'{self.server_url}/api{path}',
+                json=json,
+                params=params,
+                headers=self._headers(),
+                timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT),
+            ) as response:
+                status = response.status
+                try:
+                    data = await response.json(content_type=None)
+                except ValueError:
+                    data = {}
+                if response.status not in expected:
+                    error = data.get('error') if isinstance(data, dict) else None
+                    retry_after = response.headers.get('Retry-After')
+                    raise AitClientError(response.status, error or response.reason,
+                                         int(retry_after) if retry_after and retry_after.isdigit() else None)
+                return data
+        finally:
+            if self.stats is not None:
+                # 4xx are answers (e.g. login before register), only 5xx and network errors count
+                self.stats.record(path, time.perf_counter() - started, status is not None and status < 500)
+
+    # ----- auth -----
+
+    async def login(self):
+        """Авторизоваться на сервере"""
+        data = await self.request('POST', '/auth/login', json={
+            'username': self.username,
+            'password': self.password
+        })
+        self.user = data['user']
+        self.token = self.user.get('token')
+        return self.user
+
+    async def register(self, email):
         """Зарегистрировать нового пользователя"""
+        data = await self.request('POST', '/auth/register', json={
+            'username': self.username,
+            'password': self.password,
+            'email': email
+        }, expected=(201,))
+        self.user = data['user']
+        self.token = self.user.get('token')
+        return self.user
+
+    async def ensure_account(self, email=None):
+        """Войти, а если пользователя нет - зарегистрировать"""
         try:
-            response = self.session.post(
-                f'{self.server_url}/api/auth/register',
-                json={
-                    'username': self.username,
-                    'password': self.password,
-                    'email': email
-                }
-            )
-            
-            if response.status_code == 201:
-                print(f"✅ Пользователь зарегистрирован: {self.username}")
-                return True
-            else:
-                print(f"❌ Ошибка регистрации: {response.json()['error']}")
-                return False
-                
-        except Exception as e:
-            print(f"❌ Ошибка: {str(e)}")
-            return False
-    
-    def connect_client(self, device_info=None):
-        """Подключить клиент"""
-        try:
-            response = self.session.post(
-                f'{self.server_url}/api/clients/connect',
-                json={
-                    'device_info': device_info or {'os': 'Windows', 'app': 'Alit Client'}
-                }
-            )
-            
-            if response.status_code == 201:
-                data = response.json()['session']
-                self.client_id = data['client_id']
-                self.session_id = data['session_id']
-                print(f"✅ Клиент подключен!")
-                print(f"   Client ID: {self.client_id}")
-                print(f"   IP адрес: {data['ip_address']}")
-                return True
-            else:
-                print(f"❌ Ошибка подключения: {response.json()['error']}")
-                return False
-                
-        except Exception as e:
-            print(f"❌ Ошибка: {str(e)}")
-            return False
-    
-    def send_heartbeat(self):
-        """Отправить heartbeat"""
+            return await self.login()
+        except AitClientError as e:
+            if e.status != 401:
+                raise
+        return await self.register(email or f'{self.username}@example.com')
+
+    async def logout(self):
+        await self.request('POST', '/auth/logout')
+        self.token = None
+
+    # ----- presence -----
+
+    async def connect_client(self, device_info=None, heartbeats=True):
+        """Подключить клиент и (по умолчанию) запустить фоновый heartbeat"""
+        data = await self.request('POST', '/clients/connect', json={
+            'device_info': device_info or {'os': sys.platform, 'app': 'Alit Client'}
+        }, expected=(201,))
+        session = data['session']
+        self.client_id = session['client_id']
+        self.session_id = session['session_id']
+        self.heartbeat_interval = session.get('heartbeat_interval', DEFAULT_HEARTBEAT_INTERVAL)
+
+        if heartbeats:
+            self.start_heartbeats()
+        return session
+
+    async def heartbeat(self):
+        """Отправить heartbeat (AitClientError 404 - клиент истёк на сервере)"""
         if not self.client_id:
-            return False
-            
-        try:
-            response = self.session.post(
-                f'{self.server_url}/api/clients/heartbeat',
-                json={'client_id': self.client_id}
-            )
-            
-            return response.status_code == 200
-            
-        except Exception as e:
-            print(f"❌ Heartbeat ошибка: {str(e)}")
-            return False
-    
-    def disconnect_client(self):
+            raise AitClientError(0, 'клиент не подключен')
+        await self.request('POST', '/clients/heartbeat', json={'client_id': self.client_id})
+
+    async def disconnect_client(self):
         """Отключить клиент"""
+        self.stop_heartbeats()
         if not self.client_id:
             return False
-            
+        client_id, self.client_id = self.client_id, None
         try:
-            response = self.session.post(
-                f'{self.server_url}/api/clients/disconnect',
-                json={'client_id': self.client_id}
-            )
-            
-            if response.status_code == 200:
-                print(f"✅ Клиент отключен")
-                return True
+            await self.request('POST', '/clients/disconnect', json={'client_id': client_id})
+        except AitClientError as e:
+            if e.status != 404:
+                raise
+        return True
+
+    def start_heartbeats(self):
+        if self._heartbeat_task is None or self._heartbeat_task.done():
+            self._heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+
+    def stop_heartbeats(self):
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+
+    async def _heartbeat_loop(self):
+        failures = 0
+        while True:
+            if failures:
+                await asyncio.sleep(backoff_delay(failures))
             else:
-                print(f"❌ Ошибка отключения: {response.json()['error']}")
-                return False
-                
-        except Exception as e:
-            print(f"❌ Ошибка: {str(e)}")
-            return False
-    
-    def get_server_info(self):
-        """Получить информацию о сервере"""
+                await asyncio.sleep(jittered(self.heartbeat_interval))
+
+            try:
+                if self.client_id:
+                    await self.heartbeat()
+                else:
+                    await self.connect_client(heartbeats=False)
+                failures = 0
+            except AitClientError as e:
+                if e.status == 404:
+                    # Expired on the server (sleep, restart) - register again
+                    self.client_id = None
+                    failures = 0
+                    continue
+                if e.status == 401:
+                    await self.login()
+                failures += 1
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                failures += 1
+
+    # ----- chat -----
+
+    @staticmethod
+    def _chat_path(room=None):
+        """'/chat' для общего чата, '/rooms/<room>' для остальных комнат"""
+        return '/chat' if room is None else f'/rooms/{room}'
+
+    async def list_rooms(self):
+        return (await self.request('GET', '/rooms'))['rooms']
+
+    async def create_room(self, name):
+        return await self.request('POST', '/rooms', json={'name': name}, expected=(201,))
+
+    async def send_message(self, content, room=None):
+        return await self.request('POST', f'{self._chat_path(room)}/messages', json={'content': content}, expected=(201,))
+
+    async def get_messages(self, limit=50, room=None):
+        return await self.request('GET', f'{self._chat_path(room)}/messages', params={'limit': limit})
+
+    async def delete_message(self, message_id, room=None):
+        return await self.request('DELETE', f'{self._chat_path(room)}/messages/{message_id}')
+
+    async def subscribe(self, last_event_id=None, room=None):
+        """Бесконечный поток событий чата (event_type, data); переподключается сам"""
+        attempt = 0
+        url = f'{self.server_url}/api{self._chat_path(room)}/stream'
+        while True:
+            headers = self._headers()
+            if last_event_id is not None:
+                headers['Last-Event-ID'] = str(last_event_id)
+            try:
+                async with self.http.get(url, headers=headers) as response:
+                    if response.status != 200:
+                        raise AitClientError(response.status, response.reason)
+                    attempt = 0
+
+                    event_id, event_type, data_lines = None, 'message', []
+                    async for raw in response.content:
+                        line = raw.decode('utf-8').rstrip('\r\n')
+                        if not line:
+                            if data_lines:
+                                if event_id is not None:
+                                    last_event_id = event_id
+                                yield event_type, _loads('\n'.join(data_lines))
+                            event_id, event_type, data_lines = None, 'message', []
+                        elif line.startswith(':'):
+                            continue  # keepalive
+                        else:
+                            field, _, value = line.partition(':')
+                            value = value[1:] if value.startswith(' ') else value
+                            if field == 'id':
+                                event_id = value
+                            elif field == 'event':
+                                event_type = value
+                            elif field == 'data':
+                                data_lines.append(value)
+            except (aiohttp.ClientError, asyncio.TimeoutError, AitClientError):
+                pass
+            await asyncio.sleep(backoff_delay(attempt))
+            attempt += 1
+
+    async def server_info(self):
+        return await self.request('GET', '/health')
+
+    async def close(self):
         try:
-            response = self.session.get(f'{self.server_url}/api/health')
-            
-            if response.status_code == 200:
-                data = response.json()
-                print("📊 Информация о сервере:")
-                print(f"   Статус: {data['status']}")
-                print(f"   Пользователей: {data['users_count']}")
-                print(f"   Сообщений: {data['messages_count']}")
-                print(f"   Активных клиентов: {data['active_clients']}")
-                print(f"   Активных сессий: {data['active_sessions']}")
-                return True
-            else:
-                print("❌ Ошибка получения информации")
-                return False
-                
-        except Exception as e:
-            print(f"❌ Ошибка: {str(e)}")
-            return False
+            await self.disconnect_client()
+        except (AitClientError, aiohttp.ClientError, asyncio.TimeoutError):
+            pass
+        if self._owns_http and self._http is not None:
+            await self._http.close()
+            self._http = None
+
+
+def _loads(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+# ============= SWARM =============
+
+class SwarmStats:
+    def __init__(self, window=10000):
+        self.requests = 0
+        self.errors = 0
+        self.events = 0
+        self.latencies = []
+        self.window = window
+
+    def record(self, path, latency, ok):
+        self.requests += 1
+        if not ok:
+            self.errors += 1
+        self.latencies.append(latency)
+        if len(self.latencies) > self.window:
+            del self.latencies[:len(self.latencies) - self.window]
+
+    def snapshot(self):
+        latencies = sorted(self.latencies)
+        p50 = statistics.median(latencies) * 1000 if latencies else 0.0
+        p95 = latencies[int(len(latencies) * 0.95)] * 1000 if latencies else 0.0
+        return self.requests, self.errors, self.events, p50, p95
+
+
+class Swarm:
+    """Many simulated clients over one shared connection pool"""
+
+    def __init__(self, server_url, size, prefix='swarm', password='swarm_password',
+                 pool_size=200, setup_concurrency=50, message_interval=None,
+                 subscribers=0, batch_heartbeats=False):
+        self.server_url = server_url
+        self.size = size
+        self.prefix = prefix
+        self.password = password
+        self.pool_size = pool_size
+        self.setup_concurrency = setup_concurrency
+        self.message_interval = message_interval
+        self.subscribers = subscribers
+        self.batch_heartbeats = batch_heartbeats
+        self.stats = SwarmStats()
+        self.clients = []
+        self._tasks = []
+
+    async def _start_client(self, http, index, gate):
+        client = AitClient(self.server_url, f'{self.prefix}_{index:05d}', self.password,
+                           http=http, stats=self.stats)
+        async with gate:
+            await client.ensure_account()
+            await client.connect_client(
+                device_info={'os': sys.platform, 'app': 'Alit Swarm', 'index': index},
+                heartbeats=not self.batch_heartbeats
+            )
+        return client
+
+    async def _batched_heartbeats(self, http):
+        """One request per chunk of clients instead of one per client"""
+        beater = AitClient(self.server_url, '', '', http=http, stats=self.stats)
+        interval = self.clients[0].heartbeat_interval if self.clients else DEFAULT_HEARTBEAT_INTERVAL
+        while True:
+            await asyncio.sleep(jittered(interval))
+            ids = [c.client_id for c in self.clients if c.client_id]
+            for i in range(0, len(ids), 1000):
+                try:
+                    data = await beater.request('POST', '/clients/heartbeat', json={'client_ids': ids[i:i + 1000]})
+                except (AitClientError, aiohttp.ClientError, asyncio.TimeoutError):
+                    continue
+                expired = set(data.get('unknown', []))
+                for client in self.clients:
+                    if client.client_id in expired:
+                        client.client_id = None
+                        asyncio.create_task(client.connect_client(heartbeats=False))
+
+    async def _chatter(self, client):
+        while True:
+            await asyncio.sleep(jittered(self.message_interval, 0.5))
+            try:
+                await client.send_message(f'swarm ping от {client.username}')
+            except (AitClientError, aiohttp.ClientError, asyncio.TimeoutError):
+                pass
+
+    async def _listen(self, client):
+        async for _ in client.subscribe():
+            self.stats.events += 1
 
+    async def _report(self, started):
+        while True:
+            await asyncio.sleep(5)
+            requests_, errors, events, p50, p95 = self.stats.snapshot()
+            connected = sum(1 for c in self.clients if c.client_id)
+            print(f"⏱️  {time.time() - started:6.0f}s  клиентов: {connected}/{self.size}  "
+                  f"запросов: {requests_}  ошибок: {errors}  событий: {events}  "
+                  f"p50: {p50:.1f} мс  p95: {p95:.1f} мс", flush=True)
 
-def main():
+    async def run(self, duration):
+        started = time.time()
+        async with new_http_session(pool_size=self.pool_size + self.subscribers) as http:
+            gate = asyncio.Semaphore(self.setup_concurrency)
+            print(f"🐝 Подключение {self.size} клиентов...", flush=True)
+            results = await asyncio.gather(
+                *(self._start_client(http, i, gate) for i in range(self.size)),
+                return_exceptions=True
+            )
+            self.clients = [c for c in results if isinstance(c, AitClient)]
+            failed = len(results) - len(self.clients)
+            print(f"✅ Подключено: {len(self.clients)}, ошибок: {failed} "
+                  f"({time.time() - started:.1f}s)", flush=True)
+
+            self._tasks.append(asyncio.create_task(self._report(started)))
+            if self.batch_heartbeats:
+                self._tasks.append(asyncio.create_task(self._batched_heartbeats(http)))
+            if self.message_interval:
+                self._tasks.extend(asyncio.create_task(self._chatter(c)) for c in self.clients)
+            self._tasks.extend(asyncio.create_task(self._listen(c)) for c in self.clients[:self.subscribers])
+
+            try:
+                await asyncio.sleep(duration)
+            finally:
+                for task in self._tasks:
+                    task.cancel()
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+                print("🔌 Отключение клиентов...", flush=True)
+                await asyncio.gather(*(c.close() for c in self.clients), return_exceptions=True)
+
+        requests_, errors, events, p50, p95 = self.stats.snapshot()
+        print(f"📊 Итого: запросов {requests_}, ошибок {errors}, событий {events}, "
+              f"p50 {p50:.1f} мс, p95 {p95:.1f} мс")
+
+
+# ============= INTERACTIVE CLIENT =============
+
+async def ask(prompt):
+    return (await asyncio.get_running_loop().run_in_executor(None, input, prompt)).strip()
+
+
+async def print_server_info(client):
+    """Получить информацию о сервере"""
+    try:
+        data = await client.server_info()
+        print("📊 Информация о сервере:")
+        print(f"   Статус: {data['status']}")
+        print(f"   Пользователей: {data['users_count']}")
+        print(f"   Сообщений: {data['messages_count']}")
+        print(f"   Активных клиентов: {data['active_clients']}")
+        print(f"   Активных сессий: {data['active_sessions']}")
+    except Exception as e:
+        print(f"❌ Ошибка: {str(e)}")
+
+
+async def interactive():
     print("=" * 70)
     print("Alit Chat Client Connector")
     print("=" * 70)
-    
+
     # Получить параметры
-    server_url = input("🖥️  Введите адрес сервера (например http://192.168.1.100:5000): ").strip()
-    username = input("👤 Введите имя пользователя: ").strip()
-    
-    # Попытка входа
-    password = input("🔐 Введите пароль: ").strip()
-    
-    connector = AitClientConnector(server_url, username, password)
-    
-    # Пробуем войти, если не получается - регистрируемся
-    print("\n🔄 Попытка входа...")
-    if not connector.login():
-        print("\n📝 Регистрация нового пользователя...")
-        email = input("📧 Введите email: ").strip()
-        if not connector.register(email):
+    server_url = await ask("🖥️  Введите адрес сервера (например http://192.168.1.100:5000): ")
+    username = await ask("👤 Введите имя пользователя: ")
+    password = await ask("🔐 Введите пароль: ")
+
+    async with AitClient(server_url, username, password) as client:
+        # Пробуем войти, если не получается - регистрируемся
+        print("\n🔄 Попытка входа...")
+        try:
+            await client.login()
+            print(f"✅ Успешный вход: {client.username}")
+        except AitClientError as e:
+            if e.status != 401:
+                print(f"❌ Ошибка входа: {e.message}")
+                return
+            print("\n📝 Регистрация нового пользователя...")
+            email = await ask("📧 Введите email: ")
+            try:
+                await client.register(email)
+                print(f"✅ Пользователь зарегистрирован: {client.username}")
+            except AitClientError as e:
+                print(f"❌ Ошибка регистрации: {e.message}")
+                return
+        except aiohttp.ClientError as e:
+            print(f"❌ Ошибка подключения: {str(e)}")
             return
-        
-        if not connector.login():
-            print("❌ Не удалось войти после регистрации")
+
+        # Подключить клиент (heartbeat работает в фоне)
+        print("\n🔗 Подключение клиента...")
+        try:
+            session = await client.connect_client()
+            print("✅ Клиент подключен!")
+            print(f"   Client ID: {client.client_id}")
+            print(f"   IP адрес: {session['ip_address']}")
+            print(f"   Heartbeat: каждые ~{client.heartbeat_interval} сек (автоматически)")
+        except AitClientError as e:
+            print(f"❌ Ошибка подключения: {e.message}")
             return
-    
-    # Подключить клиент
-    print("\n🔗 Подключение клиента...")
-    if not connector.connect_client():
-        return
-    
-    # Получить информацию о сервере
-    print()
-    connector.get_server_info()
-    
-    # Меню
-    print("\n" + "=" * 70)
-    print("✅ Успешно подключены! Что дальше?")
-    print("=" * 70)
-    print("1. Отправить heartbeat")
-    print("2. Получить информацию о сервере")
-    print("3. Отключиться")
-    print("0. Выход")
-    print("=" * 70)
-    
-    while True:
-        choice = input("\n📌 Выберите действие (0-3): ").strip()
-        
-        if choice == '0':
-            print("До свидания!")
-            break
-        elif choice == '1':
-            if connector.send_heartbeat():
-                print("✅ Heartbeat отправлен")
+
+        print()
+        await print_server_info(client)
+
+        # Меню
+        print("\n" + "=" * 70)
+        print("✅ Успешно подключены! Что дальше?")
+        print("=" * 70)
+        print("1. Отправить сообщение в чат")
+        print("2. Последние сообщения")
+        print("3. Получить информацию о сервере")
+        print("4. Отключиться")
+        print("0. Выход")
+        print("=" * 70)
+
+        while True:
+            choice = await ask("\n📌 Выберите действие (0-4): ")
+
+            if choice == '0':
+                print("До свидания!")
+                break
+            elif choice == '1':
+                content = await ask("💬 Сообщение: ")
+                try:
+                    await client.send_message(content)
+                    print("✅ Сообщение отправлено")
+                except AitClientError as e:
+                    print(f"❌ Ошибка: {e.message}")
+            elif choice == '2':
+                try:
+                    for msg in await client.get_messages(limit=10):
+                        print(f"   👤 {msg['username']}: {msg['content'][:60]}")
+                except AitClientError as e:
+                    print(f"❌ Ошибка: {e.message}")
+            elif choice == '3':
+                await print_server_info(client)
+            elif choice == '4':
+                await client.disconnect_client()
+                print("✅ Клиент отключен")
+                break
             else:
-                print("❌ Ошибка отправки heartbeat")
-        elif choice == '2':
-            connector.get_server_info()
-        elif choice == '3':
-            connector.disconnect_client()
-            break
+                print("❌ Неверный выбор")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Alit Chat client')
+    commands = parser.add_subparsers(dest='command')
+
+    swarm = commands.add_parser('swarm', help='simulate many clients from one process')
+    swarm.add_argument('server_url')
+    swarm.add_argument('--clients', type=int, default=1000)
+    swarm.add_argument('--duration', type=float, default=60, help='seconds to keep clients connected')
+    swarm.add_argument('--prefix', default='swarm', help='username prefix for simulated users')
+    swarm.add_argument('--password', default='swarm_password')
+    swarm.add_argument('--pool-size', type=int, default=200, help='shared HTTP connection pool size')
+    swarm.add_argument('--setup-concurrency', type=int, default=50)
+    swarm.add_argument('--message-interval', type=float, default=None,
+                       help='each client posts a message about this often (seconds)')
+    swarm.add_argument('--subscribers', type=int, default=0, help='clients that hold /api/chat/stream open')
+    swarm.add_argument('--batch-heartbeats', action='store_true',
+                       help='send heartbeats for all clients in batched requests')
+
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'swarm':
+            asyncio.run(Swarm(
+                args.server_url, args.clients,
+                prefix=args.prefix,
+                password=args.password,
+                pool_size=args.pool_size,
+                setup_concurrency=args.setup_concurrency,
+                message_interval=args.message_interval,
+                subscribers=args.subscribers,
+                batch_heartbeats=args.batch_heartbeats,
+            ).run(args.duration))
         else:
-            print("❌ Неверный выбор")
+            asyncio.run(interactive())
+    except KeyboardInterrupt:
+        print("\nДо свидания!")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,81 @@
+"""
+Background compaction of the message logs (see MessageStore.compact)
+
+Every serving process runs one thread (started on first request) that
+checks the logs of the loaded rooms each `interval` seconds and compacts a
+log once it is at least `min_bytes` and either `ratio` of its records are
+dead (deleted or superseded) or it holds messages older than `max_age`
+seconds (0 = keep forever). The trigger is re-checked under the log's
+compaction lock, so when several workers notice at once only the first
+one rewrites it. `manage_server.py compact` does the same on demand.
+"""
+
+import os
+import threading
+
+DEFAULT_INTERVAL = 10 * 60
+DEFAULT_RATIO = 0.3
+DEFAULT_MIN_BYTES = 4 * 1024 * 1024
+
+
+class Compactor:
+    def __init__(self, stores, interval=DEFAULT_INTERVAL, ratio=DEFAULT_RATIO, min_bytes=DEFAULT_MIN_BYTES,
+                 max_age=0):
+        self.stores = stores            # () -> the MessageStores to look after
+        self.interval = interval
+        self.ratio = ratio
+        self.min_bytes = min_bytes
+        self.max_age = max_age or None
+        self._reset_process_state()
+
+    def _reset_process_state(self):
+        self._lock = threading.Lock()
+        self._scheduler_pid = None
+        self._stop = threading.Event()
+        self.runs = 0
+        self.bytes_saved = 0
+        self.last_error = None
+
+    def due(self, store):
+        return store.needs_compaction(self.ratio, self.min_bytes, self.max_age)
+
+    def compact(self, store, force=False):
+        """Compact one log (if due, unless `force`); return the report or None"""
+        report = store.compact(max_age=self.max_age, only_if=None if force else self.due)
+        if report is not None:
+            with self._lock:
+                self.runs += 1
+                self.bytes_saved += report['before']['bytes'] - report['after']['bytes']
+        return report
+
+    def ensure_scheduler(self):
+        """Start this process's compaction thread (threads don't survive a fork)"""
+        if self._scheduler_pid == os.getpid() or not self.interval:
+            return
+        with self._lock:
+            if self._scheduler_pid == os.getpid():
+                return
+            self._scheduler_pid = os.getpid()
+        threading.Thread(target=self._schedule_loop, name='compaction', daemon=True).start()
+
+    def _schedule_loop(self):
+        while not self._stop.wait(self.interval):
+            for store in self.stores():
+                try:
+                    if self.due(store):
+                        self.compact(store)
+                    self.last_error = None
+                except OSError as e:
+                    self.last_error = str(e)  # e.g. disk full: the old segments are untouched
+                except Exception as e:
+                    # A bad log must not stop compaction of the others, now or later
+                    self.last_error = f'{type(e).__name__}: {e}'
+
+    def stats(self):
+        return {'runs': self.runs, 'bytes_saved': self.bytes_saved, 'error': self.last_error}
+
+    def close(self):
+        self._stop.set()
+
+    def after_fork(self):
+        self._reset_process_state()
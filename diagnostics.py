@@ -2,18 +2,52 @@
 """
 🔍 ДИАГНОСТИКА СИСТЕМЫ
 Проверяет готовность приложения к запуску
+
+    python diagnostics.py          проверка файлов и зависимостей
+    python diagnostics.py --perf   замеры производительности и оценка ёмкости
 """
 
+import argparse
+import json
 import os
+import statistics
 import sys
 import subprocess
+import time
+import urllib.request
+from datetime import datetime
 from pathlib import Path
 
+PERF_APPENDS = 200
+PERF_FSYNCS = 30
+PERF_PINGS = 5
+SAMPLE_BYTES = 8 * 1024 * 1024
+LOAD_TIME_LIMIT = 1.0       # секунд на чтение данных при старте
+WARN_DAYS = 90              # предупреждать, если лимит будет достигнут раньше
+
+def percentile(values, share):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+def format_ms(seconds):
+    return f"{seconds * 1000:.2f} мс"
+
+
+def parse_timestamp(value):
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
 class SystemDiagnostics:
     def __init__(self):
         self.app_dir = Path(__file__).parent
         self.checks_passed = 0
         self.checks_failed = 0
+        self.perf = {}
+        self.warnings = []
         
     def print_header(self):
         print("\n" + "=" * 70)
@@ -96,7 +130,7 @@ class SystemDiagnostics:
         
         if exists:
             users_file = data_dir / "users.json"
-            messages_file = data_dir / "messages.json"
+            messages_dir = data_dir / "messages"
             
             if users_file.exists():
                 size = users_file.stat().st_size
@@ -104,11 +138,14 @@ class SystemDiagnostics:
             else:
                 self.print_check("users.json", False, "Будет создан при запуске")
             
-            if messages_file.exists():
-                size = messages_file.stat().st_size
-                self.print_check("messages.json", True, f"Размер: {size} байт")
+            segments = sorted(messages_dir.glob("segment-*.jsonl")) if messages_dir.exists() else []
+            if segments:
+                size = sum(segment.stat().st_size for segment in segments)
+                self.print_check("messages/", True, f"Сегментов: {len(segments)}, размер: {size} байт")
+            elif (data_dir / "messages.json").exists():
+                self.print_check("messages.json", True, "Будет перенесён в messages/ при запуске")
             else:
-                self.print_check("messages.json", False, "Будет создан при запуске")
+                self.print_check("messages/", False, "Будет создан при первом сообщении")
     
     def check_scripts(self):
         """Проверить скрипты запуска"""
@@ -171,6 +208,269 @@ class SystemDiagnostics:
             exists = path.exists()
             self.print_check(doc, exists, description)
     
+    # ============= РЕЖИМ --perf =============
+
+    def load_config(self):
+        try:
+            with open(self.app_dir / 'config.json', 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def data_dir(self):
+        data_dir = Path(self.load_config().get('data', {}).get('data_dir', './data'))
+        return data_dir if data_dir.is_absolute() else (self.app_dir / data_dir).resolve()
+
+    def perf_disk(self):
+        """Задержка дозаписи и fsync в папке данных"""
+        print("💽 Диск (папка данных)...\n")
+        data_dir = self.data_dir()
+        data_dir.mkdir(parents=True, exist_ok=True)
+        probe = data_dir / f'.perf-{os.getpid()}.tmp'
+        line = (json.dumps({'id': '0' * 36, 'username': 'perf', 'content': 'x' * 120}) + '\n').encode('utf-8')
+        appends, fsyncs = [], []
+        fd = os.open(probe, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            for _ in range(PERF_APPENDS):
+                started = time.perf_counter()
+                os.write(fd, line)
+                appends.append(time.perf_counter() - started)
+            for _ in range(PERF_FSYNCS):
+                os.write(fd, line)
+                started = time.perf_counter()
+                os.fsync(fd)
+                fsyncs.append(time.perf_counter() - started)
+        finally:
+            os.close(fd)
+            probe.unlink()
+
+        self.perf['append_p50'] = statistics.median(appends)
+        self.perf['append_p99'] = percentile(appends, 0.99)
+        self.perf['fsync_p50'] = statistics.median(fsyncs)
+        self.perf['fsync_p99'] = percentile(fsyncs, 0.99)
+        self.print_check("Дозапись строки", True,
+                         f"p50 {format_ms(self.perf['append_p50'])}, p99 {format_ms(self.perf['append_p99'])}")
+        slow_fsync = self.perf['fsync_p50'] > 0.02
+        self.print_check("fsync", not slow_fsync,
+                         f"p50 {format_ms(self.perf['fsync_p50'])}, p99 {format_ms(self.perf['fsync_p99'])}")
+        if slow_fsync:
+            self.warnings.append("fsync медленнее 20 мс: не включайте fsync на каждую запись")
+
+    def perf_data(self):
+        """Размеры файлов данных, время их чтения и прогноз роста"""
+        print("\n📈 Данные...\n")
+        from storage import parse_key
+
+        data_dir = self.data_dir()
+        users_file = data_dir / 'users.json'
+        if users_file.exists():
+            size = users_file.stat().st_size
+            started = time.perf_counter()
+            with open(users_file, 'r', encoding='utf-8') as f:
+                users = json.load(f)
+            elapsed = time.perf_counter() - started
+            self.perf['users'] = {'bytes': size, 'count': len(users), 'parse': elapsed}
+            self.print_check("users.json", elapsed < 0.05,
+                             f"{len(users)} пользователей, {size} байт, разбор {format_ms(elapsed)}")
+            if elapsed >= 0.05:
+                self.warnings.append(f"users.json разбирается {format_ms(elapsed)} - это время добавляется "
+                                     "к каждому запросу, который читает пользователей")
+            created = [parse_timestamp(u.get('created_at')) for u in users.values() if isinstance(u, dict)]
+            self.project_growth("users.json", size, elapsed / max(size, 1), [c for c in created if c])
+        else:
+            self.print_check("users.json", True, "ещё не создан")
+
+        logs = {'messages': data_dir / 'messages'}
+        rooms_dir = data_dir / 'rooms'
+        if rooms_dir.is_dir():
+            logs.update({f'rooms/{p.name}': p for p in sorted(rooms_dir.iterdir()) if p.is_dir()})
+        for name, directory in logs.items():
+            segments = sorted(directory.glob('segment-*.jsonl')) if directory.is_dir() else []
+            if not segments:
+                continue
+            size = sum(segment.stat().st_size for segment in segments)
+            # Индексация при старте: разбор ключей по строкам, скорость по образцу
+            sampled, lines, first, last = 0, 0, None, None
+            started = time.perf_counter()
+            for segment in segments:
+                with open(segment, 'rb') as f:
+                    for raw in f:
+                        parse_key(raw)
+                        lines += 1
+                        sampled += len(raw)
+                        if first is None:
+                            first = raw
+                        if sampled >= SAMPLE_BYTES:
+                            break
+                if sampled >= SAMPLE_BYTES:
+                    break
+            per_byte = (time.perf_counter() - started) / max(sampled, 1)
+            with open(segments[-1], 'rb') as f:
+                f.seek(max(0, segments[-1].stat().st_size - 4096))
+                tail = f.read().splitlines()
+                last = tail[-1] if tail else None
+            estimate = per_byte * size
+            self.perf[name] = {'bytes': size, 'segments': len(segments), 'index_estimate': estimate}
+            self.print_check(f"{name}/", estimate < LOAD_TIME_LIMIT,
+                             f"{len(segments)} сегм., {size} байт, индексация ~{format_ms(estimate)}")
+            dates = [parse_timestamp(self.record_time(line)) for line in (first, last)]
+            self.project_growth(f"Журнал {name}", size, per_byte, [d for d in dates if d])
+
+        legacy = data_dir / 'messages.json'
+        if legacy.exists():
+            self.warnings.append("messages.json ещё не перенесён в messages/ - перенос выполнится при запуске")
+
+    @staticmethod
+    def record_time(line):
+        try:
+            record = json.loads(line)
+            return record.get('timestamp') or record.get('at')
+        except (TypeError, ValueError):
+            return None
+
+    def project_growth(self, label, size, seconds_per_byte, dates):
+        """Предупредить, если время загрузки превысит LOAD_TIME_LIMIT при текущем росте"""
+        limit_bytes = LOAD_TIME_LIMIT / seconds_per_byte if seconds_per_byte else float('inf')
+        if size >= limit_bytes:
+            self.warnings.append(f"{label} уже грузится дольше {LOAD_TIME_LIMIT:.0f} с")
+            return
+        if len(dates) < 2:
+            return
+        days = (max(dates) - min(dates)).total_seconds() / 86400
+        if days < 1:
+            return
+        per_day = size / days
+        left = (limit_bytes - size) / per_day
+        self.perf.setdefault('growth', {})[label] = {'bytes_per_day': per_day, 'days_to_limit': left}
+        if left <= WARN_DAYS:
+            self.warnings.append(f"{label} превысит {LOAD_TIME_LIMIT:.0f} с загрузки примерно через "
+                                 f"{left:.0f} дн. при текущем росте ({per_day / 1024:.0f} КБ/день)")
+
+    def perf_import(self):
+        """Время импорта server.py и создания приложения (в отдельном процессе)"""
+        print("\n🐍 Запуск сервера...\n")
+        code = ('import time; t = time.perf_counter(); import server; i = time.perf_counter() - t; '
+                't = time.perf_counter(); server.create_app(); print(i, time.perf_counter() - t)')
+        try:
+            out = subprocess.run([sys.executable, '-c', code], cwd=self.app_dir, capture_output=True,
+                                 text=True, timeout=60)
+            import_time, create_time = map(float, out.stdout.split()[-2:])
+        except (subprocess.SubprocessError, ValueError):
+            self.print_check("import server", False, "не удалось импортировать server.py")
+            return
+        self.perf['import_server'] = import_time
+        self.perf['create_app'] = create_time
+        self.print_check("import server", import_time < 1.0, format_ms(import_time))
+        self.print_check("create_app()", create_time < 1.0, format_ms(create_time))
+
+    def ollama_url(self, url=None):
+        url = url or os.environ.get('OLLAMA_URL', '').split(',')[0].strip()
+        ai = self.load_config().get('ai', {})
+        return (url or (ai.get('backends') or [None])[0] or ai.get('ollama_url')
+                or 'http://localhost:11434').rstrip('/')
+
+    def perf_ollama(self, url=None, model='mistral'):
+        """Задержка до Ollama (или fake_ollama.py) и время до первого токена"""
+        url = self.ollama_url(url)
+        print(f"\n🤖 Ollama ({url})...\n")
+        pings = []
+        try:
+            for _ in range(PERF_PINGS):
+                started = time.perf_counter()
+                with urllib.request.urlopen(f'{url}/api/tags', timeout=5) as response:
+                    response.read()
+                pings.append(time.perf_counter() - started)
+        except OSError as e:
+            self.print_check("Ollama отвечает", False, str(e))
+            return
+        self.perf['ollama_rtt'] = statistics.median(pings)
+        self.print_check("Ollama отвечает", True, f"/api/tags p50 {format_ms(self.perf['ollama_rtt'])}")
+
+        body = json.dumps({'model': model, 'stream': True,
+                           'messages': [{'role': 'user', 'content': 'Привет! Ответь одним словом.'}],
+                           'options': {'num_predict': 32}}).encode('utf-8')
+        request = urllib.request.Request(f'{url}/api/chat', data=body,
+                                         headers={'Content-Type': 'application/json'})
+        started = time.perf_counter()
+        first = final = None
+        try:
+            with urllib.request.urlopen(request, timeout=120) as response:
+                for line in response:
+                    if first is None:
+                        first = time.perf_counter() - started
+                    if line.strip():
+                        chunk = json.loads(line)
+                        if chunk.get('done'):
+                            final = chunk
+        except (OSError, ValueError) as e:
+            self.print_check(f"Генерация ({model})", False, str(e))
+            return
+        total = time.perf_counter() - started
+        self.perf['ollama_ttft'] = first
+        self.perf['ollama_total'] = total
+        rate = None
+        if final and final.get('eval_duration'):
+            rate = final.get('eval_count', 0) / (final['eval_duration'] / 1e9)
+            self.perf['ollama_tokens_per_s'] = rate
+        self.print_check(f"Первый токен ({model})", first is not None and first < 5,
+                         f"{format_ms(first or 0)}, весь ответ {format_ms(total)}"
+                         + (f", {rate:.1f} ток/с" if rate else ""))
+
+    def perf_workers(self, workers=None, threads=None):
+        """Ядра процессора и настроенные воркеры"""
+        print("\n⚙️  Воркеры...\n")
+        from supervisor import DEFAULT_THREADS, default_workers
+
+        cpus = os.cpu_count() or 1
+        workers = workers or default_workers()
+        threads = threads or DEFAULT_THREADS
+        self.perf.update(cpus=cpus, workers=workers, threads=threads)
+        too_many = workers > cpus * 2
+        self.print_check("Воркеры и ядра", not too_many,
+                         f"ядер: {cpus}, воркеров: {workers} × {threads} потоков")
+        if too_many:
+            self.warnings.append(f"воркеров ({workers}) больше, чем 2 × ядер ({cpus}): они будут "
+                                 "вытеснять друг друга")
+
+    def print_capacity(self):
+        """Оценка ёмкости по замерам"""
+        print("\n" + "=" * 70)
+        print("📐 ОЦЕНКА ЁМКОСТИ")
+        print("=" * 70 + "\n")
+        perf = self.perf
+        if 'append_p50' in perf:
+            # Запись в журнал идёт под одной блокировкой на все воркеры
+            print(f"💬 Сообщений в секунду (одна комната): ~{1 / max(perf['append_p99'], 1e-6):.0f}, "
+                  f"с fsync на каждую: ~{1 / max(perf['fsync_p50'], 1e-6):.0f}")
+        if 'workers' in perf:
+            print(f"🧵 Одновременных запросов: {perf['workers'] * perf['threads']} "
+                  f"(каждый открытый SSE-поток занимает один)")
+        if perf.get('ollama_total'):
+            per_minute = 60 / perf['ollama_total']
+            print(f"🤖 AI-ответов в минуту на один сервер Ollama (короткие ответы): ~{per_minute:.0f}")
+        for label, growth in perf.get('growth', {}).items():
+            print(f"📈 {label}: +{growth['bytes_per_day'] / 1024:.0f} КБ/день, "
+                  f"до {LOAD_TIME_LIMIT:.0f} с загрузки ~{growth['days_to_limit']:.0f} дн.")
+        if self.warnings:
+            print()
+            for warning in self.warnings:
+                print(f"⚠️  {warning}")
+        print()
+
+    def run_perf(self, ollama_url=None, model='mistral', workers=None, threads=None, as_json=False):
+        """Режим --perf"""
+        self.print_header()
+        self.perf_disk()
+        self.perf_data()
+        self.perf_import()
+        self.perf_ollama(ollama_url, model)
+        self.perf_workers(workers, threads)
+        self.print_capacity()
+        if as_json:
+            print(json.dumps({'perf': self.perf, 'warnings': self.warnings}, ensure_ascii=False, indent=2,
+                             default=str))
+        return 0 if not self.warnings else 1
+
     def print_summary(self):
         """Вывести итоги"""
         print("\n" + "=" * 70)
@@ -209,8 +509,22 @@ class SystemDiagnostics:
         
         return 0 if success else 1
 
+def build_parser():
+    parser = argparse.ArgumentParser(description='Диагностика AI Chat Assistant')
+    parser.add_argument('--perf', action='store_true', help='замеры производительности и оценка ёмкости')
+    parser.add_argument('--ollama-url', help='Ollama или fake_ollama.py (по умолчанию OLLAMA_URL / config.json)')
+    parser.add_argument('--model', default='mistral', help='модель для замера первого токена')
+    parser.add_argument('--workers', type=int, help='сколько воркеров планируется (по умолчанию по числу ядер)')
+    parser.add_argument('--threads', type=int, help='потоков на воркер')
+    parser.add_argument('--json', action='store_true', help='в конце вывести результаты в JSON')
+    return parser
+
 if __name__ == "__main__":
+    args = build_parser().parse_args()
     diag = SystemDiagnostics()
+    if args.perf:
+        sys.exit(diag.run_perf(args.ollama_url, args.model, args.workers, args.threads, args.json))
+
     exit_code = diag.run()
     
     input("Нажмите Enter для выхода...")
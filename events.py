@@ -0,0 +1,158 @@
+"""
+In-process chat event hub for the real-time stream (/api/chat/stream)
+
+Events get increasing integer ids and are kept in a short history ring.
+Subscribers don't have their own queues: each one holds a cursor (the last
+id it has seen) and waits on a shared condition, so publishing is O(1) no
+matter how many streams are open. A subscriber that falls further behind
+than the history gets a single `resync` event and should refetch.
+
+With a shared bus (pubsub.EventBus) the ids come from the bus instead and
+are the same in every worker, so they are increasing but not consecutive.
+Events arrive in batches through deliver(), and a subscriber that fell
+behind the ring is first replayed from the bus through `backfill`.
+
+Ephemeral events (typing indicators) bypass all of that: they have no id,
+are never stored or sent to the bus, and only the latest one of each type
+is kept. A subscriber gets the latest of each type that changed since its
+last read, so a burst of updates reaches it as one frame.
+"""
+
+import json
+import threading
+from collections import deque
+
+DEFAULT_HISTORY = 256
+
+
+class ChatEvent:
+    __slots__ = ('id', 'type', 'data')
+
+    def __init__(self, event_id, event_type, data):
+        self.id = event_id
+        self.type = event_type
+        self.data = data
+
+    def to_sse(self):
+        """Encode as a Server-Sent Events frame (without an id if ephemeral)"""
+        payload = json.dumps(self.data, ensure_ascii=False)
+        if self.id is None:
+            return f'event: {self.type}\ndata: {payload}\n\n'
+        return f'id: {self.id}\nevent: {self.type}\ndata: {payload}\n\n'
+
+
+class EventHub:
+    def __init__(self, history=DEFAULT_HISTORY, start_id=0, head=None, backfill=None):
+        self._history = deque(maxlen=history)
+        self._last_id = start_id
+        # Every event up to here has left the ring (or predates this hub)
+        self._floor = start_id
+        self._cond = threading.Condition()
+        self.head = head            # () -> newest id known anywhere, if ids are shared
+        self.backfill = backfill    # (after, upto) -> [ChatEvent] or None if gone
+        self._ephemeral = {}        # type -> (version, ChatEvent), the latest of each
+        self._ephemeral_version = 0
+
+    @property
+    def last_id(self):
+        return self._last_id
+
+    def _append(self, event):
+        if len(self._history) == self._history.maxlen:
+            self._floor = self._history[0].id
+        self._history.append(event)
+        self._last_id = event.id
+
+    def start_at(self, event_id):
+        """Continue after `event_id` (an empty hub joining a shared bus)"""
+        with self._cond:
+            if not self._history:
+                self._last_id = self._floor = event_id
+
+    def publish(self, event_type, data):
+        with self._cond:
+            event = ChatEvent(self._last_id + 1, event_type, data)
+            self._append(event)
+            self._cond.notify_all()
+        return event
+
+    def publish_ephemeral(self, event_type, data):
+        """Replace the latest `event_type` event; not stored, no id, this process only"""
+        with self._cond:
+            self._ephemeral_version += 1
+            self._ephemeral[event_type] = (self._ephemeral_version, ChatEvent(None, event_type, data))
+            self._cond.notify_all()
+
+    def deliver(self, events):
+        """Add events that already have ids (from the bus); one wakeup per batch
+
+        Events at or below the last id are ones this hub already has (the
+        bus delivers at least once) and are skipped.
+        """
+        with self._cond:
+            fresh = False
+            for event in events:
+                if event.id > self._last_id:
+                    self._append(event)
+                    fresh = True
+            if fresh:
+                self._cond.notify_all()
+
+    def subscribe(self, last_event_id=None):
+        """Start a subscription; resume after `last_event_id` if given"""
+        try:
+            cursor = int(last_event_id)
+        except (TypeError, ValueError):
+            cursor = self._last_id
+        # An id from the future (e.g. before a restart) can't be resumed.
+        # With shared ids it may just not have reached this worker yet.
+        if cursor > self._last_id and (self.head is None or cursor > self.head()):
+            cursor = self._last_id
+        return Subscription(self, cursor)
+
+    def _ephemeral_after(self, version):
+        return [event for seen, event in self._ephemeral.values() if seen > version]
+
+    def _events_after(self, cursor):
+        """Events newer than cursor, or None if the history no longer reaches it"""
+        if cursor >= self._last_id:
+            return []
+        if cursor < self._floor:
+            return None
+        # Subscribers are nearly always close to the end: walk back from there
+        start = len(self._history)
+        while start > 0 and self._history[start - 1].id > cursor:
+            start -= 1
+        return [self._history[i] for i in range(start, len(self._history))]
+
+
+class Subscription:
+    def __init__(self, hub, cursor):
+        self.hub = hub
+        self.cursor = cursor
+        self.ephemeral_seen = 0     # so a new subscriber gets the current state first
+
+    def get(self, timeout=None):
+        """Wait up to `timeout` seconds and return all pending events (maybe [])"""
+        hub = self.hub
+        with hub._cond:
+            if self.cursor >= hub._last_id and self.ephemeral_seen >= hub._ephemeral_version:
+                hub._cond.wait_for(lambda: self.cursor < hub._last_id
+                                   or self.ephemeral_seen < hub._ephemeral_version, timeout)
+            events = hub._events_after(self.cursor)
+            last_id = hub._last_id
+            ephemeral = hub._ephemeral_after(self.ephemeral_seen)
+            self.ephemeral_seen = hub._ephemeral_version
+
+        if events is None and hub.backfill is not None:
+            # Fell behind the ring: replay the gap from the bus (outside the
+            # lock), a page at a time; nothing in the gap means we're caught up
+            events = hub.backfill(self.cursor, last_id)
+            if events == []:
+                self.cursor = last_id
+        if events is None:
+            self.cursor = last_id
+            return [ChatEvent(last_id, 'resync', {'last_event_id': last_id}), *ephemeral]
+        if events:
+            self.cursor = events[-1].id
+        return events + ephemeral
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Fake Ollama - локальная замена Ollama для бенчмарков и тестов
+Отдаёт /api/chat и /api/tags без настоящей модели: задержка, скорость
+генерации токенов, потоковые и обычные ответы, инъекция ошибок.
+
+    python fake_ollama.py --port 11435 --latency 0.2 --token-rate 50
+    OLLAMA_URL=http://localhost:11435 python server.py
+
+    python fake_ollama.py --port 11435 --count 3      # 11435, 11436, 11437
+    OLLAMA_URL=http://localhost:11435,http://localhost:11436,http://localhost:11437 python server.py
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_PORT = 11435
+DEFAULT_MODELS = ['mistral']
+DEFAULT_REPLY = 'Привет! Я тестовая модель Alit, отвечаю без настоящей нейросети.'
+
+
+class FakeOllamaConfig:
+    """Tunable behaviour of the stand-in server"""
+
+    def __init__(self, latency=0.0, token_rate=0.0, tokens=32, error_rate=0.0,
+                 error_status=500, models=None, reply=DEFAULT_REPLY, seed=None):
+        self.latency = latency          # seconds before the first byte (prompt eval)
+        self.token_rate = token_rate    # generated tokens per second, 0 = instant
+        self.tokens = tokens            # tokens per response
+        self.error_rate = error_rate    # probability of an injected error
+        self.error_status = error_status
+        self.models = list(models or DEFAULT_MODELS)
+        self.reply = reply
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def should_fail(self):
+        if self.error_rate <= 0:
+            return False
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+    def reply_tokens(self):
+        """Split the canned reply into exactly `tokens` pieces"""
+        words = self.reply.split()
+        return [(words[i % len(words)] + ' ') for i in range(self.tokens)]
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    server_version = 'FakeOllama/1.0'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        try:
+            return json.loads(raw or b'{}')
+        except ValueError:
+            return None
+
+    def do_GET(self):
+        if self.path.rstrip('/') != '/api/tags':
+            self.send_json({'error': 'not found'}, 404)
+            return
+
+        config = self.server.config
+        if config.should_fail():
+            self.send_json({'error': 'injected failure'}, config.error_status)
+            return
+
+        self.send_json({
+            'models': [
+                {
+                    'name': f'{name}:latest',
+                    'model': f'{name}:latest',
+                    'modified_at': _now(),
+                    'size': 4_113_301_824,
+                    'digest': 'fake',
+                    'details': {'format': 'gguf', 'family': 'fake'},
+                }
+                for name in config.models
+            ]
+        })
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/api/chat':
+            self.send_json({'error': 'not found'}, 404)
+            return
+
+        config = self.server.config
+        data = self.read_json()
+        if data is None:
+            self.send_json({'error': 'invalid JSON'}, 400)
+            return
+
+        model = data.get('model', '')
+        if model.split(':', 1)[0] not in config.models:
+            self.send_json({'error': f"model '{model}' not found, try pulling it first"}, 404)
+            return
+
+        if config.should_fail():
+            self.send_json({'error': 'injected failure'}, config.error_status)
+            return
+
+        started = time.perf_counter()
+        if config.latency > 0:
+            time.sleep(config.latency)
+        prompt_eval_ns = int((time.perf_counter() - started) * 1e9)
+        prompt_tokens = sum(len(str(m.get('content', '')).split()) for m in data.get('messages', []))
+
+        # Ollama streams unless the client explicitly asks otherwise
+        if data.get('stream', True):
+            self.stream_reply(model, started, prompt_eval_ns, prompt_tokens)
+        else:
+            self.full_reply(model, started, prompt_eval_ns, prompt_tokens)
+
+    def wait_for_token(self):
+        rate = self.server.config.token_rate
+        if rate > 0:
+            time.sleep(1.0 / rate)
+
+    def final_stats(self, started, prompt_eval_ns, prompt_tokens, eval_started):
+        now = time.perf_counter()
+        return {
+            'done': True,
+            'done_reason': 'stop',
+            'total_duration': int((now - started) * 1e9),
+            'load_duration': 0,
+            'prompt_eval_count': prompt_tokens,
+            'prompt_eval_duration': prompt_eval_ns,
+            'eval_count': self.server.config.tokens,
+            'eval_duration': int((now - eval_started) * 1e9),
+        }
+
+    def full_reply(self, model, started, prompt_eval_ns, prompt_tokens):
+        eval_started = time.perf_counter()
+        pieces = []
+        for token in self.server.config.reply_tokens():
+            self.wait_for_token()
+            pieces.append(token)
+
+        payload = {
+            'model': model,
+            'created_at': _now(),
+            'message': {'role': 'assistant', 'content': ''.join(pieces).strip()},
+        }
+        payload.update(self.final_stats(started, prompt_eval_ns, prompt_tokens, eval_started))
+        self.send_json(payload)
+
+    def stream_reply(self, model, started, prompt_eval_ns, prompt_tokens):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        eval_started = time.perf_counter()
+        try:
+            for token in self.server.config.reply_tokens():
+                self.wait_for_token()
+                self.write_chunk({
+                    'model': model,
+                    'created_at': _now(),
+                    'message': {'role': 'assistant', 'content': token},
+                    'done': False,
+                })
+
+            last = {
+                'model': model,
+                'created_at': _now(),
+                'message': {'role': 'assistant', 'content': ''},
+            }
+            last.update(self.final_stats(started, prompt_eval_ns, prompt_tokens, eval_started))
+            self.write_chunk(last)
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            # Client went away mid-stream, same as a real Ollama would see it
+            self.close_connection = True
+
+    def write_chunk(self, payload):
+        line = json.dumps(payload, ensure_ascii=False).encode('utf-8') + b'\n'
+        self.wfile.write(f'{len(line):x}\r\n'.encode('ascii') + line + b'\r\n')
+        self.wfile.flush()
+
+
+class FakeOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=DEFAULT_PORT, config=None, verbose=False):
+        super().__init__((host, port), FakeOllamaHandler)
+        self.config = config or FakeOllamaConfig()
+        self.verbose = verbose
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        """Serve in a background thread (for benchmarks and scripts)"""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Fake Ollama server for benchmarking the proxy')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='0 = any free port')
+    parser.add_argument('--count', type=int, default=1, help='how many servers, on consecutive ports')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds before the first token')
+    parser.add_argument('--token-rate', type=float, default=0.0, help='tokens per second, 0 = instant')
+    parser.add_argument('--tokens', type=int, default=32, help='tokens per response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests that fail (0..1)')
+    parser.add_argument('--error-status', type=int, default=500)
+    parser.add_argument('--models', default=','.join(DEFAULT_MODELS), help='comma separated model names')
+    parser.add_argument('--reply', default=DEFAULT_REPLY)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    return parser
+
+
+def config_from_args(args):
+    return FakeOllamaConfig(
+        latency=args.latency,
+        token_rate=args.token_rate,
+        tokens=args.tokens,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        models=[m.strip() for m in args.models.split(',') if m.strip()],
+        reply=args.reply,
+        seed=args.seed,
+    )
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    servers = [
+        FakeOllamaServer(args.host, args.port + i if args.port else 0, config_from_args(args), verbose=args.verbose)
+        for i in range(max(1, args.count))
+    ]
+    config = servers[0].config
+
+    print("=" * 60)
+    print("🧪 Fake Ollama запущена")
+    print("=" * 60)
+    print(f"📍 URL: {', '.join(s.url for s in servers)}")
+    print(f"🤖 Модели: {', '.join(config.models)}")
+    print(f"⏱️  Задержка: {args.latency}s, скорость: {args.token_rate or '∞'} ток/с")
+    print(f"💥 Ошибки: {args.error_rate * 100:.1f}% (HTTP {args.error_status})")
+    print("=" * 60)
+
+    for server in servers[1:]:
+        server.start()
+    try:
+        servers[0].serve_forever()
+    except KeyboardInterrupt:
+        print("\n⏹️  Остановлено")
+    finally:
+        for server in servers[1:]:
+            server.stop()
+        servers[0].server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,25 @@
+"""
+gunicorn settings for server.py (see supervisor.py)
+
+    gunicorn --config gunicorn.conf.py --workers 4 --preload
+
+Command-line options override the values here.
+"""
+
+import multiprocessing
+
+wsgi_app = 'server:create_app()'
+bind = '0.0.0.0:5000'
+workers = multiprocessing.cpu_count()
+worker_class = 'gthread'
+threads = 8
+graceful_timeout = 30
+
+
+def when_ready(server):
+    """With --preload, index the message log once in the master so workers inherit it"""
+    if not server.cfg.preload_app:
+        return
+    app = server.app.wsgi()
+    with app.app_context():
+        app.extensions['alit'].message_store.count()
@@ -4,15 +4,90 @@ import sys
 import subprocess
 import json
 import time
+import argparse
 from pathlib import Path
 import platform
+import shutil
+import signal
+import threading
+import urllib.request
+
+from backup import BackupManager
+from bulk import export_lines, import_lines
+from compaction import DEFAULT_MIN_BYTES, DEFAULT_RATIO, Compactor
+from rooms import GENERAL, valid_room_name
+from storage import MessageStore, iter_json_object_items
+from supervisor import DEFAULT_THREADS, WorkerSupervisor
+from tokens import TokenStore
+
+DEFAULT_URL = 'http://localhost:5000'
+APP_DIR = Path(__file__).parent
+
+
+def read_config(app_dir=APP_DIR):
+    """config.json папки приложения ({} если его нет или он не читается)"""
+    try:
+        with open(app_dir / 'config.json', 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    except (OSError, ValueError):
+        config = {}
+    return config if isinstance(config, dict) else {}
+
+def config_data_dir(app_dir=APP_DIR):
+    """data.data_dir из config.json (относительный путь - от папки приложения), как у сервера"""
+    data_dir = Path(read_config(app_dir).get('data', {}).get('data_dir', './data'))
+    return data_dir if data_dir.is_absolute() else (app_dir / data_dir).resolve()
+
+def config_compaction(app_dir=APP_DIR):
+    """Пороги сжатия (ratio, min_bytes, max_age) из секции compaction config.json, как у сервера"""
+    compaction = {'ratio': DEFAULT_RATIO, 'min_bytes': DEFAULT_MIN_BYTES, 'max_age': 0}
+    section = read_config(app_dir).get('compaction', {})
+    if isinstance(section, dict):
+        compaction.update((key, section[key]) for key in compaction if key in section)
+    return compaction
 
 class ServerManager:
-    def __init__(self):
-        self.server_process = None
+    def __init__(self, workers=None, threads=DEFAULT_THREADS, port=5000, preload=False):
         self.server_path = Path(__file__).parent / 'server.py'
-        self.is_running = False
         self.os_type = platform.system()
+        self.supervisor = WorkerSupervisor(Path(__file__).parent, port=port, workers=workers,
+                                           threads=threads, preload=preload)
+        self.data_dir = config_data_dir()
+        self.users_file = self.data_dir / 'users.json'
+        self.message_store = MessageStore(self.data_dir / 'messages',
+                                          legacy_file=self.data_dir / 'messages.json')
+        self.token_store = TokenStore(self.data_dir / 'tokens.jsonl', cleanup_interval=0)
+        self.rooms_dir = self.data_dir / 'rooms'
+        self.ai_chats_dir = self.data_dir / 'ai_chats'
+        self.stats_dir = self.data_dir / 'stats'
+        self.backups = BackupManager(self.data_dir)
+
+    def room_store(self, room=GENERAL, create=False):
+        """MessageStore of a chat room, or None if there is no such room (`create` makes one)"""
+        if room == GENERAL:
+            return self.message_store
+        if not valid_room_name(room):
+            return None
+        if create:
+            (self.rooms_dir / room).mkdir(parents=True, exist_ok=True)
+        elif not (self.rooms_dir / room).is_dir():
+            return None
+        return MessageStore(self.rooms_dir / room)
+
+    def room_names(self):
+        """Names of "general" and every room on disk"""
+        return [GENERAL] + (sorted(p.name for p in self.rooms_dir.iterdir()
+                                   if p.is_dir() and valid_room_name(p.name) and p.name != GENERAL)
+                            if self.rooms_dir.is_dir() else [])
+
+    def iter_room_stores(self):
+        """(name, MessageStore) of every room, for export"""
+        for name in self.room_names():
+            yield name, self.room_store(name)
+
+    @property
+    def is_running(self):
+        return self.supervisor.running
 
     def print_header(self):
         print("\n" + "="*60)
@@ -28,7 +103,8 @@ class ServerManager:
         print("  5. 📨 Просмотр сообщений")
         print("  6. 🗑️  Очистить данные")
         print("  7. 🌐 Открыть приложение в браузере")
-        print("  8. ❌ Выход")
+        print(f"  8. {'🔄 Перезагрузить без простоя' if self.is_running else '❌ Сервер не запущен'}")
+        print("  9. ❌ Выход")
         print()
 
     def start_server(self):
@@ -36,29 +112,33 @@ class ServerManager:
             print("⚠️  Сервер уже запущен!")
             return
 
-        print("🚀 Запуск сервера...")
+        supervisor = self.supervisor
+        workers = f"{supervisor.workers} x {supervisor.threads} потоков" if supervisor.use_gunicorn else "1 процесс"
+        print(f"🚀 Запуск сервера ({supervisor.mode}, {workers})...")
         try:
-            if self.os_type == 'Windows':
-                self.server_process = subprocess.Popen(
-                    [sys.executable, str(self.server_path)],
-                    creationflags=subprocess.CREATE_NEW_CONSOLE
-                )
+            if supervisor.start():
+                print("✅ Сервер запущен и отвечает!")
+                print(f"📍 URL: http://localhost:{supervisor.port}")
+            elif supervisor.running:
+                print(f"⚠️  Сервер запущен, но не ответил за {supervisor.ready_timeout} с")
+                print(f"   Журнал: {supervisor.log_file}")
             else:
-                self.server_process = subprocess.Popen(
-                    [sys.executable, str(self.server_path)],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE
-                )
-            
-            self.is_running = True
-            print("✅ Сервер успешно запущен!")
-            print("📍 URL: http://localhost:5000")
-            print("⏱️  Подождите 2 секунды для полной инициализации...")
-            time.sleep(2)
+                print(f"❌ Сервер завершился при запуске, см. {supervisor.log_file}")
 
         except Exception as e:
             print(f"❌ Ошибка при запуске сервера: {e}")
 
+    def reload_server(self):
+        if not self.is_running:
+            print("⚠️  Сервер не запущен!")
+            return
+
+        print("🔄 Перезагрузка воркеров...")
+        if self.supervisor.reload():
+            print("✅ Новые воркеры запущены и отвечают")
+        else:
+            print(f"❌ Новые воркеры не ответили, см. {self.supervisor.log_file}")
+
     def stop_server(self):
         if not self.is_running:
             print("⚠️  Сервер не запущен!")
@@ -66,15 +146,7 @@ class ServerManager:
 
         print("⏹️  Остановка сервера...")
         try:
-            if self.server_process:
-                if self.os_type == 'Windows':
-                    self.server_process.terminate()
-                else:
-                    self.server_process.terminate()
-                    self.server_process.wait(timeout=5)
-            
-            self.is_running = False
-            self.server_process = None
+            self.supervisor.stop()
             print("✅ Сервер успешно остановлен!")
 
         except Exception as e:
@@ -82,62 +154,62 @@ class ServerManager:
 
     def check_status(self):
         print("\n📊 СТАТУС СЕРВЕРА:")
-        print(f"  Статус: {'🟢 Работает' if self.is_running else '🔴 Не работает'}")
-        print(f"  PID: {self.server_process.pid if self.is_running and self.server_process else 'N/A'}")
-        print(f"  URL: http://localhost:5000")
+        status = self.supervisor.status()
+        print(f"  Статус: {'🟢 Работает' if status['running'] else '🔴 Не работает'}")
+        print(f"  PID: {status['pid'] or 'N/A'}")
+        print(f"  URL: {status['url']}")
         print(f"  OS: {self.os_type}")
+        if status['running']:
+            print(f"  Режим: {status['mode']}, воркеров: {status['workers']}")
+            print(f"  Аптайм: {status['uptime']} с, перезапусков: {status['restarts']}")
         
         # Check data files
-        data_dir = Path(__file__).parent / 'data'
+        data_dir = self.data_dir
         if data_dir.exists():
-            users_file = data_dir / 'users.json'
-            messages_file = data_dir / 'messages.json'
+            users_file = self.users_file
             
-            users_count = len(json.load(open(users_file))) if users_file.exists() else 0
-            messages_count = len(json.load(open(messages_file))) if messages_file.exists() else 0
+            users_count = self.count_users()
+            messages_count = self.message_store.count()
             
             print(f"\n  📊 Статистика:")
             print(f"    - Пользователей: {users_count}")
             print(f"    - Сообщений: {messages_count}")
         print()
 
+    def iter_users(self):
+        """(username, data) по одному, без загрузки всего users.json в память"""
+        if not self.users_file.exists():
+            return
+        with open(self.users_file, 'rb') as f:
+            yield from iter_json_object_items(f)
+
+    def count_users(self):
+        return sum(1 for _ in self.iter_users())
+
     def view_users(self):
-        data_dir = Path(__file__).parent / 'data'
-        users_file = data_dir / 'users.json'
-        
-        if not users_file.exists():
+        if not self.users_file.exists():
             print("❌ Файл пользователей не найден!")
             return
         
         try:
-            with open(users_file, 'r', encoding='utf-8') as f:
-                users = json.load(f)
-            
             print("\n👥 ПОЛЬЗОВАТЕЛИ:")
-            if not users:
+            empty = True
+            for username, user_data in self.iter_users():
+                empty = False
+                print(f"\n  👤 {username}")
+                print(f"    Email: {user_data['email']}")
+                print(f"    ID: {user_data['id']}")
+                print(f"    Создан: {user_data['created_at']}")
+            if empty:
                 print("  Нет пользователей")
-            else:
-                for username, user_data in users.items():
-                    print(f"\n  👤 {username}")
-                    print(f"    Email: {user_data['email']}")
-                    print(f"    ID: {user_data['id']}")
-                    print(f"    Создан: {user_data['created_at']}")
             print()
         
         except Exception as e:
             print(f"❌ Ошибка при чтении пользователей: {e}")
 
     def view_messages(self):
-        data_dir = Path(__file__).parent / 'data'
-        messages_file = data_dir / 'messages.json'
-        
-        if not messages_file.exists():
-            print("❌ Файл сообщений не найден!")
-            return
-        
         try:
-            with open(messages_file, 'r', encoding='utf-8') as f:
-                messages = json.load(f)
+            messages = self.message_store.tail(10)
             
             print("\n💬 СООБЩЕНИЯ (последние 10):")
             if not messages:
@@ -157,24 +229,267 @@ class ServerManager:
             print("❌ Отменено")
             return
         
-        data_dir = Path(__file__).parent / 'data'
         try:
-            users_file = data_dir / 'users.json'
-            messages_file = data_dir / 'messages.json'
-            
-            if users_file.exists():
-                users_file.write_text('{}')
+            if self.users_file.exists():
+                self.users_file.write_text('{}')
                 print("✅ Пользователи очищены")
             
-            if messages_file.exists():
-                messages_file.write_text('[]')
-                print("✅ Сообщения очищены")
+            self.message_store.clear()
+            shutil.rmtree(self.rooms_dir, ignore_errors=True)
+            print("✅ Сообщения очищены (все комнаты)")
+
+            self.token_store.clear()
+            print("✅ Токены входа отозваны")
+
+            shutil.rmtree(self.ai_chats_dir, ignore_errors=True)
+            print("✅ История AI-чатов очищена")
+
+            shutil.rmtree(self.stats_dir, ignore_errors=True)
+            print("✅ Статистика чата сброшена")
             
             print("✅ Данные успешно очищены!")
         
         except Exception as e:
             print(f"❌ Ошибка при очистке данных: {e}")
 
+    def export_data(self, out_path=None):
+        """Выгрузить пользователей и сообщения в NDJSON (файл или stdout)"""
+        if out_path in (None, '-'):
+            out = sys.stdout.buffer
+            for line in export_lines(self.users_file, self.iter_room_stores()):
+                out.write(line)
+            out.flush()
+            return
+
+        lines = 0
+        with open(out_path, 'wb') as out:
+            for line in export_lines(self.users_file, self.iter_room_stores()):
+                out.write(line)
+                lines += 1
+        print(f"✅ Экспортировано записей: {lines} → {out_path}", file=sys.stderr)
+
+    def backup_command(self, full=False):
+        """Сделать резервную копию сейчас (полную или с изменений после прошлой)"""
+        path = self.backups.run(full=full)
+        print(f"✅ Резервная копия: {path} ({path.stat().st_size} байт)")
+        return 0
+
+    def restore_command(self, upto=None, target=None, list_only=False):
+        """Восстановить данные из цепочки резервных копий (сервер должен быть остановлен)"""
+        try:
+            chain = self.backups.chain(upto)
+        except FileNotFoundError:
+            print(f"❌ Нет резервной копии {upto}")
+            return 1
+        if not chain:
+            print("❌ Нет полной резервной копии")
+            return 1
+        if list_only:
+            for path in chain:
+                print(path.name)
+            return 0
+        self.backups.restore(target or self.data_dir, upto)
+        print(f"✅ Восстановлено из {len(chain)} копий, последняя: {chain[-1].name}")
+        return 0
+
+    def compact_command(self, room=None, if_needed=False, max_age=None, as_json=False):
+        """Сжать журналы сообщений: убрать удалённые (и старше max_age) сообщения
+
+        Пороги --if-needed и max_age по умолчанию - из секции compaction config.json.
+        """
+        if room is None:
+            rooms = self.room_names()
+        else:
+            rooms = [room]
+        settings = config_compaction()
+        compactor = Compactor(lambda: [], ratio=settings['ratio'], min_bytes=settings['min_bytes'],
+                              max_age=settings['max_age'] if max_age is None else max_age)
+        for name in rooms:
+            store = self.room_store(name)
+            if store is None:
+                print(f"❌ Комната не найдена: {name}")
+                return 1
+            report = compactor.compact(store, force=not if_needed)
+            if as_json:
+                self.print_json({'room': name, **(report or {})})
+            elif report is None:
+                print(f"{name}: сжатие не требуется")
+            else:
+                before, after = report['before'], report['after']
+                print(f"{name}: {before['bytes']} → {after['bytes']} байт, "
+                      f"сегментов {before['segments']} → {after['segments']}, "
+                      f"сообщений {report['messages']}, устаревших удалено {report['expired']}")
+        return 0
+
+    def purge_user_command(self, username, room=None, as_json=False):
+        """Удалить все сообщения пользователя (по индексу автора, без перебора истории)"""
+        if room is None:
+            rooms = self.room_names()
+        else:
+            rooms = [room]
+        total = 0
+        for name in rooms:
+            store = self.room_store(name)
+            if store is None:
+                print(f"❌ Комната не найдена: {name}")
+                return 1
+            deleted = store.delete_by_author(username)
+            total += deleted
+            if as_json:
+                self.print_json({'room': name, 'username': username, 'deleted': deleted})
+            elif deleted:
+                print(f"{name}: удалено сообщений {deleted}")
+        if not as_json:
+            print(f"✅ Удалено сообщений {username}: {total}")
+        return 0
+
+    def import_store(self, room):
+        """The room's MessageStore for import, creating the room if needed"""
+        return self.room_store(room, create=True)
+
+    def import_data(self, in_path):
+        """Загрузить NDJSON-выгрузку (stdin, если путь '-')"""
+        if in_path == '-':
+            report = import_lines(sys.stdin.buffer, self.users_file, self.import_store)
+        else:
+            with open(in_path, 'rb') as f:
+                report = import_lines(f, self.users_file, self.import_store)
+
+        print("✅ Импорт завершён")
+        print(f"  👥 Пользователей добавлено: {report.users_added}, пропущено: {report.users_skipped}")
+        print(f"  💬 Сообщений добавлено: {report.messages_added}, пропущено: {report.messages_skipped}")
+        if report.error_count:
+            print(f"  ⚠️  Ошибок: {report.error_count}")
+            for error in report.errors:
+                print(f"    - {error}")
+        return 1 if report.error_count else 0
+
+    # ----- неинтерактивные команды -----
+
+    def probe_server(self, url=DEFAULT_URL, timeout=2):
+        """Ответ /api/health или None, если сервер не отвечает"""
+        try:
+            with urllib.request.urlopen(f"{url.rstrip('/')}/api/health", timeout=timeout) as response:
+                return json.load(response)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def format_message(msg):
+        timestamp = str(msg.get('timestamp', ''))[:19].replace('T', ' ')
+        return f"[{timestamp}] {msg.get('username')}: {msg.get('content')}"
+
+    @staticmethod
+    def print_json(data):
+        print(json.dumps(data, ensure_ascii=False), flush=True)
+
+    def status_command(self, url=DEFAULT_URL, as_json=False):
+        health = self.probe_server(url)
+        status = {
+            'url': url,
+            'running': health is not None,
+            'health': health,
+            'users': self.count_users(),
+            'messages': self.message_store.count(),
+        }
+        if as_json:
+            self.print_json(status)
+        else:
+            print(f"Сервер: {'🟢 работает' if health else '🔴 не отвечает'} ({url})")
+            if health:
+                print(f"Клиентов онлайн: {health.get('active_clients', 0)}")
+            print(f"Пользователей: {status['users']}")
+            print(f"Сообщений: {status['messages']}")
+        return 0 if health else 1
+
+    def tail_command(self, count=10, as_json=False, room=GENERAL):
+        store = self.room_store(room)
+        if store is None:
+            print(f"❌ Комната {room!r} не найдена", file=sys.stderr)
+            return 1
+        for msg in store.tail(count):
+            if as_json:
+                self.print_json(msg)
+            else:
+                print(self.format_message(msg))
+        return 0
+
+    def follow_command(self, count=10, interval=1.0, as_json=False, room=GENERAL):
+        """Последние сообщения, затем новые по мере появления (до Ctrl+C)"""
+        store = self.room_store(room)
+        if store is None:
+            print(f"❌ Комната {room!r} не найдена", file=sys.stderr)
+            return 1
+        position = store.end_position()
+        self.tail_command(count, as_json, room)
+        sys.stdout.flush()
+        try:
+            while True:
+                time.sleep(interval)
+                records, position = store.read_since(position)
+                for kind, record in records:
+                    if as_json:
+                        self.print_json(record if kind == 'message' else {'deleted': record['deleted']})
+                    elif kind == 'message':
+                        print(self.format_message(record), flush=True)
+                    else:
+                        print(f"🗑️  удалено сообщение {record['deleted']}", flush=True)
+        except KeyboardInterrupt:
+            return 0
+
+    def users_command(self, limit=None, as_json=False):
+        for i, (username, data) in enumerate(self.iter_users()):
+            if limit is not None and i >= limit:
+                break
+            if as_json:
+                self.print_json({
+                    'username': username,
+                    'email': data.get('email'),
+                    'id': data.get('id'),
+                    'created_at': data.get('created_at')
+                })
+            else:
+                print(f"{username}\t{data.get('email', '')}\t{data.get('created_at', '')}")
+        return 0
+
+    def stats_command(self, as_json=False):
+        stats = self.message_store.stats()
+        stats['users'] = self.count_users()
+        stats['tokens'] = self.token_store.count()
+        stats['users_bytes'] = self.users_file.stat().st_size if self.users_file.exists() else 0
+        stats['rooms'] = 1 + (sum(1 for p in self.rooms_dir.iterdir() if p.is_dir()) if self.rooms_dir.is_dir() else 0)
+        if as_json:
+            self.print_json(stats)
+        else:
+            print(f"Пользователей: {stats['users']} ({stats['users_bytes']} байт), активных токенов: {stats['tokens']}")
+            print(f"Сообщений в general: {stats['messages']}, удалено: {stats['deleted']}, комнат: {stats['rooms']}")
+            print(f"Журнал: сегментов {stats['segments']}, {stats['bytes']} байт")
+        return 0
+
+    def serve_command(self):
+        """Держать пул воркеров на переднем плане: SIGHUP - перезагрузка, Ctrl+C/SIGTERM - остановка"""
+        self.start_server()
+        if not self.is_running:
+            return 1
+
+        reload_requested = threading.Event()
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, lambda *_: reload_requested.set())
+
+        def interrupt(*_):
+            raise KeyboardInterrupt
+
+        signal.signal(signal.SIGTERM, interrupt)
+        try:
+            while True:
+                if reload_requested.wait(1):
+                    reload_requested.clear()
+                    self.reload_server()
+        except KeyboardInterrupt:
+            pass
+        self.stop_server()
+        return 0
+
     def open_browser(self):
         import webbrowser
         print("🌐 Открытие приложения в браузере...")
@@ -185,7 +500,7 @@ class ServerManager:
         
         while True:
             self.print_menu()
-            choice = input("Выберите опцию (1-8): ").strip()
+            choice = input("Выберите опцию (1-9): ").strip()
             
             if choice == '1':
                 self.start_server()
@@ -202,6 +517,8 @@ class ServerManager:
             elif choice == '7':
                 self.open_browser()
             elif choice == '8':
+                self.reload_server()
+            elif choice == '9':
                 if self.is_running:
                     print("🛑 Остановка сервера перед выходом...")
                     self.stop_server()
@@ -210,7 +527,101 @@ class ServerManager:
             else:
                 print("❌ Неверный выбор. Попробуйте снова.\n")
 
+def build_parser():
+    parser = argparse.ArgumentParser(description='AI Chat server manager (без аргументов - интерактивное меню)')
+    commands = parser.add_subparsers(dest='command')
+
+    export_cmd = commands.add_parser('export', help='выгрузить пользователей и сообщения в NDJSON')
+    export_cmd.add_argument('-o', '--output', default='-', help="файл (по умолчанию stdout)")
+
+    import_cmd = commands.add_parser('import', help='загрузить NDJSON-выгрузку')
+    import_cmd.add_argument('input', help="файл или '-' для stdin")
+
+    status_cmd = commands.add_parser('status', help='состояние сервера и количество данных')
+    status_cmd.add_argument('--url', default=DEFAULT_URL, help='адрес сервера')
+
+    tail_cmd = commands.add_parser('tail', help='последние сообщения')
+    tail_cmd.add_argument('-n', '--lines', type=int, default=10, help='сколько сообщений')
+    tail_cmd.add_argument('--room', default=GENERAL, help='комната (по умолчанию general)')
+
+    follow_cmd = commands.add_parser('follow', help='последние сообщения и новые в реальном времени')
+    follow_cmd.add_argument('-n', '--lines', type=int, default=10, help='сколько сообщений показать сначала')
+    follow_cmd.add_argument('--interval', type=float, default=1.0, help='период опроса, секунды')
+    follow_cmd.add_argument('--room', default=GENERAL, help='комната (по умолчанию general)')
+
+    users_cmd = commands.add_parser('users', help='список пользователей')
+    users_cmd.add_argument('--limit', type=int, help='не больше N пользователей')
+
+    commands.add_parser('stats', help='статистика хранилища')
+
+    compact_cmd = commands.add_parser('compact', help='сжать журналы сообщений (без остановки сервера)')
+    compact_cmd.add_argument('--room', help='только эта комната (по умолчанию все)')
+    compact_cmd.add_argument('--if-needed', action='store_true',
+                             help='только если журнал превысил пороги сжатия (compaction.ratio и '
+                                  'compaction.min_bytes из config.json)')
+    compact_cmd.add_argument('--max-age', type=int,
+                             help='удалить сообщения старше N секунд (по умолчанию compaction.max_age, 0 - не удалять)')
+
+    purge_cmd = commands.add_parser('purge-user', help='удалить все сообщения пользователя')
+    purge_cmd.add_argument('username')
+    purge_cmd.add_argument('--room', help='только в этой комнате (по умолчанию во всех)')
+
+    backup_cmd = commands.add_parser('backup', help='резервная копия сейчас (в data/backups)')
+    backup_cmd.add_argument('--full', action='store_true', help='полная, а не только изменения')
+
+    restore_cmd = commands.add_parser('restore', help='восстановить из data/backups (остановите сервер)')
+    restore_cmd.add_argument('--upto', help='до этой копии включительно (по умолчанию последняя)')
+    restore_cmd.add_argument('--target', help='в другую папку данных вместо data/')
+    restore_cmd.add_argument('--list', action='store_true', help='только показать, какие копии нужны')
+
+    serve_cmd = commands.add_parser('serve', help='запустить пул воркеров и следить за ним (SIGHUP - перезагрузка)')
+    serve_cmd.add_argument('--workers', type=int, help='число воркеров (по умолчанию - по числу CPU)')
+    serve_cmd.add_argument('--threads', type=int, default=DEFAULT_THREADS, help='потоков на воркер')
+    serve_cmd.add_argument('--port', type=int, default=5000)
+    serve_cmd.add_argument('--preload', action='store_true',
+                           help='загрузить приложение один раз до fork (быстрее старт, общая память; '
+                                'перезагрузка тогда перезапускает пул)')
+
+    for command in (status_cmd, tail_cmd, follow_cmd, users_cmd, commands.choices['stats'], compact_cmd,
+                    purge_cmd):
+        command.add_argument('--json', action='store_true', help='вывод в JSON, по объекту на строку')
+    return parser
+
+def run_command(argv):
+    args = build_parser().parse_args(argv)
+    if args.command == 'serve':
+        return ServerManager(args.workers, args.threads, args.port, args.preload).serve_command()
+    manager = ServerManager()
+
+    if args.command == 'export':
+        manager.export_data(args.output)
+        return 0
+    if args.command == 'import':
+        return manager.import_data(args.input)
+    if args.command == 'status':
+        return manager.status_command(args.url, args.json)
+    if args.command == 'tail':
+        return manager.tail_command(args.lines, args.json, args.room)
+    if args.command == 'follow':
+        return manager.follow_command(args.lines, args.interval, args.json, args.room)
+    if args.command == 'users':
+        return manager.users_command(args.limit, args.json)
+    if args.command == 'stats':
+        return manager.stats_command(args.json)
+    if args.command == 'compact':
+        return manager.compact_command(args.room, args.if_needed, args.max_age, args.json)
+    if args.command == 'purge-user':
+        return manager.purge_user_command(args.username, args.room, args.json)
+    if args.command == 'backup':
+        return manager.backup_command(args.full)
+    if args.command == 'restore':
+        return manager.restore_command(args.upto, args.target, args.list)
+    return 0
+
 if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        sys.exit(run_command(sys.argv[1:]))
+
     manager = ServerManager()
     
     # Обработка Ctrl+C
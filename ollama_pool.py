@@ -0,0 +1,227 @@
+"""
+Pool of Ollama backends for the AI proxy (/api/ollama/*)
+
+    "ai": {"backends": ["http://gpu1:11434", "http://gpu2:11434"], ...}
+    OLLAMA_URL=http://localhost:11434,http://localhost:11435
+
+Routing:
+- a request only goes to a backend that has its model (from /api/tags);
+  backends whose models aren't known yet are tried too
+- among those, the one with the fewest outstanding requests wins (ties
+  rotate), counted per process
+- connection errors, timeouts and 5xx answers count as failures; after
+  `eject_after` in a row a backend is ejected for `eject_for` seconds,
+  doubling each time it is ejected again without recovering in between
+  (`eject_after=0` never ejects)
+
+Health checks: a background thread (one per process, started on first
+use) asks every backend for /api/tags each `health_interval` seconds,
+which also refreshes its model list. A backend that doesn't answer is
+marked down until a check succeeds; an ejected one only comes back after
+its ejection ends and a check passes.
+"""
+
+import itertools
+import os
+import threading
+import time
+
+DEFAULT_HEALTH_INTERVAL = 10
+DEFAULT_HEALTH_TIMEOUT = 2
+DEFAULT_EJECT_AFTER = 3
+DEFAULT_EJECT_FOR = 30
+MAX_EJECT_FOR = 10 * 60
+
+
+def model_key(name):
+    """'mistral' and 'mistral:latest' are the same model"""
+    name = (name or '').strip()
+    return name if ':' in name else f'{name}:latest'
+
+
+class NoBackendError(Exception):
+    """No healthy backend can serve the request"""
+
+    def __init__(self, message, status=503):
+        super().__init__(message)
+        self.status = status
+
+
+class Backend:
+    __slots__ = ('url', 'healthy', 'models', 'tags', 'outstanding', 'failures',
+                 'ejections', 'ejected_until', 'checked_at', 'requests', 'errors')
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.healthy = True         # until a check says otherwise
+        self.models = None          # set of model keys, None = not known yet
+        self.tags = []              # the backend's /api/tags "models" entries
+        self.outstanding = 0
+        self.failures = 0           # in a row
+        self.ejections = 0          # in a row, for the backoff
+        self.ejected_until = 0.0
+        self.checked_at = None
+        self.requests = 0
+        self.errors = 0
+
+    def available(self, now):
+        return self.healthy and now >= self.ejected_until
+
+    def has_model(self, key):
+        return self.models is None or key in self.models
+
+    def to_dict(self, now):
+        return {
+            'url': self.url,
+            'healthy': self.healthy,
+            'ejected_for': max(0, round(self.ejected_until - now)),
+            'outstanding': self.outstanding,
+            'models': sorted(self.models) if self.models is not None else None,
+            'requests': self.requests,
+            'errors': self.errors,
+        }
+
+
+class OllamaPool:
+    def __init__(self, urls, health_interval=DEFAULT_HEALTH_INTERVAL, health_timeout=DEFAULT_HEALTH_TIMEOUT,
+                 eject_after=DEFAULT_EJECT_AFTER, eject_for=DEFAULT_EJECT_FOR, clock=time.monotonic):
+        self.backends = [Backend(url) for url in dict.fromkeys(urls)]
+        if not self.backends:
+            raise ValueError('at least one Ollama backend is required')
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.eject_after = eject_after
+        self.eject_for = eject_for
+        self.clock = clock
+        self._reset_process_state()
+
+    def _reset_process_state(self):
+        self._lock = threading.Lock()
+        self._rotation = itertools.count()
+        self._checker_pid = None
+        self._stop = threading.Event()
+        for backend in self.backends:
+            backend.outstanding = 0
+
+    @property
+    def primary_url(self):
+        return self.backends[0].url
+
+    # ----- routing -----
+
+    def acquire(self, model=None, exclude=()):
+        """Pick a backend for `model` and count the request as outstanding
+
+        Raises NoBackendError (503, or 404 if no backend has the model).
+        """
+        self._ensure_checker()
+        key = model_key(model) if model else None
+        now = self.clock()
+        with self._lock:
+            candidates = [b for b in self.backends if b.available(now) and b not in exclude]
+            if not candidates:
+                raise NoBackendError('Нет доступных серверов Ollama')
+            if key is not None:
+                candidates = [b for b in candidates if b.has_model(key)]
+                if not candidates:
+                    raise NoBackendError(f"Модель '{model}' не загружена ни на одном сервере Ollama", 404)
+            # Fewest outstanding requests; rotating the start spreads ties
+            start = next(self._rotation) % len(candidates)
+            rotated = candidates[start:] + candidates[:start]
+            backend = min(rotated, key=lambda b: b.outstanding)
+            backend.outstanding += 1
+            backend.requests += 1
+            return backend
+
+    def release(self, backend, ok=True):
+        """Finish a request; `ok=False` counts towards ejection"""
+        now = self.clock()
+        with self._lock:
+            backend.outstanding = max(0, backend.outstanding - 1)
+            if ok:
+                backend.failures = 0
+                backend.ejections = 0
+                return
+            backend.errors += 1
+            backend.failures += 1
+            if self.eject_after and backend.failures >= self.eject_after:
+                self._eject(backend, now)
+
+    def _eject(self, backend, now):
+        backend.ejected_until = now + min(MAX_EJECT_FOR, self.eject_for * (2 ** backend.ejections))
+        backend.ejections += 1
+        backend.failures = 0
+
+    # ----- health checks -----
+
+    def _ensure_checker(self):
+        """Start this process's health-check thread (threads don't survive a fork)"""
+        if self._checker_pid == os.getpid() or not self.health_interval:
+            return
+        with self._lock:
+            if self._checker_pid == os.getpid():
+                return
+            self._checker_pid = os.getpid()
+        threading.Thread(target=self._check_loop, name='ollama-health', daemon=True).start()
+
+    def _check_loop(self):
+        while True:
+            self.check_all()
+            if self._stop.wait(self.health_interval):
+                return
+
+    def check(self, backend):
+        """GET /api/tags: marks the backend up or down and refreshes its models"""
+        import requests
+
+        try:
+            response = requests.get(f'{backend.url}/api/tags', timeout=self.health_timeout)
+            ok = response.status_code == 200
+            tags = response.json().get('models', []) if ok else None
+        except (requests.exceptions.RequestException, ValueError):
+            ok, tags = False, None
+
+        now = self.clock()
+        with self._lock:
+            backend.checked_at = now
+            backend.healthy = ok
+            if tags is not None:
+                backend.tags = tags
+                backend.models = {model_key(t.get('name') or t.get('model')) for t in tags}
+            if ok and now >= backend.ejected_until:
+                backend.failures = 0
+        return ok
+
+    def check_all(self):
+        for backend in self.backends:
+            self.check(backend)
+
+    def tags(self):
+        """Models of every healthy backend, merged (the /api/tags answer)"""
+        self._ensure_checker()
+        now = self.clock()
+        stale = [b for b in self.backends
+                 if b.checked_at is None or now - b.checked_at >= self.health_interval]
+        for backend in stale:
+            self.check(backend)
+        merged = {}
+        with self._lock:
+            for backend in self.backends:
+                if backend.available(now):
+                    for tag in backend.tags:
+                        merged.setdefault(model_key(tag.get('name') or tag.get('model')), tag)
+            if not any(b.available(now) for b in self.backends):
+                raise NoBackendError('Ollama не доступна')
+        return {'models': list(merged.values())}
+
+    def stats(self):
+        now = self.clock()
+        with self._lock:
+            return [backend.to_dict(now) for backend in self.backends]
+
+    def close(self):
+        self._stop.set()
+
+    def after_fork(self):
+        """In a forked child: no health thread and no requests in flight yet"""
+        self._reset_process_state()
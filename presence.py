@@ -0,0 +1,281 @@
+"""
+Presence of connected clients (/api/clients/*)
+
+Clients live only in memory. Each one has a deadline (last heartbeat + TTL)
+kept in a min-heap, so expiry costs O(log n) per client instead of a scan.
+Heartbeats only touch `last_seen` (O(1)); a heap entry whose client has
+heartbeated since it was pushed is simply re-pushed with the new deadline
+when it reaches the top. Expiry runs in batches at most every
+`sweep_interval` seconds, piggybacking on normal calls.
+
+With several workers a client's heartbeats land on any of them, so with a
+`bus` (pubsub.EventBus) the registry of every worker holds every client:
+connects and disconnects are published on the bus, and each worker
+publishes the clients that heartbeated through it once every
+`share_interval` seconds (one event per worker, however many clients),
+with their full records, so a worker started later picks them up too.
+Every worker expires clients on its own clock; a shared heartbeat only
+has to arrive well within the TTL. Without a bus, presence is this
+process's alone.
+"""
+
+import heapq
+import os
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+
+DEFAULT_TTL = 90                 # seconds without a heartbeat before a client is dropped
+DEFAULT_HEARTBEAT_INTERVAL = 30  # what clients are told to use
+DEFAULT_SWEEP_INTERVAL = 1.0
+# Not a valid room name, so never a room's channel on the bus
+PRESENCE_CHANNEL = '~presence'
+
+
+class ClientSession:
+    """One connected client (a browser tab, a CLI, an SDK instance)"""
+
+    __slots__ = ('client_id', 'session_id', 'username', 'avatar', 'ip_address',
+                 'device_info', 'connected_at', 'last_seen')
+
+    def __init__(self, username, avatar, ip_address, device_info, now):
+        self.client_id = str(uuid.uuid4())
+        self.session_id = str(uuid.uuid4())
+        self.username = username
+        self.avatar = avatar
+        self.ip_address = ip_address
+        self.device_info = device_info or {}
+        self.connected_at = datetime.now().isoformat()
+        self.last_seen = now
+
+    @classmethod
+    def from_record(cls, record, now):
+        """A client another worker connected (see to_record)"""
+        client = cls(record['username'], record.get('avatar'), record.get('ip_address'),
+                     record.get('device_info'), now)
+        client.client_id = record['client_id']
+        client.session_id = record.get('session_id') or client.session_id
+        client.connected_at = record.get('connected_at') or client.connected_at
+        return client
+
+    def to_record(self):
+        return {**self.to_dict(), 'avatar': self.avatar}
+
+    def to_dict(self):
+        return {
+            'client_id': self.client_id,
+            'session_id': self.session_id,
+            'username': self.username,
+            'ip_address': self.ip_address,
+            'device_info': self.device_info,
+            'connected_at': self.connected_at,
+        }
+
+
+class _BusSink:
+    """What EventBus.attach() expects of a hub, handing presence events to the registry"""
+
+    def __init__(self, registry):
+        self.registry = registry
+
+    def start_at(self, event_id):
+        pass  # nothing to replay: shared heartbeats bring every live client
+
+    def deliver(self, events):
+        self.registry._apply(events)
+
+
+class PresenceRegistry:
+    """In-memory registry of connected clients with heartbeat expiry"""
+
+    def __init__(self, ttl=DEFAULT_TTL, heartbeat_interval=DEFAULT_HEARTBEAT_INTERVAL,
+                 sweep_interval=DEFAULT_SWEEP_INTERVAL, clock=time.monotonic, bus=None, share_interval=None):
+        self.ttl = ttl
+        self.heartbeat_interval = heartbeat_interval
+        self.sweep_interval = sweep_interval
+        self.clock = clock
+        self.bus = bus
+        self.share_interval = share_interval or heartbeat_interval / 2
+
+        self._lock = threading.Lock()
+        self._clients = {}            # client_id -> ClientSession
+        self._deadlines = []          # heap of (deadline, client_id)
+        self._per_user = Counter()    # username -> connected clients
+        self._avatars = {}            # username -> avatar
+        self._next_sweep = 0.0
+        self._online_cache = None     # cached online list, dropped on membership change
+        self._seen = set()            # ids heartbeated here since they were last shared
+        self._sharer_pid = None
+        self._stop = threading.Event()
+        self.last_error = None
+        if bus is not None:
+            bus.attach(PRESENCE_CHANNEL, _BusSink(self))
+
+    # ----- mutations -----
+
+    def connect(self, username, avatar=None, ip_address=None, device_info=None):
+        """Register a new client and return its session"""
+        self._follow_bus()
+        now = self.clock()
+        client = ClientSession(username, avatar or username[:1].upper(), ip_address, device_info, now)
+        with self._lock:
+            self._sweep(now)
+            self._add(client, now)
+        if self.bus is not None:
+            self.bus.publish(PRESENCE_CHANNEL, 'connect', client.to_record())
+        return client
+
+    def heartbeat(self, client_ids):
+        """Refresh a batch of clients; return the ids that are not connected"""
+        self._follow_bus()
+        now = self.clock()
+        unknown = []
+        with self._lock:
+            self._sweep(now)
+            for client_id in client_ids:
+                client = self._clients.get(client_id)
+                if client is None:
+                    unknown.append(client_id)
+                else:
+                    client.last_seen = now
+                    if self.bus is not None:
+                        self._seen.add(client_id)
+        return unknown
+
+    def disconnect(self, client_id):
+        """Remove a client; return False if it wasn't connected"""
+        self._follow_bus()
+        with self._lock:
+            self._sweep(self.clock())
+            client = self._clients.get(client_id)
+            if client is None:
+                return False
+            self._drop(client)
+            # Its heap entry is left behind and skipped when it surfaces
+        if self.bus is not None:
+            self.bus.publish(PRESENCE_CHANNEL, 'disconnect', {'client_id': client_id})
+        return True
+
+    # ----- reads -----
+
+    def get(self, client_id):
+        self._follow_bus()
+        with self._lock:
+            self._sweep(self.clock())
+            return self._clients.get(client_id)
+
+    def counts(self):
+        """(active_clients, active_sessions): connected clients and distinct users online"""
+        self._follow_bus()
+        with self._lock:
+            self._sweep(self.clock())
+            return len(self._clients), len(self._per_user)
+
+    def online_users(self):
+        """Users with at least one live client, sorted by name"""
+        self._follow_bus()
+        with self._lock:
+            self._sweep(self.clock())
+            if self._online_cache is None:
+                self._online_cache = [
+                    {'username': name, 'avatar': self._avatars.get(name), 'clients': count}
+                    for name, count in sorted(self._per_user.items())
+                ]
+            return self._online_cache
+
+    # ----- sharing through the bus -----
+
+    def _follow_bus(self):
+        """Start this process's relay and sharing threads (threads don't survive a fork)"""
+        if self.bus is None or self._sharer_pid == os.getpid():
+            return
+        self.bus.ensure_relay()
+        with self._lock:
+            if self._sharer_pid == os.getpid():
+                return
+            self._sharer_pid = os.getpid()
+        threading.Thread(target=self._share_loop, name='presence', daemon=True).start()
+
+    def _share_loop(self):
+        while not self._stop.wait(self.share_interval):
+            try:
+                self.share()
+            except Exception as e:
+                # e.g. the bus locked for longer than its timeout: those clients are shared next round
+                self.last_error = f'{type(e).__name__}: {e}'
+
+    def share(self):
+        """Publish the clients that heartbeated here since the last call"""
+        with self._lock:
+            seen = self._seen
+            self._seen = set()
+            records = [self._clients[cid].to_record() for cid in seen if cid in self._clients]
+        if records:
+            try:
+                self.bus.publish(PRESENCE_CHANNEL, 'seen', {'clients': records})
+            except Exception:
+                with self._lock:
+                    self._seen |= seen
+                raise
+
+    def _apply(self, events):
+        """Connects, heartbeats and disconnects published by any worker (this one's too)"""
+        now = self.clock()
+        with self._lock:
+            for event in events:
+                if event.type == 'disconnect':
+                    client = self._clients.get(event.data.get('client_id'))
+                    if client is not None:
+                        self._drop(client)
+                    continue
+                records = event.data.get('clients', ()) if event.type == 'seen' else (event.data,)
+                for record in records:
+                    client = self._clients.get(record.get('client_id'))
+                    if client is not None:
+                        client.last_seen = max(client.last_seen, now)
+                    elif record.get('client_id') and record.get('username'):
+                        self._add(ClientSession.from_record(record, now), now)
+
+    def close(self):
+        self._stop.set()
+
+    # ----- internals (caller holds the lock) -----
+
+    def _add(self, client, now):
+        self._clients[client.client_id] = client
+        heapq.heappush(self._deadlines, (now + self.ttl, client.client_id))
+        self._per_user[client.username] += 1
+        self._avatars[client.username] = client.avatar
+        self._online_cache = None
+
+    def _drop(self, client):
+        del self._clients[client.client_id]
+        self._per_user[client.username] -= 1
+        if self._per_user[client.username] <= 0:
+            del self._per_user[client.username]
+            self._avatars.pop(client.username, None)
+        self._online_cache = None
+
+    def _sweep(self, now):
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.sweep_interval
+
+        heap = self._deadlines
+        while heap and heap[0][0] <= now:
+            _, client_id = heapq.heappop(heap)
+            client = self._clients.get(client_id)
+            if client is None:
+                continue  # already disconnected
+            deadline = client.last_seen + self.ttl
+            if deadline > now:
+                heapq.heappush(heap, (deadline, client_id))
+            else:
+                self._drop(client)
+
+        # Disconnects leave stale entries behind; rebuild if they dominate
+        if len(heap) > 2 * len(self._clients) + 64:
+            self._deadlines = [(c.last_seen + self.ttl, cid) for cid, c in self._clients.items()]
+            heapq.heapify(self._deadlines)
@@ -0,0 +1,259 @@
+"""
+Cross-worker chat events: a notification log in SQLite (data/events.sqlite3)
+
+Every gunicorn worker has its own EventHubs, so an event published in one
+worker has to reach the streams held by all the others. Publishing inserts
+a row into the shared `events` table; each process runs one relay thread
+that reads the rows added since its last position (from any process) and
+hands them to the local hub of their channel (room).
+
+- Ids are the table's row ids, the same in every worker, so an SSE client
+  can reconnect to any worker with Last-Event-ID and resume where it was.
+- Delivery is at least once: a relay only advances its position after the
+  rows are handed over, and hubs drop ids they already have. A client that
+  fell behind its hub's history is replayed from the table (read_after)
+  for as long as the rows are kept.
+- Fan-out is coalesced: one query returns everything new and every hub
+  gets its share in a single batch (one wakeup for its streams). The
+  relay polls `PRAGMA data_version`, which only changes when another
+  connection committed, every `poll_interval`; a publish in the same
+  process wakes it immediately.
+- Old rows are pruned after `retention` seconds or beyond `max_events`.
+
+The database runs in WAL mode so readers never block the writer. Each
+thread gets its own connection, and none is carried across a fork.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from events import ChatEvent
+from timing import log_event
+
+DEFAULT_POLL_INTERVAL = 0.05
+DEFAULT_RETENTION = 60 * 60
+DEFAULT_MAX_EVENTS = 100_000
+PRUNE_INTERVAL = 60
+RELAY_BATCH = 1000
+BACKFILL_LIMIT = 500
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel TEXT NOT NULL,
+    type TEXT NOT NULL,
+    data TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_channel ON events (channel, id);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+'''
+
+
+class EventBus:
+    def __init__(self, path, poll_interval=DEFAULT_POLL_INTERVAL, retention=DEFAULT_RETENTION,
+                 max_events=DEFAULT_MAX_EVENTS, clock=time.time):
+        self.path = Path(path)
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.max_events = max_events
+        self.clock = clock
+
+        self._hubs = {}            # channel -> EventHub in this process
+        self._reset_process_state()
+
+    def _reset_process_state(self):
+        self._lock = threading.Lock()
+        # Held while a batch is handed out, so a hub attached meanwhile gets all or none of it
+        self._deliver_lock = threading.Lock()
+        self._local = threading.local()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._relay_pid = None
+        self._position = None      # last row id handed to the hubs
+        self._next_prune = 0.0
+        self.published = 0
+        self.relayed = 0
+        self.errors = 0
+        self.last_error = None
+
+    # ----- connections -----
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def _max_id(self, conn):
+        return conn.execute('SELECT COALESCE(MAX(id), 0) FROM events').fetchone()[0]
+
+    def _pruned_upto(self, conn):
+        row = conn.execute("SELECT value FROM meta WHERE key = 'pruned_upto'").fetchone()
+        return row[0] if row else 0
+
+    # ----- hubs -----
+
+    def attach(self, channel, hub):
+        """Route the channel's events to a new `hub`; ids and replay come from the bus"""
+        hub.head = self.head
+        hub.backfill = lambda after, upto: self.read_after(channel, after, upto)
+        with self._deliver_lock:
+            # The hub picks up exactly where the relay is (or will be, once it
+            # starts); anything older is backfill
+            if self._relay_pid == os.getpid():
+                hub.start_at(self._position)
+            with self._lock:
+                self._hubs[channel] = hub
+
+    def detach(self, channel):
+        with self._lock:
+            self._hubs.pop(channel, None)
+
+    def head(self):
+        """Newest id this process has relayed"""
+        return self._position or 0
+
+    # ----- publishing and reading -----
+
+    def publish(self, channel, event_type, data):
+        """Insert an event for every worker; return its id"""
+        self.ensure_relay()
+        payload = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+        cursor = self._connection().execute(
+            'INSERT INTO events (channel, type, data, created) VALUES (?, ?, ?, ?)',
+            (channel, event_type, payload, self.clock()))
+        self.published += 1
+        self._wake.set()
+        return cursor.lastrowid
+
+    def read_after(self, channel, after, upto, limit=BACKFILL_LIMIT):
+        """Events of a channel with after < id <= upto, or None if some were pruned"""
+        self.ensure_relay()
+        conn = self._connection()
+        if after < self._pruned_upto(conn):
+            return None
+        rows = conn.execute(
+            'SELECT id, type, data FROM events WHERE channel = ? AND id > ? AND id <= ? ORDER BY id LIMIT ?',
+            (channel, after, upto, limit)).fetchall()
+        return [ChatEvent(event_id, event_type, json.loads(data)) for event_id, event_type, data in rows]
+
+    # ----- relay -----
+
+    def ensure_relay(self):
+        """Start this process's relay thread (threads don't survive a fork)"""
+        if self._relay_pid == os.getpid():
+            return
+        with self._deliver_lock, self._lock:
+            if self._relay_pid == os.getpid():
+                return
+            # Only what is published from now on is relayed; older events are replayed on demand
+            self._position = self._max_id(self._connection())
+            for hub in self._hubs.values():
+                hub.start_at(self._position)
+            self._relay_pid = os.getpid()
+            threading.Thread(target=self._relay_loop, name='event-relay', daemon=True).start()
+
+    def _relay_loop(self):
+        conn = self._connection()
+        version = None
+        while not self._stop.is_set():
+            woken = self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            try:
+                current = conn.execute('PRAGMA data_version').fetchone()[0]
+                if woken or current != version:
+                    version = current
+                    while self._relay_once(conn) == RELAY_BATCH:
+                        pass
+                if self.clock() >= self._next_prune:
+                    self._next_prune = self.clock() + PRUNE_INTERVAL
+                    self.prune(conn)
+            except sqlite3.Error:
+                time.sleep(self.poll_interval)  # e.g. locked for longer than the timeout
+            except Exception as e:
+                # Anything else must not end delivery to every stream of this worker
+                self._relay_error('relay', e)
+                time.sleep(self.poll_interval)
+
+    def _relay_error(self, where, error):
+        self.errors += 1
+        self.last_error = f'{type(error).__name__}: {error}'
+        log_event('event_relay_error', where=where, error=self.last_error)
+
+    def _relay_once(self, conn):
+        rows = conn.execute(
+            'SELECT id, channel, type, data FROM events WHERE id > ? ORDER BY id LIMIT ?',
+            (self._position, RELAY_BATCH)).fetchall()
+        if not rows:
+            return 0
+        batches = {}
+        for event_id, channel, event_type, data in rows:
+            batches.setdefault(channel, []).append((event_id, event_type, data))
+        with self._deliver_lock:
+            with self._lock:
+                hubs = {channel: self._hubs.get(channel) for channel in batches}
+            for channel, batch in batches.items():
+                hub = hubs[channel]
+                if hub is None:
+                    continue
+                events = []
+                for event_id, event_type, data in batch:
+                    try:
+                        events.append(ChatEvent(event_id, event_type, json.loads(data)))
+                    except ValueError as e:
+                        self._relay_error(channel, e)  # skip the row, keep the rest
+                try:
+                    hub.deliver(events)
+                except Exception as e:
+                    # A failing hub loses this batch of its channel, not the other channels'
+                    # nor later batches: the position still moves past it
+                    self._relay_error(channel, e)
+            self._position = rows[-1][0]
+        self.relayed += len(rows)
+        return len(rows)
+
+    def prune(self, conn=None):
+        """Drop rows older than the retention or beyond max_events"""
+        conn = conn or self._connection()
+        cutoff = max(
+            conn.execute('SELECT COALESCE(MAX(id), 0) FROM events WHERE created < ?',
+                         (self.clock() - self.retention,)).fetchone()[0],
+            self._max_id(conn) - self.max_events,
+        )
+        if cutoff <= self._pruned_upto(conn):
+            return 0
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            deleted = conn.execute('DELETE FROM events WHERE id <= ?', (cutoff,)).rowcount
+            conn.execute("INSERT INTO meta (key, value) VALUES ('pruned_upto', ?) "
+                         "ON CONFLICT (key) DO UPDATE SET value = MAX(value, excluded.value)", (cutoff,))
+        return deleted
+
+    def stats(self):
+        return {
+            'position': self.head(),
+            'published': self.published,
+            'relayed': self.relayed,
+            'channels': len(self._hubs),
+            'errors': self.errors,
+            'error': self.last_error,
+        }
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+
+    def after_fork(self):
+        """In a forked child: no connections, threads, hubs or counters from the parent"""
+        self._hubs = {}
+        self._reset_process_state()
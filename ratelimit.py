@@ -0,0 +1,178 @@
+"""
+In-process token-bucket rate limiting for the API routes
+
+Each limited route has up to two buckets per caller: one keyed by the
+authenticated user and one by client IP. A bucket holds up to `burst`
+tokens and refills at `per_minute / 60` tokens per second; a request takes
+one token from each of its buckets, or none if any of them is empty, and is
+then refused with 429 and the time until the next token.
+
+Buckets live in an OrderedDict kept in last-use order, so a check is a
+dict lookup, a move_to_end and a little arithmetic on the bucket in place.
+A bucket that has been idle long enough to refill completely is identical
+to a new one and can be dropped; those are always at the front of the
+order, so cleanup pops from the front and stops at the first live bucket
+(amortized O(1), piggybacking on normal checks like presence expiry does).
+
+Limits are per process: with several gunicorn workers a caller can get up
+to one quota per worker.
+"""
+
+import math
+import threading
+from contextlib import nullcontext
+import time
+from collections import OrderedDict
+
+DEFAULT_SWEEP_INTERVAL = 5.0
+_NO_LOCK = nullcontext()
+
+
+class Bucket:
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, tokens, updated):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class TokenBucketLimiter:
+    """Token buckets with one shared rate and size, keyed by any hashable"""
+
+    def __init__(self, per_minute, burst, clock=time.monotonic, sweep_interval=DEFAULT_SWEEP_INTERVAL):
+        self.rate = per_minute / 60.0   # tokens per second
+        self.burst = burst
+        self.clock = clock
+        self.sweep_interval = sweep_interval
+        # An idle bucket is full again (same as a fresh one) after this long
+        self.idle_after = burst / self.rate
+
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()   # key -> Bucket, least recently used first
+        self._next_sweep = 0.0
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def hit(self, key):
+        """Take a token for `key`; return (allowed, remaining, retry_after seconds)"""
+        now = self.clock()
+        with self._lock:
+            bucket = self._refill(key, now)
+            if bucket.tokens >= 1:
+                bucket.tokens -= 1
+                return True, int(bucket.tokens), 0.0
+            return False, 0, self.retry_after(bucket)
+
+    def _refill(self, key, now):
+        """`key`'s bucket brought up to `now` (caller holds the lock)"""
+        if now >= self._next_sweep:
+            self._sweep(now)
+
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = Bucket(self.burst, now)
+        else:
+            self._buckets.move_to_end(key)
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+        return bucket
+
+    def retry_after(self, bucket):
+        """Seconds until `bucket` has a whole token"""
+        return max(0.0, (1 - bucket.tokens) / self.rate)
+
+    def reset_after(self, remaining):
+        """Seconds until a bucket with `remaining` tokens is full again"""
+        return (self.burst - remaining) / self.rate
+
+    def _sweep(self, now):
+        buckets = self._buckets
+        while buckets:
+            key, bucket = next(iter(buckets.items()))
+            if now - bucket.updated < self.idle_after:
+                break
+            del buckets[key]
+        self._next_sweep = now + self.sweep_interval
+
+
+class RateLimitResult:
+    __slots__ = ('allowed', 'limit', 'remaining', 'reset', 'retry_after')
+
+    def __init__(self, allowed, limit, remaining, reset, retry_after):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = remaining
+        self.reset = reset
+        self.retry_after = retry_after
+
+    def headers(self):
+        """RateLimit-* headers (IETF draft) plus Retry-After when refused"""
+        headers = {
+            'RateLimit-Limit': str(self.limit),
+            'RateLimit-Remaining': str(self.remaining),
+            'RateLimit-Reset': str(math.ceil(self.reset)),
+        }
+        if not self.allowed:
+            headers['Retry-After'] = str(max(1, math.ceil(self.retry_after)))
+        return headers
+
+
+class RouteRateLimiter:
+    """Per-route limits from config:
+
+        {"send_message": {"user": {"per_minute": 30, "burst": 10},
+                          "ip": {"per_minute": 120, "burst": 30}}, ...}
+    """
+
+    SCOPES = ('user', 'ip')
+
+    def __init__(self, routes, clock=time.monotonic):
+        self.routes = {}
+        for route, scopes in routes.items():
+            limiters = {
+                scope: TokenBucketLimiter(limit['per_minute'], limit['burst'], clock=clock)
+                for scope, limit in scopes.items() if scope in self.SCOPES and limit
+            }
+            if limiters:
+                self.routes[route] = limiters
+
+    def check(self, route, username=None, ip_address=None):
+        """RateLimitResult for one request, or None if the route isn't limited"""
+        limiters = self.routes.get(route)
+        if limiters is None:
+            return None
+
+        user = limiters.get('user') if username is not None else None
+        ip = limiters.get('ip') if ip_address is not None else None
+        if user is None and ip is None:
+            return None
+
+        # Both buckets are looked at under their locks and a token is taken
+        # only if both allow the request, so a refusal by one doesn't use up
+        # the other's quota. The locks are always taken user first.
+        now = (user if user is not None else ip).clock()
+        with user._lock if user is not None else _NO_LOCK, ip._lock if ip is not None else _NO_LOCK:
+            user_bucket = user._refill(username, now) if user is not None else None
+            ip_bucket = ip._refill(ip_address, now) if ip is not None else None
+            allowed = ((user_bucket is None or user_bucket.tokens >= 1)
+                       and (ip_bucket is None or ip_bucket.tokens >= 1))
+            if allowed:
+                if user_bucket is not None:
+                    user_bucket.tokens -= 1
+                if ip_bucket is not None:
+                    ip_bucket.tokens -= 1
+
+            # Report whichever bucket is closest to refusing
+            if ip_bucket is None or (user_bucket is not None and user_bucket.tokens <= ip_bucket.tokens):
+                limiter, bucket = user, user_bucket
+            else:
+                limiter, bucket = ip, ip_bucket
+            if allowed:
+                remaining = int(bucket.tokens)
+                retry_after = 0.0
+            else:
+                remaining = 0
+                retry_after = max(user.retry_after(user_bucket) if user_bucket is not None else 0.0,
+                                  ip.retry_after(ip_bucket) if ip_bucket is not None else 0.0)
+        return RateLimitResult(allowed, limiter.burst, remaining, limiter.reset_after(remaining), retry_after)
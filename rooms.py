@@ -0,0 +1,219 @@
+"""
+Named chat rooms, each with its own message log and event stream
+
+    data/messages/                    "general", the original global chat
+    data/rooms/<name>/segment-*.jsonl every other room
+
+Every room is a separate MessageStore (own directory, own lock file, own
+index) and a separate EventHub, so sending to one room never waits on a
+write, an index scan or the subscribers of another.
+
+Rooms are loaded on first use: the registry only creates the objects, and
+the store indexes its segments on its first read or write. Loaded rooms
+are kept in an OrderedDict in last-use order; rooms idle for longer than
+`idle_timeout`, or beyond `max_loaded`, are evicted from the front (their
+index, recent messages and event history are dropped, the files stay). Rooms with an open
+stream and "general" are never evicted. Like presence expiry, eviction
+piggybacks on normal lookups at most every `sweep_interval` seconds.
+
+With a `bus` (pubsub.EventBus) events are published through it, so every
+worker's hub for the room gets them, not just this process's.
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from events import EventHub
+from storage import DEFAULT_RECENT, MessageStore
+
+GENERAL = 'general'
+ROOM_NAME_RE = re.compile(r'^[a-z0-9][a-z0-9_-]{0,31}$')
+DEFAULT_IDLE_TIMEOUT = 10 * 60
+DEFAULT_MAX_LOADED = 64
+DEFAULT_SWEEP_INTERVAL = 30.0
+
+
+def valid_room_name(name):
+    return isinstance(name, str) and ROOM_NAME_RE.match(name) is not None
+
+
+class Room:
+    __slots__ = ('name', 'store', 'events', 'bus', 'subscribers', 'last_used')
+
+    def __init__(self, name, store, now, bus=None):
+        self.name = name
+        self.store = store
+        self.bus = bus
+        self.subscribers = 0    # open streams; a room being streamed isn't evicted
+        self.last_used = now
+        self.new_events()
+
+    def new_events(self):
+        self.events = EventHub()
+        if self.bus is not None:
+            self.bus.attach(self.name, self.events)
+
+    def publish(self, event_type, data):
+        """Send an event to the room's streams (in every worker, with a bus)"""
+        if self.bus is not None:
+            self.bus.publish(self.name, event_type, data)
+        else:
+            self.events.publish(event_type, data)
+
+
+class RoomRegistry:
+    def __init__(self, rooms_dir, general_dir, legacy_file=None, idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 max_loaded=DEFAULT_MAX_LOADED, sweep_interval=DEFAULT_SWEEP_INTERVAL, clock=time.monotonic,
+                 bus=None, recent_messages=DEFAULT_RECENT):
+        self.rooms_dir = Path(rooms_dir)
+        self.recent_messages = recent_messages
+        self.bus = bus
+        self.idle_timeout = idle_timeout
+        self.max_loaded = max_loaded
+        self.sweep_interval = sweep_interval
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._rooms = OrderedDict()   # name -> Room, least recently used first
+        self._next_sweep = 0.0
+        self.evictions = 0
+        # The global chat keeps its original location and is always loaded
+        general = MessageStore(general_dir, legacy_file=legacy_file, recent_size=recent_messages)
+        self.general = Room(GENERAL, general, clock(), bus)
+
+    def directory(self, name):
+        return self.rooms_dir / name
+
+    def exists(self, name):
+        if name == GENERAL:
+            return True
+        return valid_room_name(name) and (name in self._rooms or self.directory(name).is_dir())
+
+    def names(self):
+        """Every room on disk, "general" first"""
+        names = set()
+        if self.rooms_dir.is_dir():
+            names.update(p.name for p in self.rooms_dir.iterdir() if p.is_dir() and valid_room_name(p.name))
+        names.discard(GENERAL)
+        return [GENERAL] + sorted(names)
+
+    def is_loaded(self, name):
+        return name == GENERAL or name in self._rooms
+
+    def create(self, name):
+        """Create a room on disk; return False if it already exists"""
+        if not valid_room_name(name):
+            raise ValueError(name)
+        if self.exists(name):
+            return False
+        try:
+            self.directory(name).mkdir(parents=True)
+        except FileExistsError:
+            return False
+        return True
+
+    def get(self, name):
+        """The room (loading it if needed), or None if there is no such room"""
+        if name == GENERAL:
+            return self.general
+        now = self.clock()
+        with self._lock:
+            if now >= self._next_sweep:
+                self._sweep(now)
+            room = self._rooms.get(name)
+            if room is not None:
+                self._rooms.move_to_end(name)
+                room.last_used = now
+                return room
+        if not self.exists(name):
+            return None
+        with self._lock:
+            room = self._rooms.get(name)
+            if room is None:
+                store = MessageStore(self.directory(name), recent_size=self.recent_messages)
+                room = self._rooms[name] = Room(name, store, now, self.bus)
+                if len(self._rooms) > self.max_loaded:
+                    self._sweep(now)
+            return room
+
+    def get_or_create(self, name):
+        """The room, created on disk first if needed; None if `name` can't be a room"""
+        if not valid_room_name(name):
+            return None
+        self.create(name)
+        return self.get(name)
+
+    def iter_stores(self):
+        """(name, MessageStore) of every room on disk, "general" first, loading each in turn"""
+        for name in self.names():
+            room = self.get(name)
+            if room is not None:
+                yield name, room.store
+
+    def loaded(self, name):
+        """The room if it is loaded, without loading it or counting as a use"""
+        if name == GENERAL:
+            return self.general
+        with self._lock:
+            return self._rooms.get(name)
+
+    def stores(self):
+        """Message stores of the loaded rooms, "general" first"""
+        with self._lock:
+            return [self.general.store, *(room.store for room in self._rooms.values())]
+
+    # ----- streams -----
+
+    def open_stream(self, room):
+        if self.bus is not None:
+            self.bus.ensure_relay()  # before subscribing, so resumed ids are known
+        with self._lock:
+            room.subscribers += 1
+
+    def close_stream(self, room):
+        with self._lock:
+            room.subscribers -= 1
+            room.last_used = self.clock()
+
+    # ----- eviction -----
+
+    def _sweep(self, now):
+        rooms = self._rooms
+        for _ in range(len(rooms)):
+            name, room = next(iter(rooms.items()))
+            overfull = len(rooms) > self.max_loaded
+            if not overfull and now - room.last_used < self.idle_timeout:
+                break
+            if room.subscribers:
+                rooms.move_to_end(name)  # streamed right now, so recently used anyway
+                continue
+            del rooms[name]
+            room.store.close()
+            if self.bus is not None:
+                self.bus.detach(name)
+            self.evictions += 1
+        self._next_sweep = now + self.sweep_interval
+
+    def stats(self):
+        total = len(self.names())
+        with self._lock:
+            rooms = [self.general, *self._rooms.values()]
+            return {
+                'rooms': total,
+                'loaded': len(rooms),
+                'streaming': sum(1 for room in rooms if room.subscribers),
+                'evictions': self.evictions,
+            }
+
+    def after_fork(self):
+        """Fresh locks and event hubs in a forked child; indexes stay shared copy-on-write"""
+        self._lock = threading.Lock()
+        if self.bus is not None:
+            self.bus.after_fork()
+        for room in [self.general, *self._rooms.values()]:
+            room.store.after_fork()
+            room.new_events()
+            room.subscribers = 0
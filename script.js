@@ -15,19 +15,21 @@ class ChatApplication {
         this.requestDelay = 1000; // 1 секунда между запросами
         this.lastRequestTime = 0;
         
-        this.currentChatId = 1;
+        // AI-разговоры хранятся на сервере (/api/ai/chats): список приходит
+        // страницами без сообщений, сообщения чата - окнами по мере прокрутки
+        this.currentChatId = null;
         this.conversationHistory = [];
-        this.chats = {
-            1: {
-                id: 1,
-                title: 'Первый разговор',
-                messages: []
-            }
-        };
+        this.chats = {};
+        this.chatsCursor = null;
+        this.localChatId = 0;
         
         this.currentView = 'ai-chat';
         this.globalMessages = [];
         this.globalChatPolling = null;
+        this.presenceClientId = null;
+        this.presenceHeartbeat = null;
+        this.typingSentAt = 0;
+        this.typingStream = null;
 
         this.initializeElements();
         this.attachEventListeners();
@@ -89,7 +91,10 @@ class ChatApplication {
                 this.sendGlobalMessage();
             }
         });
-        this.globalMessageInput.addEventListener('input', () => this.autoResizeTextarea(this.globalMessageInput));
+        this.globalMessageInput.addEventListener('input', () => {
+            this.autoResizeTextarea(this.globalMessageInput);
+            this.sendTyping();
+        });
 
         // Sidebar tabs
         document.querySelectorAll('.sidebar-tab').forEach(btn => {
@@ -113,7 +118,7 @@ class ChatApplication {
         this.attachMobileMenuHandlers();
 
         // Chat history
-        this.updateChatHistory();
+        this.loadChatList();
     }
 
     switchView(view) {
@@ -143,6 +148,8 @@ class ChatApplication {
             if (this.globalChatPolling) {
                 clearInterval(this.globalChatPolling);
             }
+            this.stopPresence();
+            this.stopTypingStream();
         } else {
             document.getElementById('globalChatView').classList.add('active');
             document.getElementById('aiChatHistory').style.display = 'none';
@@ -152,6 +159,8 @@ class ChatApplication {
             
             // Start polling for new messages
             this.globalChatPolling = setInterval(() => this.loadGlobalChat(), 3000);
+            this.startPresence();
+            this.startTypingStream();
         }
 
         // Close mobile menu
@@ -223,19 +232,77 @@ class ChatApplication {
         textarea.style.height = Math.min(textarea.scrollHeight, 200) + 'px';
     }
 
-    createNewChat() {
-        this.currentChatId = Math.max(...Object.keys(this.chats).map(Number)) + 1;
-        this.chats[this.currentChatId] = {
-            id: this.currentChatId,
+    async aiHistoryRequest(path, options = {}) {
+        // null if the server has no history for us (offline, logged out, disabled)
+        try {
+            const response = await fetch(`${this.serverUrl}/ai/chats${path}`, {
+                headers: this.getAuthHeaders(),
+                credentials: 'include',
+                ...options
+            });
+            return response.ok ? await response.json() : null;
+        } catch (error) {
+            console.error('AI history error:', error);
+            return null;
+        }
+    }
+
+    async loadChatList() {
+        const cursor = this.chatsCursor ? `&cursor=${encodeURIComponent(this.chatsCursor)}` : '';
+        const page = await this.aiHistoryRequest(`?limit=30${cursor}`);
+        if (page) {
+            page.chats.forEach(chat => {
+                this.chats[chat.id] = { ...chat, messages: null, start: 0, saved: true };
+            });
+            this.chatsCursor = page.next;
+        }
+
+        if (this.currentChatId === null) {
+            const newest = page && page.chats[0];
+            if (newest) {
+                await this.switchChat(newest.id);
+            } else {
+                await this.createNewChat();
+            }
+        } else {
+            this.updateChatHistory();
+        }
+    }
+
+    async createNewChat() {
+        const chat = await this.aiHistoryRequest('', {
+            method: 'POST',
+            body: JSON.stringify({ title: 'Новый разговор' })
+        });
+        const id = chat ? chat.id : `local-${++this.localChatId}`;
+        this.chats[id] = {
+            id,
             title: 'Новый разговор',
-            messages: []
+            updated: Date.now() / 1000,
+            messages: [],
+            start: 0,
+            saved: Boolean(chat)
         };
+        this.currentChatId = id;
         this.conversationHistory = [];
         this.renderChatMessages();
         this.updateChatHistory();
         this.messageInput.focus();
     }
 
+    saveChatTurns(chatId, turns, title) {
+        const chat = this.chats[chatId];
+        if (!chat || !chat.saved) return;
+
+        this.aiHistoryRequest(`/${chatId}/messages`, {
+            method: 'POST',
+            body: JSON.stringify({ messages: turns })
+        });
+        if (title) {
+            this.aiHistoryRequest(`/${chatId}`, { method: 'PUT', body: JSON.stringify({ title }) });
+        }
+    }
+
     // ============= AI CHAT =============
 
     async sendAIMessage() {
@@ -281,16 +348,21 @@ class ChatApplication {
                 content: response
             });
 
-            this.chats[this.currentChatId].messages.push(
+            const turns = [
                 { role: 'user', content: message },
                 { role: 'assistant', content: response }
-            );
-
-            if (this.chats[this.currentChatId].messages.length === 2) {
-                const title = message.substring(0, 30) + (message.length > 30 ? '...' : '');
-                this.chats[this.currentChatId].title = title;
+            ];
+            const chat = this.chats[this.currentChatId];
+            chat.messages.push(...turns);
+            chat.updated = Date.now() / 1000;
+
+            let title = null;
+            if (chat.start + chat.messages.length === 2) {
+                title = message.substring(0, 30) + (message.length > 30 ? '...' : '');
+                chat.title = title;
                 this.updateChatHistory();
             }
+            this.saveChatTurns(chat.id, turns, title);
 
         } catch (error) {
             console.error('Error:', error);
@@ -327,8 +399,9 @@ class ChatApplication {
             throw new Error('❌ Ollama не запущена!\n\n💡 Решение:\n1. Откройте приложение Ollama\n2. Выполните: ollama run mistral\n3. Оставьте окно открытым');
         }
 
-        // Ограничить историю - отправляем только последние 5 сообщений
-        const recentHistory = this.conversationHistory.slice(-10);
+        // Длинную историю сервер сам сжимает до бюджета контекста (старые сообщения
+        // заменяются кратким содержанием), здесь только ограничиваем размер запроса
+        const recentHistory = this.conversationHistory.slice(-40);
 
         const messages = [
             {
@@ -354,6 +427,7 @@ class ChatApplication {
                 },
                 body: JSON.stringify({
                     model: this.ollamaModel,
+                    chat_id: this.currentChatId,
                     messages: messages,
                     stream: false,
                     options: {
@@ -541,7 +615,8 @@ class ChatApplication {
         const historyContainer = document.getElementById('aiChatHistory');
         historyContainer.innerHTML = '';
 
-        Object.values(this.chats).reverse().forEach(chat => {
+        // Recently used first, like the server's pages
+        Object.values(this.chats).sort((a, b) => b.updated - a.updated).forEach(chat => {
             const historyItem = document.createElement('div');
             historyItem.className = `history-item ${chat.id === this.currentChatId ? 'active' : ''}`;
             historyItem.dataset.chatId = chat.id;
@@ -567,13 +642,48 @@ class ChatApplication {
 
             historyContainer.appendChild(historyItem);
         });
+
+        if (this.chatsCursor) {
+            const moreBtn = document.createElement('div');
+            moreBtn.className = 'history-item history-more';
+            moreBtn.textContent = 'Показать ещё...';
+            moreBtn.addEventListener('click', () => this.loadChatList());
+            historyContainer.appendChild(moreBtn);
+        }
+    }
+
+    async loadChatWindow(chat) {
+        // The newest messages first, older ones on request
+        const before = chat.messages === null ? '' : `&before=${chat.start}`;
+        const window = await this.aiHistoryRequest(`/${chat.id}/messages?limit=50${before}`);
+        if (!window) {
+            chat.messages = chat.messages || [];
+            return;
+        }
+        chat.messages = [...window.messages, ...(chat.messages || [])];
+        chat.start = window.start;
     }
 
-    switchChat(chatId) {
+    async switchChat(chatId) {
+        const chat = this.chats[chatId];
+        if (chat.messages === null) {
+            await this.loadChatWindow(chat);
+        }
         this.currentChatId = chatId;
-        this.conversationHistory = [...(this.chats[chatId].messages || [])];
+        this.conversationHistory = chat.messages.map(({ role, content }) => ({ role, content }));
         
         this.chatMessages.innerHTML = '';
+
+        if (chat.start > 0) {
+            const earlierBtn = document.createElement('button');
+            earlierBtn.className = 'load-earlier-btn';
+            earlierBtn.textContent = 'Загрузить более ранние сообщения';
+            earlierBtn.addEventListener('click', async () => {
+                await this.loadChatWindow(chat);
+                this.switchChat(chatId);
+            });
+            this.chatMessages.appendChild(earlierBtn);
+        }
         
         if (this.conversationHistory.length === 0) {
             this.chatMessages.innerHTML = `
@@ -586,7 +696,7 @@ class ChatApplication {
             `;
         } else {
             this.conversationHistory.forEach(msg => {
-                this.addMessage(msg.content, msg.role);
+                this.addMessage(msg.content, msg.role === 'assistant' ? 'ai' : msg.role);
             });
         }
         
@@ -599,6 +709,9 @@ class ChatApplication {
             return;
         }
 
+        if (this.chats[chatId].saved) {
+            this.aiHistoryRequest(`/${chatId}`, { method: 'DELETE' });
+        }
         delete this.chats[chatId];
         
         if (this.currentChatId === chatId) {
@@ -670,26 +783,181 @@ class ChatApplication {
         }
     }
 
+    async batch(requests) {
+        // Several API calls in one round trip (/api/batch)
+        const response = await fetch(`${this.serverUrl}/batch`, {
+            method: 'POST',
+            headers: this.getAuthHeaders(),
+            credentials: 'include',
+            body: JSON.stringify({ requests })
+        });
+
+        if (!response.ok) {
+            throw new Error('Batch request failed');
+        }
+
+        const data = await response.json();
+        return data.responses;
+    }
+
     async loadGlobalChat() {
         try {
-            const response = await fetch(`${this.serverUrl}/chat/messages?limit=50`, {
-                headers: this.getAuthHeaders(),
-                credentials: 'include'
-            });
+            const [messages, online] = await this.batch([
+                { path: '/api/chat/messages', params: { limit: 50 } },
+                { path: '/api/clients/online' }
+            ]);
 
-            if (!response.ok) {
+            if (messages.status !== 200) {
                 throw new Error('Failed to load messages');
             }
 
-            const messages = await response.json();
-            this.globalMessages = messages;
+            this.globalMessages = messages.body;
             this.renderGlobalChat();
 
+            if (online.status === 200) {
+                this.renderOnlineUsers(online.body.users);
+            }
+
         } catch (error) {
             console.error('Error loading chat:', error);
         }
     }
 
+    // ============= PRESENCE =============
+
+    async startPresence() {
+        if (this.presenceClientId) return;
+
+        try {
+            const response = await fetch(`${this.serverUrl}/clients/connect`, {
+                method: 'POST',
+                headers: this.getAuthHeaders(),
+                credentials: 'include',
+                body: JSON.stringify({ device_info: { app: 'Alit Web', user_agent: navigator.userAgent } })
+            });
+            if (!response.ok) return;
+
+            const data = await response.json();
+            this.presenceClientId = data.session.client_id;
+
+            clearInterval(this.presenceHeartbeat);
+            this.presenceHeartbeat = setInterval(
+                () => this.sendPresenceHeartbeat(),
+                data.session.heartbeat_interval * 1000
+            );
+            this.loadOnlineUsers();
+        } catch (error) {
+            console.error('Presence connect error:', error);
+        }
+    }
+
+    async sendPresenceHeartbeat() {
+        if (!this.presenceClientId) return;
+
+        try {
+            const response = await fetch(`${this.serverUrl}/clients/heartbeat`, {
+                method: 'POST',
+                headers: this.getAuthHeaders(),
+                credentials: 'include',
+                body: JSON.stringify({ client_id: this.presenceClientId })
+            });
+
+            // Expired on the server (e.g. the tab slept) - connect again
+            if (response.status === 404) {
+                this.presenceClientId = null;
+                this.startPresence();
+            }
+        } catch (error) {
+            console.error('Presence heartbeat error:', error);
+        }
+    }
+
+    stopPresence() {
+        clearInterval(this.presenceHeartbeat);
+        this.presenceHeartbeat = null;
+
+        if (!this.presenceClientId) return;
+        const clientId = this.presenceClientId;
+        this.presenceClientId = null;
+
+        fetch(`${this.serverUrl}/clients/disconnect`, {
+            method: 'POST',
+            headers: this.getAuthHeaders(),
+            credentials: 'include',
+            body: JSON.stringify({ client_id: clientId })
+        }).catch(error => console.error('Presence disconnect error:', error));
+    }
+
+    // ============= TYPING INDICATOR =============
+
+    sendTyping() {
+        // The server ignores updates closer than 2 s anyway
+        const now = Date.now();
+        if (now - this.typingSentAt < 2000) return;
+        this.typingSentAt = now;
+
+        fetch(`${this.serverUrl}/chat/typing`, {
+            method: 'POST',
+            headers: this.getAuthHeaders(),
+            credentials: 'include',
+            body: JSON.stringify({ typing: true })
+        }).catch(error => console.error('Typing error:', error));
+    }
+
+    startTypingStream() {
+        if (this.typingStream || typeof EventSource === 'undefined') return;
+
+        this.typingStream = new EventSource(`${this.serverUrl}/chat/stream`, { withCredentials: true });
+        this.typingStream.addEventListener('typing', (e) => this.renderTyping(JSON.parse(e.data).users));
+    }
+
+    stopTypingStream() {
+        if (this.typingStream) {
+            this.typingStream.close();
+            this.typingStream = null;
+        }
+        this.renderTyping([]);
+    }
+
+    renderTyping(users) {
+        const indicator = document.getElementById('globalTyping');
+        if (!indicator) return;
+
+        const me = JSON.parse(localStorage.getItem('user') || '{}').username;
+        const others = users.filter(name => name !== me);
+        indicator.textContent = others.length === 0 ? ''
+            : others.length === 1 ? `${others[0]} печатает...`
+            : `${others.join(', ')} печатают...`;
+    }
+
+    async loadOnlineUsers() {
+        try {
+            const response = await fetch(`${this.serverUrl}/clients/online`, {
+                headers: this.getAuthHeaders(),
+                credentials: 'include'
+            });
+            if (!response.ok) return;
+
+            const data = await response.json();
+            this.renderOnlineUsers(data.users);
+        } catch (error) {
+            console.error('Error loading online users:', error);
+        }
+    }
+
+    renderOnlineUsers(users) {
+        const usersList = document.getElementById('usersList');
+        if (!usersList) return;
+
+        usersList.innerHTML = '';
+        users.forEach(user => {
+            const item = document.createElement('div');
+            item.className = 'user-item';
+            item.textContent = `🟢 ${user.username}`;
+            usersList.appendChild(item);
+        });
+    }
+
     renderGlobalChat() {
         this.globalChatMessages.innerHTML = '';
 
@@ -1,69 +1,444 @@
-from flask import Flask, request, jsonify, session, send_from_directory
-from flask_cors import CORS
+"""
+Flask server for Alit: auth, chat rooms, presence and the Ollama proxy
+
+Importing this module has no side effects. `create_app(config)` builds the
+application; it reads config.json once, and the data directory, message
+log and in-memory registries are only touched on first use. Per-app state
+lives in `AppServices` (app.extensions['alit']); `message_store`,
+`presence` and `chat_events` below are proxies to the current app's (the
+store and events of the "general" room).
+
+With gunicorn `--preload` the app is built once in the master and forked
+into workers, which share its memory copy-on-write. Inherited file handles
+and locks are reset in every child right after the fork.
+"""
+
+from flask import Blueprint, Flask, Response, current_app, g, has_app_context, request, jsonify, session, send_from_directory, stream_with_context
+from werkzeug.local import LocalProxy
 from werkzeug.security import generate_password_hash, check_password_hash
+import copy
 import json
+import math
 import os
+import threading
+import time
+import weakref
 from datetime import datetime
 import uuid
 from pathlib import Path
 
-app = Flask(__name__, static_folder='.', static_url_path='')
-app.secret_key = 'your-secret-key-change-this-in-production'
-
-# Configure session
-app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
-app.config['SESSION_COOKIE_SECURE'] = False  # Allow HTTP in development
-app.config['PERMANENT_SESSION_LIFETIME'] = 7 * 24 * 60 * 60  # 7 days
-
-# Configure CORS properly
-# Note: For same-origin (localhost), cookies are sent automatically
-# For cross-origin, we need credentials support
-cors_config = {
-    "origins": ["http://localhost:5000", "http://127.0.0.1:5000", "http://localhost", "http://127.0.0.1"],
-    "allow_headers": ['Content-Type', 'Authorization'],
-    "methods": ['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'],
-    "supports_credentials": True
+from accesslog import AccessLog, LogHandler
+from aichats import DEFAULT_PAGE, DEFAULT_WINDOW, ChatHistory, clean_title, valid_messages
+from backup import BackupManager
+from chatstats import DEFAULT_TOP, ChatStats
+from compaction import Compactor
+from ollama_pool import NoBackendError, OllamaPool
+from presence import PresenceRegistry
+from pubsub import EventBus
+from ratelimit import RouteRateLimiter
+from rooms import GENERAL, RoomRegistry, valid_room_name
+from storage import FileLock, write_json_atomic
+from summarizer import ContextBudget
+from timing import Timings, log_event, request_id, setup_logging
+from tokens import TokenStore
+from typing_state import TypingTracker
+
+APP_DIR = Path(__file__).parent
+CONFIG_FILE = APP_DIR / 'config.json'
+
+DEFAULT_CONFIG = {
+    'server': {
+        'host': '0.0.0.0',
+        'port': 5000,
+        'debug': False,
+        'secret_key': 'your-secret-key-change-this-in-production',
+        # Session cookies and auth tokens expire this long after last use
+        'session_lifetime': 7 * 24 * 60 * 60,
+        # For same-origin (localhost) cookies are sent automatically;
+        # cross-origin callers need credentials support
+        'cors_origins': [
+            'http://localhost:5000', 'http://127.0.0.1:5000', 'http://localhost', 'http://127.0.0.1',
+            'http://192.168.0.129:5000', 'http://192.168.0.129'
+        ]
+    },
+    'data': {
+        'data_dir': './data',
+        # Backups into data/backups every backup_interval seconds: a full one
+        # every backup_full_every-th time, incremental in between; the newest
+        # backup_keep full backups (with their incrementals) are kept
+        'auto_backup': False,
+        'backup_interval': 60 * 60,
+        'backup_full_every': 24,
+        'backup_keep': 3
+    },
+    # Message logs of loaded rooms are rewritten without deleted messages
+    # once they are over min_bytes and `ratio` of their records are dead;
+    # max_age (seconds, 0 = never) also drops messages older than that
+    'compaction': {
+        'enabled': True,
+        'interval': 10 * 60,
+        'ratio': 0.3,
+        'min_bytes': 4 * 1024 * 1024,
+        'max_age': 0
+    },
+    # Rooms other than "general" are loaded on first use and evicted when idle
+    'rooms': {
+        'idle_timeout': 10 * 60,
+        'max_loaded': 64,
+        # Newest messages per loaded room kept in memory for GET .../messages
+        'recent_messages': 200
+    },
+    # /api/admin/stats: per-room aggregates kept up with the message logs,
+    # written to data/stats every persist_interval seconds
+    'stats': {
+        'enabled': True,
+        'interval': 5,
+        'persist_interval': 60,
+        'days': 90
+    },
+    'features': {
+        'typing_indicator': True
+    },
+    # Typing indicators live in memory: a typer expires after ttl seconds,
+    # updates closer than min_interval are ignored, and each room gets at
+    # most one "typing" stream event per interval
+    'typing': {
+        'ttl': 6,
+        'interval': 0.5,
+        'min_interval': 2
+    },
+    # Chat events go through a SQLite notification log shared by all workers
+    # (data/events.sqlite3); with "shared": false each process only sees its own
+    'events': {
+        'shared': True,
+        'poll_interval': 0.05,
+        'retention': 60 * 60,
+        'max_events': 100_000
+    },
+    'ai': {
+        # Ollama upstream (OLLAMA_URL wins; point it at fake_ollama.py for benchmarks)
+        'ollama_url': 'http://localhost:11434',
+        # Several upstreams instead (or OLLAMA_URL=url1,url2): least loaded one
+        # that has the model wins, failing ones are ejected for a while
+        'backends': [],
+        'health_interval': 10,
+        'eject_after': 3,
+        'eject_for': 30,
+        # Prompts over max_tokens (estimated) keep the last keep_recent turns;
+        # older ones are replaced by a rolling summary made in the background
+        'context': {
+            'enabled': True,
+            'max_tokens': 3000,
+            'keep_recent': 6,
+            'summary_tokens': 256,
+            'cache_size': 1000
+        },
+        # AI conversations stored per user in data/ai_chats (/api/ai/chats);
+        # chat lists of the last cache_users users stay in memory
+        'history': {
+            'enabled': True,
+            'cache_users': 1000
+        }
+    },
+    # JSON lines in data/logs/access.jsonl, written by a background thread;
+    # "sample" keeps only that share of a route's successful requests
+    'access_log': {
+        'enabled': True,
+        'max_bytes': 50 * 1024 * 1024,
+        'rotate_interval': 24 * 60 * 60,
+        'backups': 5,
+        'queue_size': 10_000,
+        'sample': {
+            'client_heartbeat': 0.1,
+            'online_users': 0.1,
+            'get_messages': 0.2,
+            'set_typing': 0.1
+        }
+    },
+    # Token buckets per route (view function name), per user and per client IP
+    'rate_limits': {
+        'enabled': True,
+        'routes': {
+            'register': {'ip': {'per_minute': 5, 'burst': 5}},
+            'login': {'ip': {'per_minute': 20, 'burst': 10}},
+            'send_message': {'user': {'per_minute': 30, 'burst': 10},
+                             'ip': {'per_minute': 300, 'burst': 60}},
+            'delete_message': {'user': {'per_minute': 60, 'burst': 20}},
+            'delete_author_messages': {'user': {'per_minute': 5, 'burst': 5}},
+            'create_room': {'user': {'per_minute': 5, 'burst': 5}},
+            'create_ai_chat': {'user': {'per_minute': 30, 'burst': 10}},
+            'append_ai_messages': {'user': {'per_minute': 60, 'burst': 20}},
+            'ollama_chat_proxy': {'user': {'per_minute': 10, 'burst': 3},
+                                  'ip': {'per_minute': 30, 'burst': 5}},
+        }
+    }
 }
 
-# Add local network IP
-cors_config["origins"].append("http://192.168.0.129:5000")
-cors_config["origins"].append("http://192.168.0.129")
-
-CORS(app, 
-     resources={r"/api/*": cors_config},
-     send_wildcard=False)
-
-# Data storage paths
-DATA_DIR = Path(__file__).parent / 'data'
-USERS_FILE = DATA_DIR / 'users.json'
-MESSAGES_FILE = DATA_DIR / 'messages.json'
-
-# Create data directory if it doesn't exist
-DATA_DIR.mkdir(exist_ok=True)
+STREAM_KEEPALIVE = 15  # seconds between SSE keepalive comments
 
-# Initialize data files
-if not USERS_FILE.exists():
-    USERS_FILE.write_text('{}')
 
-if not MESSAGES_FILE.exists():
-    MESSAGES_FILE.write_text('[]')
+def merge_config(base, override):
+    """Recursively merge `override` into a copy of `base`"""
+    merged = copy.deepcopy(base)
+    for key, value in (override or {}).items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_config(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def load_config(path=CONFIG_FILE):
+    """DEFAULT_CONFIG overlaid with a JSON config file (if it exists)"""
+    path = Path(path)
+    if not path.exists():
+        return copy.deepcopy(DEFAULT_CONFIG)
+    with open(path, 'r', encoding='utf-8') as f:
+        return merge_config(DEFAULT_CONFIG, json.load(f))
+
+
+class AppServices:
+    """Everything the routes share within one app: paths, storage, registries"""
+
+    def __init__(self, config):
+        self.config = config
+        data_dir = Path(config['data']['data_dir'])
+        self.data_dir = data_dir if data_dir.is_absolute() else (APP_DIR / data_dir).resolve()
+        self.users_file = self.data_dir / 'users.json'
+        self.messages_dir = self.data_dir / 'messages'
+        self.legacy_messages_file = self.data_dir / 'messages.json'  # migrated into messages_dir
+        self.rooms_dir = self.data_dir / 'rooms'
+        self.events_file = self.data_dir / 'events.sqlite3'
+        self.tokens_file = self.data_dir / 'tokens.jsonl'
+        self.access_log_file = self.data_dir / 'logs' / 'access.jsonl'
+        self.backup_dir = self.data_dir / 'backups'
+        self.ai_chats_dir = self.data_dir / 'ai_chats'
+        self.stats_dir = self.data_dir / 'stats'
+
+        # Users allowed to call /api/admin/* (besides users with "is_admin": true)
+        self.admin_usernames = {
+            name.strip() for name in os.environ.get('ALIT_ADMINS', '').split(',') if name.strip()
+        }
+        ai = config['ai']
+        urls = [url.strip() for url in os.environ.get('OLLAMA_URL', '').split(',') if url.strip()]
+        urls = urls or ai['backends'] or [ai['ollama_url']]
+        self.ollama = OllamaPool(urls, health_interval=ai['health_interval'],
+                                 eject_after=ai['eject_after'], eject_for=ai['eject_for'])
+        self.ollama_url = self.ollama.primary_url
+        context = ai['context']
+        self.context_budget = ContextBudget(
+            self.ollama, max_tokens=context['max_tokens'], keep_recent=context['keep_recent'],
+            summary_tokens=context['summary_tokens'], cache_size=context['cache_size'],
+        ) if context['enabled'] else None
+        self.ai_history = ChatHistory(self.ai_chats_dir, cache_users=ai['history']['cache_users']) \
+            if ai['history']['enabled'] else None
+
+        events = config['events']
+        self.event_bus = EventBus(self.events_file, poll_interval=events['poll_interval'],
+                                  retention=events['retention'],
+                                  max_events=events['max_events']) if events['shared'] else None
+        # One append-only message log per room (each opened on first use)
+        self.rooms = RoomRegistry(self.rooms_dir, self.messages_dir, legacy_file=self.legacy_messages_file,
+                                  idle_timeout=config['rooms']['idle_timeout'],
+                                  max_loaded=config['rooms']['max_loaded'],
+                                  recent_messages=config['rooms']['recent_messages'],
+                                  bus=self.event_bus)
+        self.message_store = self.rooms.general.store
+
+        log = config['access_log']
+        self.access_log = AccessLog(
+            self.access_log_file, max_bytes=log['max_bytes'], rotate_interval=log['rotate_interval'],
+            backups=log['backups'], queue_size=log['queue_size'],
+            # Keyed by endpoint as Flask names it, like the rate limits
+            sample={f'{bp.name}.{route}': rate for route, rate in log['sample'].items()},
+        ) if log['enabled'] else None
+
+        data = config['data']
+        self.backups = BackupManager(
+            self.data_dir, self.backup_dir, interval=data['backup_interval'],
+            full_every=data['backup_full_every'], keep_full=data['backup_keep'],
+        ) if data['auto_backup'] else None
+
+        compaction = config['compaction']
+        self.compactor = Compactor(
+            self.rooms.stores, interval=compaction['interval'], ratio=compaction['ratio'],
+            min_bytes=compaction['min_bytes'], max_age=compaction['max_age'],
+        ) if compaction['enabled'] else None
+
+        stats = config['stats']
+        self.chat_stats = ChatStats(
+            self.rooms, self.stats_dir, interval=stats['interval'], persist_interval=stats['persist_interval'],
+            days=stats['days'],
+        ) if stats['enabled'] else None
+
+        typing = config['typing']
+        self.typing = TypingTracker(
+            self._publish_typing, ttl=typing['ttl'], interval=typing['interval'],
+            min_interval=typing['min_interval'],
+        ) if config['features']['typing_indicator'] else None
+        self._reset_process_state()
+
+    def _publish_typing(self, name, users):
+        # Rooms evicted meanwhile have no streams to tell
+        room = self.rooms.loaded(name)
+        if room is not None:
+            room.events.publish_ephemeral('typing', {'users': users})
+
+    def _build_rate_limiter(self):
+        limits = self.config['rate_limits']
+        if not limits.get('enabled'):
+            return None
+        # Keyed by endpoint as Flask names it, so the hot path does no string work
+        return RouteRateLimiter({f'{bp.name}.{route}': scopes for route, scopes in limits['routes'].items()})
+
+    def _reset_process_state(self):
+        # Connected clients are in memory, shared between workers through the event bus
+        self.presence = PresenceRegistry(bus=self.event_bus)
+        self.chat_events = self.rooms.general.events
+        # Serialize read-modify-write cycles on users.json across threads and workers
+        self.users_lock = FileLock(self.data_dir / 'users.json.lock')
+        # Tokens that predate the token store are moved out of users.json on first use
+        self.token_store = TokenStore(self.tokens_file, ttl=self.config['server']['session_lifetime'],
+                                      legacy_users_file=self.users_file, users_lock=self.users_lock)
+        self.rate_limiter = self._build_rate_limiter()
+        # Reported by /api/health so a supervisor can tell fresh workers from old ones
+        self.started_at = time.time()
+
+    def after_fork(self):
+        """Called in a forked child: drop state that must not be shared with the parent"""
+        self.rooms.after_fork()
+        self.ollama.after_fork()
+        if self.context_budget is not None:
+            self.context_budget.after_fork()
+        if self.access_log is not None:
+            self.access_log.after_fork()
+        if self.backups is not None:
+            self.backups.after_fork()
+        if self.compactor is not None:
+            self.compactor.after_fork()
+        if self.typing is not None:
+            self.typing.after_fork()
+        if self.ai_history is not None:
+            self.ai_history.after_fork()
+        if self.chat_stats is not None:
+            self.chat_stats.after_fork()
+        self._reset_process_state()
+
+
+def _after_fork_in_child(ref):
+    services = ref()
+    if services is not None:
+        services.after_fork()
+
+
+def services():
+    return current_app.extensions['alit']
+
+
+message_store = LocalProxy(lambda: services().message_store)
+presence = LocalProxy(lambda: services().presence)
+chat_events = LocalProxy(lambda: services().chat_events)
+
+bp = Blueprint('alit', __name__)
+
+
+def create_app(config=None):
+    """Build the Flask app
+
+    `config` is a dict merged over config.json, or the path of another
+    JSON config file to use instead.
+    """
+    if isinstance(config, (str, Path)):
+        config = load_config(config)
+    else:
+        config = merge_config(load_config(), config)
+
+    app = Flask(__name__, static_folder='.', static_url_path='')
+    app.secret_key = config['server']['secret_key']
+
+    # Configure session
+    app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
+    app.config['SESSION_COOKIE_SECURE'] = False  # Allow HTTP in development
+    app.config['PERMANENT_SESSION_LIFETIME'] = config['server']['session_lifetime']
+    app.config['ALIT'] = config
+
+    from flask_cors import CORS
+    CORS(app,
+         resources={r"/api/*": {
+             "origins": config['server']['cors_origins'],
+             "allow_headers": ['Content-Type', 'Authorization'],
+             "methods": ['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'],
+             "supports_credentials": True
+         }},
+         send_wildcard=False)
+
+    app_services = AppServices(config)
+    app.extensions['alit'] = app_services
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=lambda ref=weakref.ref(app_services): _after_fork_in_child(ref))
+
+    setup_logging(LogHandler(app_services.access_log) if app_services.access_log else None)
+    app.register_blueprint(bp)
+    return app
+
+
+_default_app = None
+_default_app_lock = threading.Lock()
+
+
+def __getattr__(name):
+    # `server.app` (gunicorn server:app, `from server import app`) builds the
+    # default app on first access instead of at import time
+    global _default_app
+    if name == 'app':
+        with _default_app_lock:
+            if _default_app is None:
+                _default_app = create_app()
+        return _default_app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def load_users():
     """Load users from JSON file"""
     try:
-        with open(USERS_FILE, 'r', encoding='utf-8') as f:
+        with open(services().users_file, 'r', encoding='utf-8') as f:
             return json.load(f)
     except:
         return {}
 
 def save_users(users):
     """Save users to JSON file"""
-    with open(USERS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(users, f, ensure_ascii=False, indent=2)
-
-def generate_token():
-    """Generate a simple auth token"""
-    return str(uuid.uuid4())
+    write_json_atomic(services().users_file, users)
+    invalidate_request_cache('users')
+
+def request_cache():
+    """Per-request memo; sub-requests of /api/batch share it through `g`"""
+    cache = g.get('_request_cache')
+    if cache is None:
+        cache = g._request_cache = {}
+    return cache
+
+def invalidate_request_cache(*keys):
+    if has_app_context():
+        cache = request_cache()
+        for key in keys:
+            cache.pop(key, None)
+
+def cached_users():
+    """load_users() memoized for the current request - read-only use"""
+    cache = request_cache()
+    if 'users' not in cache:
+        cache['users'] = load_users()
+    return cache['users']
+
+def issue_token(username):
+    """New auth token for this device (other devices keep theirs)"""
+    return services().token_store.issue(username, request.headers.get('User-Agent'))
+
+def bearer_token():
+    auth_header = request.headers.get('Authorization', '')
+    if auth_header.startswith('Bearer '):
+        return auth_header.split(' ', 1)[1]
+    return None
 
 def get_authenticated_username():
     """Return username from session or Bearer token (Authorization header)"""
@@ -72,48 +447,120 @@ def get_authenticated_username():
         return session['username']
 
     # Try Authorization: Bearer <token>
-    auth_header = request.headers.get('Authorization', '')
-    if auth_header.startswith('Bearer '):
-        token = auth_header.split(' ', 1)[1]
-        users = load_users()
-        for username, info in users.items():
-            if info.get('token') == token:
-                return username
+    token = bearer_token()
+    if token:
+        tokens = request_cache().setdefault('tokens', {})
+        if token not in tokens:
+            tokens[token] = services().token_store.lookup(token)
+        return tokens[token]
 
     return None
 
 def load_messages():
-    """Load messages from JSON file"""
-    try:
-        with open(MESSAGES_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except:
-        return []
+    """Load every message into a list (tools only - routes read the store directly)"""
+    return list(message_store.iter_messages())
 
-def save_messages(messages):
-    """Save messages to JSON file"""
-    with open(MESSAGES_FILE, 'w', encoding='utf-8') as f:
-        json.dump(messages, f, ensure_ascii=False, indent=2)
+def get_admin_username():
+    """Authenticated username if that user may use /api/admin/*"""
+    username = get_authenticated_username()
+    if not username:
+        return None
+    if username in services().admin_usernames or cached_users().get(username, {}).get('is_admin'):
+        return username
+    return None
 
-@app.after_request
+@bp.before_app_request
+def assign_request_id():
+    """Give the request an id (X-Request-ID) for logs and Server-Timing"""
+    request.request_id = request_id(request.headers.get('X-Request-ID'))
+    request.started = time.perf_counter()
+
+@bp.before_app_request
+def start_maintenance():
+    """Backups, compaction and chat stats run in background threads of every serving process"""
+    app_services = services()
+    if app_services.backups is not None:
+        app_services.backups.ensure_scheduler()
+    if app_services.compactor is not None:
+        app_services.compactor.ensure_scheduler()
+    if app_services.chat_stats is not None:
+        app_services.chat_stats.ensure_worker()
+
+@bp.after_app_request
 def after_request(response):
-    """Add CORS headers to response"""
+    """Add CORS headers and the request id to response"""
+    response.headers['X-Request-ID'] = getattr(request, 'request_id', '')
     origin = request.headers.get('Origin', '*')
     response.headers['Access-Control-Allow-Origin'] = origin
     response.headers['Access-Control-Allow-Headers'] = 'Content-Type,Authorization'
     response.headers['Access-Control-Allow-Methods'] = 'GET,PUT,POST,DELETE,OPTIONS'
     response.headers['Access-Control-Allow-Credentials'] = 'true'
+    response.headers['Access-Control-Expose-Headers'] = 'X-Request-ID, Server-Timing'
     response.headers['Vary'] = 'Origin'
+    log_access(response)
     return response
 
-@app.route('/api/<path:path>', methods=['OPTIONS'])
+def log_access(response):
+    """Queue the access log record of this request (written in the background)"""
+    access_log = services().access_log
+    started = getattr(request, 'started', None)
+    if access_log is None or started is None:
+        return
+    rate = access_log.keep(request.endpoint, response.status_code)
+    if rate is None:
+        return
+    record = {
+        'ts': round(time.time(), 3),
+        'event': 'access',
+        'request_id': request.request_id,
+        'ip': request.remote_addr,
+        'method': request.method,
+        'path': request.path,
+        'endpoint': request.endpoint,
+        'status': response.status_code,
+        # Streamed responses: until the headers, the stream itself isn't included
+        'ms': round((time.perf_counter() - started) * 1000, 1),
+        'bytes': response.content_length,
+        'ua': request.user_agent.string,
+    }
+    if rate != 1:
+        record['sample'] = rate
+    access_log.write(record)
+
+@bp.before_app_request
+def enforce_rate_limit():
+    """Refuse requests over the route's token-bucket limit with 429"""
+    limiter = services().rate_limiter
+    if limiter is None or request.endpoint not in limiter.routes:
+        return None
+
+    result = limiter.check(request.endpoint, get_authenticated_username(), request.remote_addr)
+    # Kept on the request, not `g`: batch sub-requests share `g` with the batch
+    request.rate_limit = result
+    if result is not None and not result.allowed:
+        response = jsonify({
+            'error': 'Слишком много запросов, попробуйте позже',
+            'retry_after': math.ceil(result.retry_after)
+        })
+        response.status_code = 429
+        return response
+    return None
+
+@bp.after_app_request
+def add_rate_limit_headers(response):
+    result = getattr(request, 'rate_limit', None)
+    if result is not None:
+        response.headers.update(result.headers())
+    return response
+
+@bp.route('/api/<path:path>', methods=['OPTIONS'])
 def handle_options(path):
     """Handle preflight requests"""
     return '', 204
 
 # ============= AUTH ROUTES =============
 
-@app.route('/api/auth/register', methods=['POST'])
+@bp.route('/api/auth/register', methods=['POST'])
 def register():
     """Register a new user"""
     try:
@@ -132,25 +579,29 @@ def register():
         if len(password) < 6:
             return jsonify({'error': 'Пароль должен быть не менее 6 символов'}), 400
 
-        users = load_users()
-
-        # Check if user exists
-        if username in users:
+        # Check if user exists (again under the lock below) before paying for the hash
+        if username in cached_users():
             return jsonify({'error': 'Пользователь с таким именем уже существует'}), 400
 
         # Create new user
         user_id = str(uuid.uuid4())
-        token = generate_token()
-        users[username] = {
-            'id': user_id,
-            'email': email,
-            'password': generate_password_hash(password),
-            'created_at': datetime.now().isoformat(),
-            'avatar': username[0].upper(),
-            'token': token
-        }
+        password_hash = generate_password_hash(password)
+
+        with services().users_lock:
+            users = load_users()
+            if username in users:
+                return jsonify({'error': 'Пользователь с таким именем уже существует'}), 400
+
+            users[username] = {
+                'id': user_id,
+                'email': email,
+                'password': password_hash,
+                'created_at': datetime.now().isoformat(),
+                'avatar': username[0].upper()
+            }
+            save_users(users)
 
-        save_users(users)
+        token = issue_token(username)
 
         # Set up persistent session
         session.permanent = True
@@ -172,7 +623,7 @@ def register():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/auth/login', methods=['POST'])
+@bp.route('/api/auth/login', methods=['POST'])
 def login():
     """Login user"""
     try:
@@ -183,7 +634,7 @@ def login():
         if not username or not password:
             return jsonify({'error': 'Имя пользователя и пароль обязательны'}), 400
 
-        users = load_users()
+        users = cached_users()
 
         if username not in users:
             return jsonify({'error': 'Неверное имя пользователя или пароль'}), 401
@@ -193,10 +644,8 @@ def login():
         if not check_password_hash(user['password'], password):
             return jsonify({'error': 'Неверное имя пользователя или пароль'}), 401
 
-        # create/rotate token for the user
-        token = generate_token()
-        users[username]['token'] = token
-        save_users(users)
+        # A new token for this device; users.json is not touched
+        token = issue_token(username)
 
         # set server session as well for same-origin browser
         session.permanent = True
@@ -217,72 +666,136 @@ def login():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/auth/logout', methods=['POST'])
+@bp.route('/api/auth/logout', methods=['POST'])
 def logout():
-    """Logout user"""
+    """Logout user; {"all": true} also signs out every other device"""
+    data = request.get_json(silent=True) or {}
+    token_store = services().token_store
+    if data.get('all'):
+        username = get_authenticated_username()
+        if username:
+            token_store.revoke_user(username)
+
     # If Authorization token provided, revoke it
-    auth_header = request.headers.get('Authorization', '')
-    if auth_header.startswith('Bearer '):
-        token = auth_header.split(' ', 1)[1]
-        users = load_users()
-        for u, info in users.items():
-            if info.get('token') == token:
-                info['token'] = None
-        save_users(users)
+    token = bearer_token()
+    if token:
+        token_store.revoke(token)
 
     session.clear()
     return jsonify({'message': 'Успешный выход'}), 200
 
-@app.route('/api/auth/user', methods=['GET'])
+@bp.route('/api/auth/user', methods=['GET'])
 def get_current_user():
     """Get current logged in user (session or token)"""
     username = get_authenticated_username()
     if not username:
         return jsonify({'error': 'Не авторизованы'}), 401
 
-    users = load_users()
+    users = cached_users()
     if username not in users:
         return jsonify({'error': 'Пользователь не найден'}), 404
 
     user = users[username]
+    token = bearer_token()
     return jsonify({
         'id': user['id'],
         'username': username,
         'email': user['email'],
         'avatar': user['avatar'],
-        'token': user.get('token')
+        'token': token if token and services().token_store.lookup(token) == username else None
     }), 200
 
-# ============= GLOBAL CHAT ROUTES =============
+@bp.route('/api/auth/tokens', methods=['GET'])
+def list_tokens():
+    """Signed-in devices of the current user (tokens are shown shortened)"""
+    username = get_authenticated_username()
+    if not username:
+        return jsonify({'error': 'Не авторизованы'}), 401
 
-@app.route('/api/chat/messages', methods=['GET'])
-def get_messages():
-    """Get all global chat messages"""
+    current = bearer_token()
+    devices = [{
+        'token': token[:8] + '…',
+        'device': record.device,
+        'created_at': datetime.fromtimestamp(record.created).isoformat(),
+        'last_seen': datetime.fromtimestamp(record.last_seen).isoformat(),
+        'current': token == current
+    } for token, record in services().token_store.tokens_for(username)]
+    return jsonify({'count': len(devices), 'tokens': devices}), 200
+
+# ============= CHAT ROUTES =============
+# /api/chat/* is the "general" room; /api/rooms/<room>/* any other room.
+# Both URL forms share one view function, so rate limits apply to both.
+
+ROOM_NOT_FOUND = 'Комната не найдена'
+
+@bp.route('/api/rooms', methods=['GET'])
+def list_rooms():
+    """Every room, "general" first"""
+    rooms = services().rooms
+    return jsonify({'rooms': [{'name': name, 'loaded': rooms.is_loaded(name)} for name in rooms.names()]}), 200
+
+@bp.route('/api/rooms', methods=['POST'])
+def create_room():
+    """Create a room: {"name": "lowercase-name"}"""
+    username = get_authenticated_username()
+    if not username:
+        return jsonify({'error': 'Не авторизованы'}), 401
+
+    data = request.get_json(silent=True) or {}
+    name = data.get('name', '')
+    if not valid_room_name(name):
+        return jsonify({'error': 'Имя комнаты: 1-32 символа a-z, 0-9, "-" и "_"'}), 400
+
+    if not services().rooms.create(name):
+        return jsonify({'error': 'Комната уже существует'}), 409
+    return jsonify({'name': name}), 201
+
+@bp.route('/api/chat/messages', methods=['GET'])
+@bp.route('/api/rooms/<room>/messages', methods=['GET'])
+def get_messages(room=GENERAL):
+    """Get the latest messages of a room, or with ?username= one user's, a page at a time"""
     try:
+        chat_room = services().rooms.get(room)
+        if chat_room is None:
+            return jsonify({'error': ROOM_NOT_FOUND}), 404
+
         limit = request.args.get('limit', 50, type=int)
-        messages = load_messages()
-        
-        # Return last N messages
-        return jsonify(messages[-limit:]), 200
+
+        username = request.args.get('username')
+        if username:
+            # Newest first; "next" is the `before` of the following (older) page
+            lines, cursor, total = chat_room.store.by_author(username, max(1, min(limit, 200)),
+                                                             request.args.get('before'))
+            body = b'{"messages":[' + b','.join(lines) + b'],"next":' + json.dumps(cursor).encode() \
+                + b',"total":' + str(total).encode() + b'}'
+            return Response(body, mimetype='application/json'), 200
+
+        # Last N messages (every one with limit=0): their log lines are already JSON, usually from memory
+        return Response(chat_room.store.recent_json(limit if limit > 0 else None), mimetype='application/json'), 200
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/chat/messages', methods=['POST'])
-def send_message():
-    """Send a message to global chat"""
+@bp.route('/api/chat/messages', methods=['POST'])
+@bp.route('/api/rooms/<room>/messages', methods=['POST'])
+def send_message(room=GENERAL):
+    """Send a message to a room"""
     try:
         username = get_authenticated_username()
         if not username:
             return jsonify({'error': 'Не авторизованы'}), 401
 
+        chat_room = services().rooms.get(room)
+        if chat_room is None:
+            return jsonify({'error': ROOM_NOT_FOUND}), 404
+
         data = request.get_json()
         content = data.get('content', '').strip()
 
         if not content:
             return jsonify({'error': 'Сообщение не может быть пустым'}), 400
 
-        users = load_users()
+        users = cached_users()
         user = users.get(username)
         if not user:
             return jsonify({'error': 'Пользователь не найден'}), 404
@@ -295,117 +808,643 @@ def send_message():
             'timestamp': datetime.now().isoformat()
         }
 
-        messages = load_messages()
-        messages.append(message)
-        save_messages(messages)
+        chat_room.store.append(message)
+        chat_room.publish('message', message)
+        if services().typing is not None:
+            services().typing.update(chat_room.name, username, False)
 
         return jsonify(message), 201
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/chat/messages/<message_id>', methods=['DELETE'])
-def delete_message(message_id):
+@bp.route('/api/chat/messages/<message_id>', methods=['DELETE'])
+@bp.route('/api/rooms/<room>/messages/<message_id>', methods=['DELETE'])
+def delete_message(message_id, room=GENERAL):
     """Delete a message (only by author)"""
     try:
         username = get_authenticated_username()
         if not username:
             return jsonify({'error': 'Не авторизованы'}), 401
 
-        messages = load_messages()
-        message_index = None
+        chat_room = services().rooms.get(room)
+        if chat_room is None:
+            return jsonify({'error': ROOM_NOT_FOUND}), 404
 
-        for i, msg in enumerate(messages):
-            if msg['id'] == message_id:
-                message_index = i
-                break
+        message = chat_room.store.get(message_id)
 
-        if message_index is None:
+        if message is None:
             return jsonify({'error': 'Сообщение не найдено'}), 404
 
-        if messages[message_index]['username'] != username:
+        if message['username'] != username:
             return jsonify({'error': 'Вы не можете удалить это сообщение'}), 403
 
-        del messages[message_index]
-        save_messages(messages)
+        if not chat_room.store.delete(message_id):
+            return jsonify({'error': 'Сообщение не найдено'}), 404
+        chat_room.publish('message_deleted', {'id': message_id})
 
         return jsonify({'message': 'Сообщение удалено'}), 200
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@bp.route('/api/chat/messages', methods=['DELETE'])
+@bp.route('/api/rooms/<room>/messages', methods=['DELETE'])
+def delete_author_messages(room=GENERAL):
+    """Delete every message of ?username= in a room (that user or an admin)"""
+    try:
+        username = get_authenticated_username()
+        if not username:
+            return jsonify({'error': 'Не авторизованы'}), 401
+
+        author = request.args.get('username')
+        if not author:
+            return jsonify({'error': 'username обязателен'}), 400
+        if author != username and not get_admin_username():
+            return jsonify({'error': 'Недостаточно прав'}), 403
+
+        chat_room = services().rooms.get(room)
+        if chat_room is None:
+            return jsonify({'error': ROOM_NOT_FOUND}), 404
+
+        deleted = chat_room.store.delete_by_author(author)
+        if deleted:
+            # One event for the lot: clients reload instead of removing them one by one
+            chat_room.publish('messages_deleted', {'username': author, 'count': deleted})
+
+        return jsonify({'deleted': deleted}), 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/chat/typing', methods=['POST'])
+@bp.route('/api/rooms/<room>/typing', methods=['POST'])
+def set_typing(room=GENERAL):
+    """The current user is typing ({"typing": true}) or stopped ({"typing": false})"""
+    username = get_authenticated_username()
+    if not username:
+        return jsonify({'error': 'Не авторизованы'}), 401
+
+    tracker = services().typing
+    if tracker is None:
+        return jsonify({'error': 'Индикатор набора отключён'}), 404
+
+    chat_room = services().rooms.get(room)
+    if chat_room is None:
+        return jsonify({'error': ROOM_NOT_FOUND}), 404
+
+    data = request.get_json(silent=True) or {}
+    # Too frequent updates are ignored, not refused: the client needn't retry
+    accepted = tracker.update(chat_room.name, username, bool(data.get('typing', True)))
+    return jsonify({'accepted': accepted, 'ttl': tracker.ttl}), 202
+
+@bp.route('/api/chat/stream', methods=['GET'])
+@bp.route('/api/rooms/<room>/stream', methods=['GET'])
+def chat_stream(room=GENERAL):
+    """Server-Sent Events stream of new and deleted messages (and typing) in a room"""
+    rooms = services().rooms
+    chat_room = rooms.get(room)
+    if chat_room is None:
+        return jsonify({'error': ROOM_NOT_FOUND}), 404
+
+    # Not evicted while someone listens (its event ids must stay valid)
+    rooms.open_stream(chat_room)
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    subscription = chat_room.events.subscribe(last_event_id)
+
+    def generate():
+        yield 'retry: 3000\n\n'
+        while True:
+            events = subscription.get(timeout=STREAM_KEEPALIVE)
+            if not events:
+                yield ': keepalive\n\n'
+            else:
+                # Everything pending goes out in one write
+                yield ''.join(event.to_sse() for event in events)
+
+    response = Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # Runs when the client goes away, even if the stream never started
+    response.call_on_close(lambda: rooms.close_stream(chat_room))
+    return response
+
+# ============= AI CHAT HISTORY ROUTES =============
+# The chat list carries titles only; messages are fetched in windows
+
+AI_CHAT_NOT_FOUND = 'Разговор не найден'
+
+def ai_history_for_user():
+    """(username, ChatHistory) or (None, error response)"""
+    username = get_authenticated_username()
+    if not username:
+        return None, (jsonify({'error': 'Не авторизованы'}), 401)
+    history = services().ai_history
+    if history is None:
+        return None, (jsonify({'error': 'История AI-чатов отключена'}), 404)
+    return username, history
+
+@bp.route('/api/ai/chats', methods=['GET'])
+def list_ai_chats():
+    """A page of the user's AI chats, newest first: ?limit=20&cursor=<next from the previous page>"""
+    username, history = ai_history_for_user()
+    if username is None:
+        return history
+
+    limit = request.args.get('limit', DEFAULT_PAGE, type=int)
+    chats, cursor = history.list_chats(username, limit, request.args.get('cursor'))
+    return jsonify({'chats': chats, 'next': cursor}), 200
+
+@bp.route('/api/ai/chats', methods=['POST'])
+def create_ai_chat():
+    """Start an AI chat: {"title": "..."} (optional)"""
+    username, history = ai_history_for_user()
+    if username is None:
+        return history
+
+    data = request.get_json(silent=True) or {}
+    return jsonify(history.create(username, data.get('title'))), 201
+
+@bp.route('/api/ai/chats/<chat_id>', methods=['PUT'])
+def rename_ai_chat(chat_id):
+    """Rename an AI chat: {"title": "..."}"""
+    username, history = ai_history_for_user()
+    if username is None:
+        return history
+
+    data = request.get_json(silent=True) or {}
+    chat = history.rename(username, chat_id, clean_title(data.get('title')))
+    if chat is None:
+        return jsonify({'error': AI_CHAT_NOT_FOUND}), 404
+    return jsonify(chat), 200
+
+@bp.route('/api/ai/chats/<chat_id>', methods=['DELETE'])
+def delete_ai_chat(chat_id):
+    username, history = ai_history_for_user()
+    if username is None:
+        return history
+
+    if not history.delete(username, chat_id):
+        return jsonify({'error': AI_CHAT_NOT_FOUND}), 404
+    return jsonify({'message': 'Разговор удалён'}), 200
+
+@bp.route('/api/ai/chats/<chat_id>/messages', methods=['GET'])
+def get_ai_messages(chat_id):
+    """A window of an AI chat: the last `limit` messages before index `before` (default: the newest)"""
+    username, history = ai_history_for_user()
+    if username is None:
+        return history
+
+    window = history.messages(username, chat_id, request.args.get('before', type=int),
+                              request.args.get('limit', DEFAULT_WINDOW, type=int))
+    if window is None:
+        return jsonify({'error': AI_CHAT_NOT_FOUND}), 404
+    messages, start, total = window
+    return jsonify({'messages': messages, 'start': start, 'total': total}), 200
+
+@bp.route('/api/ai/chats/<chat_id>/messages', methods=['POST'])
+def append_ai_messages(chat_id):
+    """Add turns to an AI chat: {"messages": [{"role": "user", "content": "..."}, ...]}"""
+    username, history = ai_history_for_user()
+    if username is None:
+        return history
+
+    data = request.get_json(silent=True) or {}
+    messages = data.get('messages')
+    if not valid_messages(messages):
+        return jsonify({'error': 'Нужен список сообщений с role (user, assistant, system) и content'}), 400
+
+    total = history.append(username, chat_id, messages)
+    if total is None:
+        return jsonify({'error': AI_CHAT_NOT_FOUND}), 404
+    return jsonify({'total': total}), 201
+
+# ============= CLIENT PRESENCE ROUTES =============
+
+@bp.route('/api/clients/connect', methods=['POST'])
+def connect_client():
+    """Register a connected client for the current user"""
+    try:
+        username = get_authenticated_username()
+        if not username:
+            return jsonify({'error': 'Не авторизованы'}), 401
+
+        data = request.get_json(silent=True) or {}
+        device_info = data.get('device_info')
+        if device_info is not None and not isinstance(device_info, dict):
+            return jsonify({'error': 'device_info должен быть объектом'}), 400
+
+        user = cached_users().get(username)
+        if not user:
+            return jsonify({'error': 'Пользователь не найден'}), 404
+
+        client = presence.connect(
+            username,
+            avatar=user.get('avatar'),
+            ip_address=request.remote_addr,
+            device_info=device_info
+        )
+
+        session_info = client.to_dict()
+        session_info['heartbeat_interval'] = presence.heartbeat_interval
+        session_info['expires_in'] = presence.ttl
+        return jsonify({'message': 'Клиент подключен', 'session': session_info}), 201
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/clients/heartbeat', methods=['POST'])
+def client_heartbeat():
+    """Keep one client (client_id) or a batch of clients (client_ids) alive"""
+    try:
+        data = request.get_json(silent=True) or {}
+        client_ids = data.get('client_ids')
+        if client_ids is None:
+            client_ids = [data['client_id']] if data.get('client_id') else []
+
+        if not client_ids or not isinstance(client_ids, list):
+            return jsonify({'error': 'client_id обязателен'}), 400
+
+        unknown = presence.heartbeat(client_ids)
+
+        # A single unknown client has expired and must connect again
+        if len(client_ids) == 1 and unknown:
+            return jsonify({'error': 'Клиент не подключен', 'unknown': unknown}), 404
+
+        return jsonify({
+            'message': 'OK',
+            'alive': len(client_ids) - len(unknown),
+            'unknown': unknown,
+            'expires_in': presence.ttl
+        }), 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/clients/disconnect', methods=['POST'])
+def disconnect_client():
+    """Disconnect a client"""
+    try:
+        data = request.get_json(silent=True) or {}
+        client_id = data.get('client_id')
+        if not client_id:
+            return jsonify({'error': 'client_id обязателен'}), 400
+
+        if not presence.disconnect(client_id):
+            return jsonify({'error': 'Клиент не подключен'}), 404
+
+        return jsonify({'message': 'Клиент отключен'}), 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/clients/online', methods=['GET'])
+def online_users():
+    """Users with at least one connected client"""
+    users = presence.online_users()
+    return jsonify({'count': len(users), 'users': users}), 200
+
 # ============= HEALTH CHECK =============
 
-@app.route('/api/health', methods=['GET'])
+@bp.route('/api/health', methods=['GET'])
 def health():
     """Health check endpoint"""
+    active_clients, active_sessions = presence.counts()
     return jsonify({
         'status': 'online',
         'timestamp': datetime.now().isoformat(),
-        'users_count': len(load_users()),
-        'messages_count': len(load_messages())
+        'users_count': len(cached_users()),
+        'messages_count': message_store.count(),
+        'rooms': services().rooms.stats(),
+        'events': services().event_bus.stats() if services().event_bus else None,
+        'access_log': services().access_log.stats() if services().access_log else None,
+        'backups': services().backups.stats() if services().backups else None,
+        'compaction': services().compactor.stats() if services().compactor else None,
+        'typing': services().typing.stats() if services().typing else None,
+        'chat_stats': services().chat_stats.stats() if services().chat_stats else None,
+        'active_clients': active_clients,
+        'active_sessions': active_sessions,
+        'pid': os.getpid(),
+        'started_at': services().started_at
     }), 200
 
+# ============= ADMIN: CHAT STATS =============
+
+@bp.route('/api/admin/stats', methods=['GET'])
+def admin_stats():
+    """Messages per user (top posters, or ?username=), per hour of day and per day: ?room=&top=10&days=30"""
+    if not get_admin_username():
+        return jsonify({'error': 'Недостаточно прав'}), 403
+
+    chat_stats = services().chat_stats
+    if chat_stats is None:
+        return jsonify({'error': 'Статистика отключена'}), 404
+
+    room_stats = chat_stats.room(request.args.get('room', GENERAL))
+    if room_stats is None:
+        return jsonify({'error': ROOM_NOT_FOUND}), 404
+
+    summary = room_stats.summary(top=request.args.get('top', DEFAULT_TOP, type=int),
+                                 days=request.args.get('days', 30, type=int))
+    username = request.args.get('username')
+    if username:
+        summary['user'] = {'username': username, 'messages': room_stats.user_messages(username)}
+    return jsonify(summary), 200
+
+# ============= ADMIN: BULK EXPORT / IMPORT =============
+
+@bp.route('/api/admin/export', methods=['GET'])
+def admin_export():
+    """Stream users and the messages of every room as NDJSON (constant memory)"""
+    if not get_admin_username():
+        return jsonify({'error': 'Недостаточно прав'}), 403
+
+    from bulk import export_lines
+
+    filename = f"alit-export-{datetime.now().strftime('%Y%m%d-%H%M%S')}.ndjson"
+    return Response(
+        export_lines(services().users_file, services().rooms.iter_stores()),
+        mimetype='application/x-ndjson',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+@bp.route('/api/admin/import', methods=['POST'])
+def admin_import():
+    """Import an NDJSON export from the request body, line by line"""
+    if not get_admin_username():
+        return jsonify({'error': 'Недостаточно прав'}), 403
+
+    from bulk import import_lines
+
+    try:
+        lines = iter(lambda: request.stream.readline(), b'')
+        rooms = services().rooms
+
+        def room_store(name):
+            room = rooms.get_or_create(name)
+            return room.store if room is not None else None
+
+        report = import_lines(lines, services().users_file, room_store, users_lock=services().users_lock)
+        invalidate_request_cache('users', 'tokens')
+        return jsonify({'message': 'Импорт завершён', 'report': report.to_dict()}), 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# ============= BATCH =============
+
+BATCH_MAX_REQUESTS = 20
+# Endpoints that stream forever or make no sense inside a batch (as does any room's .../stream)
+BATCH_EXCLUDED_PATHS = ('/api/batch', '/api/chat/stream')
+# Request headers every sub-request inherits from the batch request
+BATCH_FORWARDED_HEADERS = ('Authorization', 'Cookie', 'Origin', 'User-Agent', 'Accept-Language')
+
+def run_subrequest(sub):
+    """Dispatch one batch item through the normal routing and return (result, cookies)"""
+    if not isinstance(sub, dict):
+        return {'status': 400, 'body': {'error': 'Некорректный запрос'}}, []
+
+    method = sub.get('method', 'GET')
+    path = sub.get('path', '')
+    params = sub.get('params')
+    if not isinstance(method, str) or not isinstance(path, str) or not isinstance(params, (dict, str, type(None))):
+        return {'id': sub.get('id'), 'status': 400, 'body': {'error': 'Некорректный запрос'}}, []
+    method = method.upper()
+    route = path.split('?', 1)[0]
+    if not route.startswith('/api/') or route in BATCH_EXCLUDED_PATHS or route.endswith('/stream'):
+        return {'id': sub.get('id'), 'status': 400, 'body': {'error': f'Недопустимый путь: {path}'}}, []
+
+    from werkzeug.test import EnvironBuilder
+
+    headers = {name: request.headers[name] for name in BATCH_FORWARDED_HEADERS if name in request.headers}
+    headers['X-Request-ID'] = request.request_id  # sub-requests log under the batch's id
+    builder = EnvironBuilder(
+        path=path,
+        method=method,
+        query_string=params,
+        json=sub.get('body'),
+        headers=headers,
+        environ_base={'REMOTE_ADDR': request.remote_addr}
+    )
+
+    # Nested request contexts share the outer app context, so `g` (and the
+    # request cache holding users, messages and the authenticated user) is
+    # shared by every sub-request of the batch.
+    app = current_app._get_current_object()
+    with app.request_context(builder.get_environ()):
+        response = app.full_dispatch_request()
+
+    try:
+        if response.is_streamed:
+            return {'id': sub.get('id'), 'status': 400, 'body': {'error': 'Потоковые ответы не поддерживаются в batch'}}, []
+
+        body = response.get_json(silent=True)
+        if body is None:
+            body = response.get_data(as_text=True)
+        return {'id': sub.get('id'), 'status': response.status_code, 'body': body}, response.headers.getlist('Set-Cookie')
+    finally:
+        response.close()
+
+@bp.route('/api/batch', methods=['POST'])
+def batch():
+    """Run several API calls in one round trip.
+
+    Body: {"requests": [{"id": "...", "method": "GET", "path": "/api/...",
+    "params": {...}, "body": {...}}, ...]}. Items run in order and the
+    response lists their status and body in the same order.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        subrequests = data.get('requests')
+
+        if not isinstance(subrequests, list) or not subrequests:
+            return jsonify({'error': 'requests должен быть непустым списком'}), 400
+
+        if len(subrequests) > BATCH_MAX_REQUESTS:
+            return jsonify({'error': f'Не более {BATCH_MAX_REQUESTS} запросов в batch'}), 400
+
+        # Authenticate once up front; sub-requests hit the shared cache
+        get_authenticated_username()
+
+        results = []
+        cookies = []
+        for sub in subrequests:
+            result, set_cookies = run_subrequest(sub)
+            results.append(result)
+            cookies.extend(set_cookies)
+
+        response = jsonify({'responses': results})
+        for cookie in cookies:
+            response.headers.add('Set-Cookie', cookie)
+        return response, 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # ============= OLLAMA PROXY ROUTES =============
 
-@app.route('/api/ollama/chat', methods=['POST'])
+OLLAMA_DURATIONS = (('load', 'load_duration'), ('prompt_eval', 'prompt_eval_duration'),
+                    ('eval', 'eval_duration'), ('model', 'total_duration'))
+
+
+def _ollama_durations(timings, result):
+    """Ollama's own timings (from a reply or the last streamed chunk) as phases"""
+    for phase, field in OLLAMA_DURATIONS:
+        timings.add_ns(phase, result.get(field))
+
+
+def _log_ai_request(rid, timings, fields):
+    log_event('ai_request', request_id=rid, timings=timings.to_dict(), **fields)
+
+
+def _ai_reply(body, status, timings, fields):
+    """A JSON reply of the proxy with its Server-Timing, logged"""
+    response = jsonify(body)
+    response.status_code = status
+    timings.mark('serialize')
+    timings.since_start('total')
+    response.headers['Server-Timing'] = timings.header()
+    fields['status'] = status
+    _log_ai_request(request.request_id, timings, fields)
+    return response
+
+
+@bp.route('/api/ollama/chat', methods=['POST'])
 def ollama_chat_proxy():
-    """Proxy requests to Ollama"""
+    """Proxy a chat request to the least loaded Ollama backend that has the model
+
+    Phases (Server-Timing, and the "ai_request" log record): queue (until
+    the prompt is ready), context (the context budget), connect (until
+    Ollama answers with headers, retries included), ttfb (then until the
+    first streamed chunk), serialize, total, and Ollama's own load,
+    prompt_eval, eval and model times.
+    """
+    timings = Timings(request.started)
+    fields = {'user': get_authenticated_username()}
     try:
         import requests
         
         data = request.get_json()
+        # Ollama streams NDJSON unless told otherwise
+        stream = bool(data.get('stream', True))
+        fields.update(model=data.get('model'), stream=stream)
+        pool = services().ollama
+        budget = services().context_budget
+        timings.mark('queue')
+        if budget is not None:
+            # Long chats: older turns give way to the chat's rolling summary
+            data = budget.apply(data, fields['user'] or request.remote_addr)
+            timings.mark('context')
+        else:
+            data.pop('chat_id', None)
         
-        # Forward request to local Ollama
-        response = requests.post(
-            'http://localhost:11434/api/chat',
-            json=data,
-            timeout=120
-        )
+        # A backend that refuses the connection is skipped for the next one
+        tried = []
+        while True:
+            backend = pool.acquire(data.get('model'), exclude=tried)
+            try:
+                response = requests.post(
+                    f'{backend.url}/api/chat',
+                    json=data,
+                    timeout=120,
+                    stream=stream,
+                    headers={'X-Request-ID': request.request_id}
+                )
+                break
+            except requests.exceptions.ConnectionError:
+                pool.release(backend, ok=False)
+                tried.append(backend)
+            except BaseException:
+                pool.release(backend, ok=False)
+                raise
+        timings.mark('connect')
+        fields.update(backend=backend.url, retries=len(tried))
         
+        if response.status_code == 200 and stream:
+            failed = []
+            rid = request.request_id
+
+            # Pass NDJSON chunks through as they arrive
+            def generate():
+                try:
+                    first = True
+                    for line in response.iter_lines():
+                        if line:
+                            if first:
+                                timings.mark('ttfb')
+                                first = False
+                            if b'"done":true' in line or b'"done": true' in line:
+                                _ollama_durations(timings, json.loads(line))
+                            yield line + b'\n'
+                except requests.exceptions.RequestException:
+                    failed.append(True)
+                    raise
+
+            def finish():
+                response.close()
+                pool.release(backend, ok=not failed)
+                timings.since_start('total')
+                fields.update(status=200, failed=bool(failed))
+                _log_ai_request(rid, timings, fields)
+
+            proxied = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+            # Only what is known before the body; the log record gets everything
+            proxied.headers['Server-Timing'] = timings.header()
+            # Runs when the client is done, even if the stream never started
+            proxied.call_on_close(finish)
+            return proxied
+
+        pool.release(backend, ok=response.status_code < 500)
         if response.status_code == 200:
-            return jsonify(response.json()), 200
+            result = response.json()
+            _ollama_durations(timings, result)
+            return _ai_reply(result, 200, timings, fields)
         else:
-            return jsonify({'error': f'Ollama error: {response.text}'}), response.status_code
+            return _ai_reply({'error': f'Ollama error: {response.text}'}, response.status_code, timings, fields)
             
-    except requests.exceptions.ConnectionError:
-        return jsonify({
-            'error': '❌ Ollama не запущена!\n\n💡 Решение:\n1. Откройте приложение Ollama\n2. Выполните: ollama run mistral\n3. Оставьте окно открытым'
-        }), 503
+    except NoBackendError as e:
+        if e.status == 503:
+            # Every backend is down, ejected or refused the connection
+            return _ai_reply({
+                'error': '❌ Ollama не запущена!\n\n💡 Решение:\n1. Откройте приложение Ollama\n2. Выполните: ollama run mistral\n3. Оставьте окно открытым'
+            }, 503, timings, fields)
+        return _ai_reply({'error': str(e)}, e.status, timings, fields)
     except requests.exceptions.Timeout:
-        return jsonify({'error': 'Ollama не отвечает (timeout)'}), 504
+        return _ai_reply({'error': 'Ollama не отвечает (timeout)'}, 504, timings, fields)
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return _ai_reply({'error': str(e)}, 500, timings, fields)
 
-@app.route('/api/ollama/tags', methods=['GET'])
+@bp.route('/api/ollama/tags', methods=['GET'])
 def ollama_tags_proxy():
-    """Proxy requests to get Ollama tags"""
+    """Models available on the healthy Ollama backends (merged)"""
     try:
-        import requests
-        
-        response = requests.get(
-            'http://localhost:11434/api/tags',
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            return jsonify(response.json()), 200
-        else:
-            return jsonify({'error': 'Failed to get Ollama tags'}), response.status_code
-            
-    except requests.exceptions.ConnectionError:
+        return jsonify(services().ollama.tags()), 200
+    except NoBackendError:
         return jsonify({'error': 'Ollama не доступна'}), 503
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@bp.route('/api/admin/ollama', methods=['GET'])
+def admin_ollama_backends():
+    """State of every Ollama backend and of the summarizer in this worker"""
+    if not get_admin_username():
+        return jsonify({'error': 'Недостаточно прав'}), 403
+    budget = services().context_budget
+    return jsonify({
+        'backends': services().ollama.stats(),
+        'context': budget.stats() if budget is not None else None,
+    }), 200
+
 # ============= STATIC FILES =============
 
-@app.route('/')
+@bp.route('/')
 def index():
     """Serve index.html"""
     return send_from_directory('.', 'index.html')
 
-@app.errorhandler(404)
+@bp.app_errorhandler(404)
 def not_found(e):
     """Handle 404 errors - try to serve static files"""
     if request.path.startswith('/api'):
@@ -420,12 +1459,15 @@ def not_found(e):
     return send_from_directory('.', 'index.html')
 
 if __name__ == '__main__':
+    app = create_app()
+    server_config = app.config['ALIT']['server']
+    port = server_config['port']
     print("=" * 60)
     print("🚀 AI Chat Server запущен")
     print("=" * 60)
-    print("📍 URL: http://localhost:5000")
-    print("📊 API Health: http://localhost:5000/api/health")
+    print(f"📍 URL: http://localhost:{port}")
+    print(f"📊 API Health: http://localhost:{port}/api/health")
     print("=" * 60)
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    app.run(debug=server_config['debug'], host=server_config['host'], port=port)
 
 
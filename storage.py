@@ -0,0 +1,1100 @@
+"""
+Message storage: an append-only log of NDJSON segment files
+
+    data/messages/segment-000001.jsonl
+    data/messages/segment-000002.jsonl
+    ...
+
+Every line is either a message (`{"id":"...", ...}`, id always first) or a
+tombstone for a deleted one (`{"deleted":"<id>", "at":"...", "username":
+"...", "timestamp": "..."}`, the last two copied from the message so that
+readers following the log know what went away). Appends and
+deletes are a single write at the end of the active segment, so they cost
+the same at 1k and 1M messages. Reads are memory-mapped and never build the
+whole history in RAM.
+
+The in-memory index (id -> position) is built by scanning the segments once
+on first use. Other processes (gunicorn workers, manage_server.py) append to
+the same files; every call first picks up whatever they wrote since, and
+writers serialize through an exclusive lock file where the OS supports it.
+
+Deleted, superseded and (optionally) expired lines are dropped by compact(),
+which rewrites the log into new segments while reads and writes go on (see
+compact()). Segment numbers are never reused: compaction and clear() leave
+at least an empty segment numbered after the old ones, so another process
+sees its segments vanish instead of a new file under a known name.
+
+The newest `recent_size` messages are also kept in a ring of small slotted
+records holding their log line, which already is the message's compact
+JSON, so the chat's "latest messages" poll is answered from memory by
+joining bytes. The ring is filled from the end of the log on first use and
+then follows every indexed append and tombstone.
+
+A secondary index, username -> ids of that user's live messages in log
+order, is built on the first by-author query (one pass over the log) and
+then kept up by every scan like the main index. by_author() pages through
+it newest first and delete_by_author() tombstones all of a user's messages
+in one write; both cost the number of that user's messages, not the size of
+the log. The index also remembers where its deleted messages were, so a
+page cursor deleted since it was handed out still resumes at the nearest
+older message (until compaction drops the deleted lines).
+"""
+
+import codecs
+import glob
+import json
+import mmap
+import os
+import sys
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from itertools import dropwhile, islice
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process only
+    fcntl = None
+
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.jsonl'
+SEGMENT_BYTES = 64 * 1024 * 1024   # roll over to a new segment after this size
+READ_CHUNK = 1024 * 1024
+DECODE_CHUNK = 1024                 # messages decoded per json.loads in iter_messages
+DEFAULT_RECENT = 200                # messages kept in memory for recent_lines()
+
+_MESSAGE_PREFIX = b'{"id":"'
+_TOMBSTONE_PREFIX = b'{"deleted":"'
+_USERNAME_FIELD = b',"username":"'
+
+
+def write_json_atomic(path, data):
+    """Write JSON next to `path` and rename it into place, so readers never see a partial file"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def encode_message(message):
+    """One log line for a message, id first so the index can skip JSON parsing"""
+    record = {'id': message['id']}
+    record.update(message)
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+def encode_tombstone(message_id, message=None):
+    record = {'deleted': message_id, 'at': datetime.now().isoformat()}
+    if message:
+        record['username'] = message.get('username')
+        record['timestamp'] = message.get('timestamp')
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+def parse_key(line):
+    """('message' | 'deleted' | None, id) for a raw log line"""
+    for kind, prefix in (('message', _MESSAGE_PREFIX), ('deleted', _TOMBSTONE_PREFIX)):
+        if line.startswith(prefix):
+            end = line.find(b'"', len(prefix))
+            key = line[len(prefix):end]
+            if end > 0 and b'\\' not in key:
+                return kind, key.decode('utf-8')
+    # Unusual ids (escapes) or hand-edited lines: fall back to a real parse
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None, None
+    if 'deleted' in record:
+        return 'deleted', record['deleted']
+    if 'id' in record:
+        return 'message', record['id']
+    return None, None
+
+
+def parse_author(line):
+    """Username of a raw message or tombstone line (None if it has none)"""
+    # Messages from the routes are {"id":"...","username":"...",...}
+    if line.startswith(_MESSAGE_PREFIX):
+        start = line.find(b'"', len(_MESSAGE_PREFIX)) + 1
+        if start and line.startswith(_USERNAME_FIELD, start):
+            start += len(_USERNAME_FIELD)
+            end = line.find(b'"', start)
+            if end > 0 and b'\\' not in line[start:end]:
+                return line[start:end].decode('utf-8')
+    try:
+        return json.loads(line).get('username')
+    except (ValueError, AttributeError):
+        return None
+
+
+def map_file(path):
+    """Read-only mmap of a file, or None if it's empty"""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def iter_lines(buffer, start=0, end=None):
+    """(offset, line) for every complete line of buffer[start:end]"""
+    end = len(buffer) if end is None else end
+    pos = start
+    while pos < end:
+        newline = buffer.find(b'\n', pos, end)
+        if newline < 0:
+            return  # torn tail, not ours to read yet
+        if newline > pos:
+            yield pos, buffer[pos:newline]
+        pos = newline + 1
+
+
+def iter_lines_reversed(buffer, end=None):
+    """(offset, line) from the last complete line of buffer[:end] back to the first"""
+    end = buffer.rfind(b'\n', 0, len(buffer) if end is None else end)
+    while end > 0:
+        start = buffer.rfind(b'\n', 0, end) + 1
+        if end > start:
+            yield start, buffer[start:end]
+        end = start - 1
+
+
+def _iter_json_values(fileobj, opening, closing):
+    """Incrementally decode the values of a top-level JSON array/object"""
+    decoder = json.JSONDecoder()
+    reader = codecs.getincrementaldecoder('utf-8')()
+    buf = ''
+    pos = 0
+    eof = False
+    started = False
+
+    def fill():
+        nonlocal buf, pos, eof
+        chunk = fileobj.read(READ_CHUNK)
+        if not chunk:
+            eof = True
+            buf = buf[pos:] + reader.decode(b'', final=True)
+        else:
+            buf = buf[pos:] + reader.decode(chunk)
+        pos = 0
+
+    def skip(chars):
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in chars:
+                pos += 1
+            if pos < len(buf) or eof:
+                return
+            fill()
+
+    def value():
+        nonlocal pos
+        while True:
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+                # A number at the end of the buffer may continue in the next chunk
+                if end < len(buf) or eof:
+                    pos = end
+                    return obj
+            except ValueError:
+                if eof:
+                    raise
+            fill()
+
+    skip(' \t\r\n')
+    if pos >= len(buf) or buf[pos] != opening:
+        raise ValueError(f'expected {opening!r}')
+    pos += 1
+
+    while True:
+        skip(' \t\r\n,' if started else ' \t\r\n')
+        if pos >= len(buf):
+            raise ValueError('unexpected end of JSON')
+        if buf[pos] == closing:
+            return
+        started = True
+        if opening == '{':
+            key = value()
+            skip(' \t\r\n:')
+            yield key, value()
+        else:
+            yield value()
+
+
+def iter_json_array(fileobj):
+    """Stream the items of a JSON array file (e.g. the legacy messages.json)"""
+    return _iter_json_values(fileobj, '[', ']')
+
+
+def iter_json_object_items(fileobj):
+    """Stream (key, value) pairs of a JSON object file (e.g. users.json)"""
+    return _iter_json_values(fileobj, '{', '}')
+
+
+class FileLock:
+    """Exclusive lock shared by every thread and process using the same path
+
+    flock() on `path` plus a thread lock; re-entrant within a thread. On
+    Windows only the thread lock applies (single process).
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if self._depth == 0 and fcntl is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._thread_lock.release()
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _age_cutoff(max_age):
+    """Timestamps (ISO, like the messages') older than this are expired"""
+    return (datetime.now() - timedelta(seconds=max_age)).isoformat()
+
+
+class _CompactOutput:
+    """Temporary segment files of a compaction, and the index of what went in"""
+
+    def __init__(self, directory, segment_bytes, fsync=False):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.files = []            # [(path, size)]
+        self._f = None
+        self.index = {}
+        self.deleted = set()
+        self.lines = 0
+
+    def _write(self, line):
+        size = len(line) + 1
+        if self._f is None or (self.files[-1][1] and self.files[-1][1] + size > self.segment_bytes):
+            self._close()
+            path = self.directory / f'.compact-{len(self.files) + 1:06d}.tmp'
+            self._f = open(path, 'wb')
+            self.files.append((path, 0))
+        path, offset = self.files[-1]
+        self._f.write(line)
+        self._f.write(b'\n')
+        self.files[-1] = (path, offset + size)
+        self.lines += 1
+        return len(self.files) - 1, offset
+
+    def add(self, key, line):
+        self.index[key] = self._write(line)
+
+    def add_tail(self, kind, key, line):
+        if kind is None:
+            return
+        position = self._write(line)
+        if kind == 'message':
+            self.index[key] = position
+            self.deleted.discard(key)
+        else:
+            self.index.pop(key, None)
+            self.deleted.add(key)
+
+    def _close(self):
+        if self._f is not None:
+            if self.fsync:
+                self._f.flush()
+                os.fsync(self._f.fileno())
+            self._f.close()
+            self._f = None
+
+    def install(self, first_number):
+        """Rename the files to segments first_number...; return [(number, size)]"""
+        self._close()
+        installed = []
+        for i, (path, size) in enumerate(self.files):
+            number = first_number + i
+            os.replace(path, self.directory / f'{SEGMENT_PREFIX}{number:06d}{SEGMENT_SUFFIX}')
+            installed.append((number, size))
+        # Positions so far were (file index, offset)
+        self.index = {key: (first_number + i, offset) for key, (i, offset) in self.index.items()}
+        self.files = []
+        return installed
+
+    def discard(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+        for path, _ in self.files:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+
+class RecentMessage:
+    """A message in the recent ring: its log line plus what filters need"""
+
+    __slots__ = ('id', 'username', 'avatar', 'raw')
+
+    def __init__(self, message_id, raw):
+        message = json.loads(raw)
+        self.id = message_id
+        # Few distinct authors: every record shares the same string objects
+        self.username = _intern(message.get('username'))
+        self.avatar = _intern(message.get('avatar'))
+        self.raw = raw
+
+
+class MessageStore:
+    """Append-only message log (see module docstring)"""
+
+    def __init__(self, directory, legacy_file=None, segment_bytes=SEGMENT_BYTES, fsync=False,
+                 recent_size=DEFAULT_RECENT):
+        self.directory = Path(directory)
+        self.legacy_file = Path(legacy_file) if legacy_file else None
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.recent_size = recent_size
+
+        self._lock = threading.RLock()
+        self._opened = False
+        self._segments = []        # segment numbers, ascending
+        self._scanned = {}         # segment number -> bytes indexed so far
+        self._inodes = {}          # segment number -> inode of the file indexed
+        self._index = {}           # message id -> (segment, offset)
+        self._deleted = set()      # ids with a tombstone
+        self._lines = 0            # records indexed, live or not (for the dead ratio)
+        self._recent = None        # deque of RecentMessage, None until first needed
+        self._by_author = None     # username -> {id: None} in log order, None until first needed
+        self._author_gone = {}     # id -> (segment, offset) of a deleted message, kept with _by_author
+        self._write_fd = None
+        self._write_segment = None
+
+    # ----- paths -----
+
+    def segment_path(self, number):
+        return self.directory / f'{SEGMENT_PREFIX}{number:06d}{SEGMENT_SUFFIX}'
+
+    def segment_paths(self):
+        with self._lock:
+            self._open()
+            self._refresh()
+            return [self.segment_path(n) for n in self._segments]
+
+    def _list_segments(self):
+        numbers = []
+        for path in self.directory.glob(f'{SEGMENT_PREFIX}*{SEGMENT_SUFFIX}'):
+            try:
+                numbers.append(int(path.name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]))
+            except ValueError:
+                continue
+        return sorted(numbers)
+
+    # ----- opening and indexing -----
+
+    def _open(self):
+        if self._opened:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._opened = True
+        if not self._list_segments() and self.legacy_file and self.legacy_file.exists():
+            self._migrate_legacy()
+        self._refresh()
+
+    def _migrate_legacy(self):
+        """One-time import of the old data/messages.json array"""
+        # Its own lock file: the writes below take .lock themselves
+        with FileLock(self.directory / '.migrate.lock'):
+            if self._list_segments() or not self.legacy_file.exists():
+                return  # another process migrated it while we waited
+            with open(self.legacy_file, 'rb') as f:
+                batch = []
+                for message in iter_json_array(f):
+                    batch.append(message)
+                    if len(batch) >= 1000:
+                        self._append_lines([encode_message(m) for m in batch])
+                        batch = []
+                if batch:
+                    self._append_lines([encode_message(m) for m in batch])
+            self.legacy_file.rename(self.legacy_file.with_name(self.legacy_file.name + '.migrated'))
+
+    def _refresh(self):
+        """Index whatever this or another process appended since the last call"""
+        rewritten = False
+        if self._segments:
+            last = self._segments[-1]
+            try:
+                st = os.stat(self.segment_path(last))
+            except FileNotFoundError:
+                st = None
+            if (st is not None and st.st_size == self._scanned[last] and st.st_ino == self._inodes.get(last)
+                    and not self.segment_path(last + 1).exists()):
+                return  # fast path: nothing new
+            # Shorter than what we indexed, or another file: not the segment we know
+            rewritten = st is not None and (st.st_size < self._scanned[last]
+                                            or st.st_ino != self._inodes.get(last, st.st_ino))
+
+        numbers = self._list_segments()
+        if self._segments and (rewritten or not numbers or numbers[0] > self._segments[0]
+                               or any(n not in numbers for n in self._segments)):
+            # Segments vanished (compaction or clear in another process): start over
+            self._reset_index()
+
+        for number in numbers:
+            if number not in self._scanned:
+                self._segments.append(number)
+                self._scanned[number] = 0
+            self._scan(number)
+
+    def _reset_index(self):
+        self._segments = []
+        self._scanned = {}
+        self._inodes = {}
+        self._index = {}
+        self._deleted = set()
+        self._lines = 0
+        self._recent = None
+        self._by_author = None
+        self._author_gone = {}
+        self._close_writer()
+
+    def _scan(self, number):
+        path = self.segment_path(number)
+        start = self._scanned[number]
+        try:
+            buffer = map_file(path)
+        except FileNotFoundError:
+            return
+        if number not in self._inodes:
+            try:
+                self._inodes[number] = os.stat(path).st_ino
+            except FileNotFoundError:
+                pass
+        if buffer is None:
+            return
+        try:
+            end = buffer.rfind(b'\n') + 1
+            if end <= start:
+                return
+            recent = self._recent
+            by_author = self._by_author
+            for offset, line in iter_lines(buffer, start, end):
+                kind, key = parse_key(line)
+                if recent is not None and kind:
+                    self._track_recent(kind, key, line)
+                if by_author is not None and kind:
+                    self._track_author(kind, key, line)
+                if kind == 'message':
+                    self._index[key] = (number, offset)
+                    self._deleted.discard(key)
+                elif kind == 'deleted':
+                    self._index.pop(key, None)
+                    self._deleted.add(key)
+                if kind:
+                    self._lines += 1
+            self._scanned[number] = end
+        finally:
+            buffer.close()
+
+    # ----- writing -----
+
+    def _close_writer(self):
+        if self._write_fd is not None:
+            os.close(self._write_fd)
+        self._write_fd = None
+        self._write_segment = None
+
+    def _writer_for(self, size_needed):
+        """File descriptor of the segment the next write goes to"""
+        if not self._segments:
+            number = 1
+        else:
+            number = self._segments[-1]
+            if self._scanned[number] and self._scanned[number] + size_needed > self.segment_bytes:
+                number += 1
+
+        if number not in self._scanned:
+            self._segments.append(number)
+            self._scanned[number] = 0
+
+        if self._write_segment != number:
+            self._close_writer()
+            self._write_fd = os.open(self.segment_path(number), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            self._write_segment = number
+
+        # A torn line left by a crashed writer would glue onto ours - cut it off
+        size = os.fstat(self._write_fd).st_size
+        if size > self._scanned[number]:
+            os.truncate(self.segment_path(number), self._scanned[number])
+        return number, self._write_fd
+
+    def _append_lines(self, lines=None, build=None):
+        """Write encoded lines at the end of the log; return their (segment, offset)
+
+        With `build` the lines are made under the lock, after the index
+        has caught up with every other writer, so a decision like "is this
+        message still live" can't be overtaken by another process.
+        """
+        with self._lock, FileLock(self.directory / '.lock'):
+            self._refresh()
+            if build is not None:
+                lines = build()
+                if not lines:
+                    return []
+            data = b''.join(lines)
+            number, fd = self._writer_for(len(data))
+            offset = self._scanned[number]
+            view = memoryview(data)
+            while view:
+                written = os.write(fd, view)
+                view = view[written:]
+            if self.fsync:
+                os.fsync(fd)
+
+            positions = []
+            for line in lines:
+                positions.append((number, offset))
+                offset += len(line)
+            # Our own write is indexed directly instead of re-reading it
+            self._scan(number)
+            return positions
+
+    def append(self, message):
+        """Append one message (a dict with at least an 'id')"""
+        with self._lock:
+            self._open()
+            self._append_lines([encode_message(message)])
+        return message
+
+    def append_many(self, messages, skip_existing=False):
+        """Append a batch in one write; return how many were written"""
+        with self._lock:
+            self._open()
+            self._refresh()
+            if skip_existing:
+                seen = set()
+                fresh = []
+                for message in messages:
+                    key = message['id']
+                    if key not in self._index and key not in self._deleted and key not in seen:
+                        seen.add(key)
+                        fresh.append(message)
+                messages = fresh
+            if messages:
+                self._append_lines([encode_message(m) for m in messages])
+            return len(messages)
+
+    def delete(self, message_id):
+        """Tombstone a message; return False if it doesn't exist"""
+        def tombstone():
+            position = self._index.get(message_id)
+            if position is None:
+                return []  # never was, or another worker deleted it first
+            try:
+                message = json.loads(self._read_line(*position))
+            except ValueError:
+                message = None
+            return [encode_tombstone(message_id, message)]
+
+        with self._lock:
+            self._open()
+            return bool(self._append_lines(build=tombstone))
+
+    def sync(self):
+        with self._lock:
+            if self._write_fd is not None:
+                os.fsync(self._write_fd)
+
+    def clear(self):
+        """Delete every segment (manage_server.py "clear data")"""
+        with self._lock:
+            self._open()
+            with FileLock(self.directory / '.lock'):
+                self._close_writer()
+                numbers = self._list_segments()
+                if numbers:
+                    # Numbering goes on after the old segments (see the module docstring)
+                    self.segment_path(numbers[-1] + 1).touch()
+                for number in numbers:
+                    self.segment_path(number).unlink()
+                self._reset_index()
+
+    def close(self):
+        with self._lock:
+            self._close_writer()
+
+    def after_fork(self):
+        """Reset per-process handles in a forked child; the index stays shared copy-on-write"""
+        self._lock = threading.RLock()
+        if self._write_fd is not None:
+            os.close(self._write_fd)  # the child's copy; the parent keeps its own
+        self._write_fd = None
+        self._write_segment = None
+
+    # ----- reading -----
+
+    def _read_line(self, number, offset):
+        with open(self.segment_path(number), 'rb') as f:
+            f.seek(offset)
+            return f.readline().rstrip(b'\n')
+
+    def count(self):
+        with self._lock:
+            self._open()
+            self._refresh()
+            return len(self._index)
+
+    def contains(self, message_id):
+        with self._lock:
+            self._open()
+            self._refresh()
+            return message_id in self._index
+
+    def get(self, message_id):
+        """One message by id, or None"""
+        with self._lock:
+            self._open()
+            self._refresh()
+            position = self._index.get(message_id)
+            if position is None:
+                return None
+            return json.loads(self._read_line(*position))
+
+    def _live_snapshot(self):
+        with self._lock:
+            self._open()
+            self._refresh()
+            return list(self._segments), dict(self._scanned), self._index
+
+    def iter_raw(self):
+        """Raw line of every live message, oldest first, straight from mmap"""
+        return self.scan_live()[1]
+
+    def scan_live(self):
+        """(end position, iterator of raw live lines) from one snapshot
+
+        Following the log with read_since() from that position continues
+        exactly where the lines stop.
+        """
+        segments, scanned, index = self._live_snapshot()
+        end = (segments[-1], scanned[segments[-1]]) if segments else (0, 0)
+        return end, self._iter_snapshot(segments, scanned, index)
+
+    def _iter_snapshot(self, segments, scanned, index):
+        for number in segments:
+            try:
+                buffer = map_file(self.segment_path(number))
+            except FileNotFoundError:
+                continue
+            if buffer is None:
+                continue
+            try:
+                for offset, line in iter_lines(buffer, 0, scanned[number]):
+                    kind, key = parse_key(line)
+                    if kind == 'message' and index.get(key) == (number, offset):
+                        yield line
+            finally:
+                buffer.close()
+
+    def iter_messages(self):
+        """Every live message as a dict, oldest first"""
+        # One json.loads over a joined chunk is much cheaper than one per line
+        chunk = []
+        for line in self.iter_raw():
+            chunk.append(line)
+            if len(chunk) >= DECODE_CHUNK:
+                yield from json.loads(b'[' + b','.join(chunk) + b']')
+                chunk.clear()
+        if chunk:
+            yield from json.loads(b'[' + b','.join(chunk) + b']')
+
+    def tail(self, limit=50):
+        """The last `limit` live messages, oldest first, read from the end of the log"""
+        lines = self._tail_lines(limit)
+        return json.loads(b'[' + b','.join(lines) + b']') if lines else []
+
+    def _tail_lines(self, limit):
+        if limit <= 0:
+            return []
+        segments, scanned, index = self._live_snapshot()
+        found = []
+        for number in reversed(segments):
+            try:
+                buffer = map_file(self.segment_path(number))
+            except FileNotFoundError:
+                continue
+            if buffer is None:
+                continue
+            try:
+                for offset, line in iter_lines_reversed(buffer, scanned[number]):
+                    kind, key = parse_key(line)
+                    if kind == 'message' and index.get(key) == (number, offset):
+                        found.append(line)
+                        if len(found) >= limit:
+                            break
+            finally:
+                buffer.close()
+            if len(found) >= limit:
+                break
+        found.reverse()
+        return found
+
+    # ----- the author index -----
+
+    def _track_author(self, kind, key, line):
+        """Follow an indexed line in the author index (before the main index moves on)"""
+        old = self._index.get(key)
+        if old is not None:
+            # Tombstones name the author; a superseded copy has to be read
+            author = parse_author(line) if kind == 'deleted' else None
+            if author is None or key not in self._by_author.get(author, ()):
+                author = parse_author(self._read_line(*old))
+            ids = self._by_author.get(author)
+            if ids is not None:
+                ids.pop(key, None)
+                if not ids:
+                    del self._by_author[author]
+            if kind == 'deleted':
+                self._author_gone[key] = old
+        if kind == 'message':
+            self._by_author.setdefault(parse_author(line), {})[key] = None
+            self._author_gone.pop(key, None)
+
+    def _build_author_index(self):
+        """One pass over the live lines (caller holds the lock)"""
+        by_author = {}
+        gone = {}
+        index = self._index
+        deleted = self._deleted
+        for number in self._segments:
+            try:
+                buffer = map_file(self.segment_path(number))
+            except FileNotFoundError:
+                continue
+            if buffer is None:
+                continue
+            try:
+                for offset, line in iter_lines(buffer, 0, self._scanned[number]):
+                    kind, key = parse_key(line)
+                    if kind != 'message':
+                        continue
+                    if index.get(key) == (number, offset):
+                        by_author.setdefault(parse_author(line), {})[key] = None
+                    elif key in deleted:
+                        gone[key] = (number, offset)  # its last copy wins, as in the main index
+            finally:
+                buffer.close()
+        self._by_author = by_author
+        self._author_gone = gone
+
+    def _author_ids(self, username):
+        self._open()
+        self._refresh()
+        if self._by_author is None:
+            self._build_author_index()
+        return self._by_author.get(username, {})
+
+    def count_by_author(self, username):
+        with self._lock:
+            return len(self._author_ids(username))
+
+    def by_author(self, username, limit=50, before=None):
+        """A page of a user's messages, newest first: (raw lines oldest first, next cursor, total)
+
+        `before` is the id the previous page returned as its cursor (its
+        oldest message); None starts from the newest. If that message has
+        been deleted since, the page starts at the nearest older one.
+        """
+        with self._lock:
+            ids = self._author_ids(username)
+            total = len(ids)
+            newest_first = reversed(ids)
+            if before is not None:
+                if before in ids:
+                    for key in newest_first:
+                        if key == before:
+                            break
+                else:
+                    # ids are in log order, so everything past the deleted line comes first
+                    gone = self._author_gone.get(before)
+                    index = self._index
+                    newest_first = dropwhile(lambda key: index[key] > gone, newest_first) if gone else iter(())
+            page = list(islice(newest_first, max(0, limit)))
+            positions = [self._index[key] for key in page]
+            more = len(page) == limit and page[-1] != next(iter(ids), None)
+        lines = []
+        try:
+            for position in reversed(positions):
+                lines.append(self._read_line(*position))
+        except FileNotFoundError:
+            return self.by_author(username, limit, before)  # compacted meanwhile: read the new files
+        return lines, page[-1] if more and page else None, total
+
+    def delete_by_author(self, username):
+        """Tombstone every live message of `username` in one write; return how many"""
+        def tombstones():
+            lines = []
+            for key in self._author_ids(username):
+                try:
+                    message = json.loads(self._read_line(*self._index[key]))
+                except ValueError:
+                    message = {'username': username}
+                lines.append(encode_tombstone(key, message))
+            return lines
+
+        with self._lock:
+            self._open()
+            return len(self._append_lines(build=tombstones))
+
+    # ----- the recent ring -----
+
+    def _track_recent(self, kind, key, line):
+        """Follow an indexed line in the ring (a newer copy or tombstone replaces the old)"""
+        if key in self._index:
+            for record in self._recent:
+                if record.id == key:
+                    self._recent.remove(record)
+                    break
+        if kind == 'message':
+            self._remember(self._recent, key, line)
+
+    @staticmethod
+    def _remember(ring, key, line):
+        try:
+            ring.append(RecentMessage(key, line))
+        except ValueError:
+            pass  # a damaged line isn't served from memory
+
+    def recent_lines(self, limit=50):
+        """Log lines (compact JSON) of the last `limit` live messages, oldest first
+
+        Served from the in-memory ring when it covers `limit`; only the
+        first call, a larger `limit` or a ring thinned by deletes reads the log.
+        `limit` None means every live message.
+        """
+        if limit is None:
+            return self._tail_lines(sys.maxsize)
+        if limit <= 0:
+            return []
+        with self._lock:
+            self._open()
+            self._refresh()
+            ring = self._recent
+            live = len(self._index)
+            if limit <= self.recent_size and (ring is None or len(ring) < min(limit, live)):
+                # Not built yet, or deletes left it short: refill from the end of the log
+                ring = self._recent = deque(maxlen=self.recent_size)
+                for line in self._tail_lines(self.recent_size):
+                    self._remember(ring, parse_key(line)[1], line)
+            if ring is not None and (limit <= len(ring) or len(ring) == live):
+                return [record.raw for record in islice(ring, max(0, len(ring) - limit), None)]
+        return self._tail_lines(limit)
+
+    def recent_json(self, limit=50):
+        """recent_lines() as one JSON array, ready to send"""
+        return b'[' + b','.join(self.recent_lines(limit)) + b']'
+
+    def end_position(self):
+        """(segment, offset) just past the last indexed line, for read_since()"""
+        with self._lock:
+            self._open()
+            self._refresh()
+            if not self._segments:
+                return (0, 0)
+            last = self._segments[-1]
+            return (last, self._scanned[last])
+
+    def read_since(self, position):
+        """Records appended after `position`, and the new end position
+
+        Returns ([(kind, record), ...], position) where kind is 'message' or
+        'deleted'. Only the new bytes are read. If the log was cleared or
+        compacted since `position`, nothing is returned and the position
+        jumps to the current end.
+        """
+        segments, scanned, _ = self._live_snapshot()
+        if not segments:
+            return [], (0, 0)
+        start_segment, start_offset = position
+        if start_segment and (start_segment not in scanned or start_offset > scanned[start_segment]):
+            return [], (segments[-1], scanned[segments[-1]])
+
+        records = []
+        for number in segments:
+            if number < start_segment:
+                continue
+            start = start_offset if number == start_segment else 0
+            if start >= scanned[number]:
+                continue
+            try:
+                buffer = map_file(self.segment_path(number))
+            except FileNotFoundError:
+                continue
+            if buffer is None:
+                continue
+            try:
+                for _, line in iter_lines(buffer, start, scanned[number]):
+                    kind, _ = parse_key(line)
+                    if kind:
+                        records.append((kind, json.loads(line)))
+            finally:
+                buffer.close()
+        return records, (segments[-1], scanned[segments[-1]])
+
+    def stats(self):
+        """Counts and sizes straight from the index, without reading messages"""
+        with self._lock:
+            self._open()
+            self._refresh()
+            return {
+                'messages': len(self._index),
+                'deleted': len(self._deleted),
+                'segments': len(self._segments),
+                'bytes': sum(self._scanned.values()),
+                'dead_ratio': round(self._dead_ratio(), 3),
+            }
+
+    # ----- compaction -----
+
+    def _dead_ratio(self):
+        """Share of indexed records that are tombstones or no longer live"""
+        return (self._lines - len(self._index)) / self._lines if self._lines else 0.0
+
+    def needs_compaction(self, ratio, min_bytes, max_age=None):
+        """Enough dead records (or expired messages) to be worth a rewrite"""
+        with self._lock:
+            self._open()
+            self._refresh()
+            if not self._segments or sum(self._scanned.values()) < min_bytes:
+                return False
+            if self._dead_ratio() >= ratio:
+                return True
+            first = self._segments[0]
+        if max_age:
+            # The oldest record well past the cutoff (a tenth of max_age of slack)
+            oldest = self._first_timestamp(first)
+            return oldest is not None and oldest < _age_cutoff(max_age * 1.1)
+        return False
+
+    def _first_timestamp(self, number):
+        try:
+            with open(self.segment_path(number), 'rb') as f:
+                line = f.readline()
+            record = json.loads(line)
+            return record.get('timestamp') or record.get('at')
+        except (OSError, ValueError, AttributeError):
+            return None
+
+    def compact(self, max_age=None, only_if=None):
+        """Rewrite the log keeping only live messages; return a report or None
+
+        1. Without blocking anyone, the live messages as of now (and younger
+           than `max_age` seconds, if given) are copied into temporary files,
+           at most `segment_bytes` each, and a new index is built on the way.
+        2. Under the write lock, whatever was appended meanwhile is copied
+           after them as is (its tombstones still apply), the temporary files
+           are renamed to segment numbers after every existing one, the old
+           segments are removed and the new index is installed.
+
+        Other processes see their segments vanish and re-index. If the
+        process dies between the renames and the removals, the old and new
+        segments together still index to the same messages. Tombstones are
+        dropped, so a later import with skip_existing can bring a deleted
+        message back. `only_if(store)` is re-checked once this process holds
+        the compaction lock, so concurrent triggers run it once.
+        """
+        with FileLock(self.directory / '.compact.lock'):
+            if only_if is not None and not only_if(self):
+                return None
+            for leftover in glob.glob(str(self.directory / '.compact-*.tmp')):
+                os.unlink(leftover)
+
+            with self._lock:
+                self._open()
+                self._refresh()
+                if not self._segments:
+                    return None
+                before = {'bytes': sum(self._scanned.values()), 'segments': len(self._segments),
+                          'records': self._lines}
+                segments, scanned, index = list(self._segments), dict(self._scanned), dict(self._index)
+            cut_segment = segments[-1]
+
+            output = _CompactOutput(self.directory, self.segment_bytes, self.fsync)
+            cutoff = _age_cutoff(max_age) if max_age else None
+            expired = 0
+            try:
+                for number in segments:
+                    try:
+                        buffer = map_file(self.segment_path(number))
+                    except FileNotFoundError:
+                        continue
+                    if buffer is None:
+                        continue
+                    try:
+                        for offset, line in iter_lines(buffer, 0, scanned[number]):
+                            kind, key = parse_key(line)
+                            if kind != 'message' or index.get(key) != (number, offset):
+                                continue
+                            if cutoff is not None and (json.loads(line).get('timestamp') or cutoff) < cutoff:
+                                expired += 1
+                                continue
+                            output.add(key, line)
+                    finally:
+                        buffer.close()
+
+                with self._lock, FileLock(self.directory / '.lock'):
+                    self._refresh()
+                    if self._segments[:1] != segments[:1]:
+                        return None  # someone else rewrote the log meanwhile
+                    # The tail: appended after the snapshot, copied verbatim
+                    for number in self._segments:
+                        if number < cut_segment:
+                            continue
+                        start = scanned[number] if number == cut_segment else 0
+                        buffer = map_file(self.segment_path(number))
+                        if buffer is None:
+                            continue
+                        try:
+                            for _, line in iter_lines(buffer, start, self._scanned[number]):
+                                output.add_tail(*parse_key(line), line)
+                        finally:
+                            buffer.close()
+
+                    old = list(self._segments)
+                    new = output.install(old[-1] + 1)
+                    if not new:
+                        # Nothing live: an empty segment keeps the numbering going
+                        self.segment_path(old[-1] + 1).touch()
+                        new = [(old[-1] + 1, 0)]
+                    self._close_writer()
+                    for number in old:
+                        self.segment_path(number).unlink()
+                    self._segments = [n for n, _ in new]
+                    self._scanned = dict(new)
+                    self._inodes = {}
+                    self._index = output.index
+                    self._deleted = output.deleted
+                    self._lines = output.lines
+                    self._recent = None
+                    self._by_author = None
+                    self._author_gone = {}
+                    after = {'bytes': sum(self._scanned.values()), 'segments': len(self._segments),
+                             'records': self._lines}
+            finally:
+                output.discard()
+        return {'before': before, 'after': after, 'expired': expired, 'messages': len(self._index)}
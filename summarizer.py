@@ -0,0 +1,284 @@
+"""
+Context budget for the AI proxy: old turns become a rolling summary
+
+When the estimated prompt of a /api/ollama/chat request is over
+`max_tokens`, the leading system messages and the last `keep_recent`
+turns are kept as they are, and the older turns are replaced by a summary
+of them (one system message) plus as many of the newest turns it doesn't
+cover yet as still fit.
+
+Summaries are written by a background thread (one per process, started on
+first use) with the chat's own model and memoized per chat in an LRU
+cache, so a request never waits for one. A summary remembers a digest of
+the turns it ends with (see below): it is reused as long as the request
+still holds those, and rolled forward (previous summary + the turns since)
+only when turns would otherwise be dropped. Until the first summary of a
+chat is ready, its oldest turns are simply dropped.
+
+Clients send a window of the latest turns (script.js sends the last 40),
+so a chat's first turns are not a stable reference. A summary is anchored
+to the turns it ends with instead: it applies to a request whose older
+turns contain those, wherever they now are in the window, and covers
+everything up to there, including turns that have slid out of it.
+
+A chat is the caller plus the `chat_id` the client sends (removed before
+forwarding), or the caller plus the chat's first message without one
+(which only works while the client sends the whole chat).
+Summarizer calls are counted apart from the proxied traffic, see stats().
+"""
+
+import hashlib
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+CHARS_PER_TOKEN = 3          # rough, and on the high side for Cyrillic text
+MESSAGE_OVERHEAD = 4         # role and separators, per message
+DEFAULT_MAX_TOKENS = 3000
+DEFAULT_KEEP_RECENT = 6
+DEFAULT_SUMMARY_TOKENS = 256
+DEFAULT_CACHE_SIZE = 1000
+DEFAULT_TIMEOUT = 120
+MAX_PENDING = 100
+MAX_TURN_CHARS = 2000        # per turn, in the summarizer's own prompt
+ANCHOR_TURNS = 2             # last turns of a summary that locate it in a later request
+
+SUMMARY_PROMPT = (
+    'Составь краткое содержание разговора пользователя с ассистентом. '
+    'Сохрани факты, решения, имена, код и открытые вопросы; без вступлений. '
+    'Пиши на языке разговора, не больше нескольких абзацев.'
+)
+SUMMARY_PREFIX = 'Краткое содержание предыдущей части разговора:\n'
+
+
+def estimate_tokens(message):
+    content = message.get('content')
+    return MESSAGE_OVERHEAD + math.ceil(len(content if isinstance(content, str) else '') / CHARS_PER_TOKEN)
+
+
+def digest_turns(turns):
+    h = hashlib.blake2b(digest_size=16)
+    for turn in turns:
+        h.update(f"{turn.get('role')}\0{turn.get('content')}\1".encode('utf-8', 'replace'))
+    return h.hexdigest()
+
+
+class Summary:
+    __slots__ = ('anchor', 'size', 'text')
+
+    def __init__(self, anchor, size, text):
+        self.anchor = anchor        # digest_turns() of the last turns it stands for
+        self.size = size            # how many turns that digest is over
+        self.text = text
+
+    @classmethod
+    def ending_with(cls, turns, text):
+        size = min(ANCHOR_TURNS, len(turns))
+        return cls(digest_turns(turns[len(turns) - size:]), size, text)
+
+    def end_in(self, turns):
+        """Index just after the last turn this summary covers in `turns`, or None"""
+        for end in range(len(turns), self.size - 1, -1):
+            if digest_turns(turns[end - self.size:end]) == self.anchor:
+                return end
+        return None
+
+
+class ContextBudget:
+    def __init__(self, pool, max_tokens=DEFAULT_MAX_TOKENS, keep_recent=DEFAULT_KEEP_RECENT,
+                 summary_tokens=DEFAULT_SUMMARY_TOKENS, cache_size=DEFAULT_CACHE_SIZE,
+                 timeout=DEFAULT_TIMEOUT, clock=time.monotonic):
+        self.pool = pool
+        self.max_tokens = max_tokens
+        self.keep_recent = keep_recent
+        self.summary_tokens = summary_tokens
+        self.cache_size = cache_size
+        self.timeout = timeout
+        self.clock = clock
+        self._cache = OrderedDict()    # chat key -> Summary, least recently used first
+        self._reset_process_state()
+
+    def _reset_process_state(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._pending = OrderedDict()  # chat key -> (model, base Summary, turns), newest per chat
+        self._worker_pid = None
+        self.counters = {
+            'trimmed': 0, 'tokens_saved': 0,
+            # What the summarizer itself costs
+            'summaries': 0, 'failures': 0, 'dropped': 0, 'seconds': 0.0,
+            'prompt_tokens': 0, 'output_tokens': 0,
+        }
+        self.last_error = None
+
+    @staticmethod
+    def chat_key(caller, chat_id, turns):
+        if chat_id is not None:
+            return f'{caller}:{chat_id}'
+        return f'{caller}:{digest_turns(turns[:1])}'
+
+    # ----- the request path -----
+
+    def apply(self, data, caller):
+        """The body to forward: `data`, or a copy whose messages fit the budget"""
+        chat_id = data.pop('chat_id', None)
+        messages = data.get('messages')
+        if not isinstance(messages, list) or not all(isinstance(m, dict) for m in messages):
+            return data
+        costs = [estimate_tokens(m) for m in messages]
+        total = sum(costs)
+        if total <= self.max_tokens:
+            return data
+
+        head = 0
+        while head < len(messages) and messages[head].get('role') == 'system':
+            head += 1
+        split = max(head, len(messages) - self.keep_recent)
+        if split == head:
+            return data  # nothing but the system prompt and recent turns
+        older = messages[head:split]
+
+        key = self.chat_key(caller, str(chat_id) if chat_id is not None else None, messages[head:])
+        summary, covered = self._cached(key, older)
+        summary_messages = []
+        if summary is not None:
+            summary_messages.append({'role': 'system', 'content': SUMMARY_PREFIX + summary.text})
+
+        # The newest uncovered turns that still fit, dropping from the front
+        left = (self.max_tokens - sum(costs[:head]) - sum(costs[split:])
+                - sum(estimate_tokens(m) for m in summary_messages))
+        start = split
+        while start > head + covered and costs[start - 1] <= left:
+            start -= 1
+            left -= costs[start]
+
+        if start > head + covered:
+            # Turns are being lost: roll the summary forward over all of them
+            self._schedule(key, data.get('model'), summary, older[covered:])
+
+        trimmed = messages[:head] + summary_messages + messages[start:]
+        with self._lock:
+            self.counters['trimmed'] += 1
+            self.counters['tokens_saved'] += max(0, total - sum(estimate_tokens(m) for m in trimmed))
+        forwarded = dict(data)
+        forwarded['messages'] = trimmed
+        return forwarded
+
+    def _cached(self, key, older):
+        """(the chat's summary, how many of `older` it covers), or (None, 0) if it doesn't apply"""
+        with self._lock:
+            summary = self._cache.get(key)
+            if summary is None:
+                return None, 0
+            self._cache.move_to_end(key)
+        end = summary.end_in(older)
+        if end is None:
+            return None, 0  # edited, slid out of the window or a different chat: a new one will be made
+        return summary, end
+
+    # ----- the summarizer -----
+
+    def _schedule(self, key, model, base, turns):
+        self._ensure_worker()
+        with self._lock:
+            if key not in self._pending and len(self._pending) >= MAX_PENDING:
+                self.counters['dropped'] += 1
+                return
+            self._pending[key] = (model, base, list(turns))
+            self._wake.notify()
+
+    def _ensure_worker(self):
+        """Start this process's summarizer thread (threads don't survive a fork)"""
+        if self._worker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker_pid == os.getpid():
+                return
+            self._worker_pid = os.getpid()
+        threading.Thread(target=self._work_loop, name='ai-summarizer', daemon=True).start()
+
+    def _work_loop(self):
+        while True:
+            with self._lock:
+                self._wake.wait_for(lambda: self._pending)
+                key, (model, base, turns) = self._pending.popitem(last=False)
+            try:
+                self._summarize(key, model, base, turns)
+            except Exception as e:
+                # An odd chat must not stop summaries for everyone else
+                with self._lock:
+                    self.counters['failures'] += 1
+                    self.last_error = f'{type(e).__name__}: {e}'
+
+    def _summarize(self, key, model, base, turns):
+        """Summarize `turns` (the ones `base`, if any, doesn't cover yet)"""
+        transcript = '\n\n'.join(
+            f"{'Пользователь' if t.get('role') == 'user' else 'Ассистент'}: {str(t.get('content'))[:MAX_TURN_CHARS]}"
+            for t in turns)
+        if base is not None:
+            transcript = f'Краткое содержание до этого места:\n{base.text}\n\nПродолжение разговора:\n{transcript}'
+        body = {
+            'model': model,
+            'stream': False,
+            'messages': [{'role': 'system', 'content': SUMMARY_PROMPT},
+                         {'role': 'user', 'content': transcript}],
+            'options': {'temperature': 0.2, 'num_predict': self.summary_tokens},
+        }
+
+        started = self.clock()
+        text, usage = self._complete(body)
+        elapsed = self.clock() - started
+        with self._lock:
+            self.counters['seconds'] += elapsed
+            self.counters['prompt_tokens'] += usage.get('prompt_eval_count') or 0
+            self.counters['output_tokens'] += usage.get('eval_count') or 0
+            if not text:
+                self.counters['failures'] += 1
+                return
+            self.counters['summaries'] += 1
+            self._cache[key] = Summary.ending_with(turns, text)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _complete(self, body):
+        """One non-streamed /api/chat call through the pool: (text or None, response fields)"""
+        import requests
+
+        from ollama_pool import NoBackendError
+
+        try:
+            backend = self.pool.acquire(body['model'])
+        except NoBackendError:
+            return None, {}
+        ok = False
+        try:
+            response = requests.post(f'{backend.url}/api/chat', json=body, timeout=self.timeout)
+            ok = response.status_code < 500
+            if response.status_code != 200:
+                return None, {}
+            result = response.json()
+            text = ((result.get('message') or {}).get('content') or '').strip()
+            return text or None, result
+        except (requests.exceptions.RequestException, ValueError):
+            return None, {}
+        finally:
+            self.pool.release(backend, ok)
+
+    # ----- stats -----
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self.counters,
+                'seconds': round(self.counters['seconds'], 3),
+                'cached': len(self._cache),
+                'pending': len(self._pending),
+                'error': self.last_error,
+            }
+
+    def after_fork(self):
+        """In a forked child: no worker, no queued jobs; memoized summaries stay"""
+        self._reset_process_state()
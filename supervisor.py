@@ -0,0 +1,230 @@
+"""
+Production worker pool for server.py, supervised by manage_server.py
+
+Where gunicorn runs (Linux/macOS) the pool is a gunicorn master with one
+gthread worker per CPU, each serving requests on a small thread pool.
+gunicorn respawns a worker that dies. On Windows, where gunicorn isn't
+available, a single threaded server process is used instead.
+
+The supervisor:
+- starts the pool and reports it ready only once /api/health answers
+- reloads without downtime: SIGHUP makes gunicorn boot the new workers
+  before retiring the old ones, and reload() returns once /api/health
+  answers from a worker that started after the signal
+- restarts the whole pool with exponential backoff when it exits on its
+  own (e.g. workers that fail to boot make the gunicorn master quit)
+
+With `preload` the app is imported once in the gunicorn master and workers
+fork from it (faster boot, shared memory), but SIGHUP would then fork the
+old code again, so reload() restarts the pool instead.
+"""
+
+import atexit
+import importlib.util
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from pathlib import Path
+
+DEFAULT_THREADS = 8          # SSE streams hold a thread each for as long as they are open
+READY_TIMEOUT = 30
+GRACEFUL_TIMEOUT = 30
+BACKOFF_INITIAL = 1.0
+BACKOFF_MAX = 30.0
+STABLE_AFTER = 60            # a pool that ran this long resets the backoff
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+
+def gunicorn_available():
+    return os.name != 'nt' and importlib.util.find_spec('gunicorn') is not None
+
+
+def backoff_delay(failures, initial=BACKOFF_INITIAL, maximum=BACKOFF_MAX):
+    """Delay before the next restart after `failures` crashes in a row"""
+    return min(maximum, initial * (2 ** failures))
+
+
+class WorkerSupervisor:
+    def __init__(self, app_dir, host='0.0.0.0', port=5000, workers=None, threads=DEFAULT_THREADS,
+                 preload=False, ready_timeout=READY_TIMEOUT, log_file=None, log=print):
+        self.app_dir = Path(app_dir)
+        self.host = host
+        self.port = port
+        self.workers = workers or default_workers()
+        self.threads = threads
+        self.preload = preload
+        self.ready_timeout = ready_timeout
+        self.log_file = Path(log_file) if log_file else self.app_dir / 'logs' / 'server.log'
+        self.log = log
+        self.use_gunicorn = gunicorn_available()
+
+        self.process = None
+        self.started_at = None
+        self.restarts = 0
+        self._failures = 0
+        self._lock = threading.RLock()
+        self._stopping = threading.Event()
+        self._watcher = None
+
+    # ----- helpers -----
+
+    @property
+    def url(self):
+        host = '127.0.0.1' if self.host in ('0.0.0.0', '') else self.host
+        return f'http://{host}:{self.port}'
+
+    @property
+    def mode(self):
+        return 'gunicorn' if self.use_gunicorn else 'threaded'
+
+    @property
+    def running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def command(self):
+        if self.use_gunicorn:
+            # The rest of the settings (app factory, hooks) are in gunicorn.conf.py
+            command = [
+                sys.executable, '-m', 'gunicorn',
+                '--config', str(self.app_dir / 'gunicorn.conf.py'),
+                '--bind', f'{self.host}:{self.port}',
+                '--workers', str(self.workers),
+                '--threads', str(self.threads),
+                '--graceful-timeout', str(GRACEFUL_TIMEOUT),
+                '--chdir', str(self.app_dir),
+            ]
+            if self.preload:
+                command.append('--preload')
+            return command
+        return [
+            sys.executable, '-c',
+            'from server import create_app; '
+            f'create_app().run(host={self.host!r}, port={self.port}, threaded=True, debug=False)',
+        ]
+
+    def health(self, timeout=1):
+        """/api/health of whichever worker answers, or None"""
+        try:
+            with urllib.request.urlopen(f'{self.url}/api/health', timeout=timeout) as response:
+                return json.load(response)
+        except (OSError, ValueError):
+            return None
+
+    def wait_ready(self, timeout=None, newer_than=None):
+        """Poll /api/health until it answers (from a worker started after `newer_than`)"""
+        deadline = time.monotonic() + (self.ready_timeout if timeout is None else timeout)
+        while time.monotonic() < deadline:
+            if not self.running:
+                return False
+            health = self.health()
+            if health and (newer_than is None or health.get('started_at', 0) > newer_than):
+                return True
+            time.sleep(0.2)
+        return False
+
+    def _spawn(self):
+        self.log_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.log_file, 'ab') as log:
+            kwargs = {'cwd': self.app_dir, 'stdout': log, 'stderr': subprocess.STDOUT}
+            if os.name == 'nt':
+                kwargs['creationflags'] = subprocess.CREATE_NEW_PROCESS_GROUP
+            self.process = subprocess.Popen(self.command(), **kwargs)
+        self.started_at = time.monotonic()
+
+    # ----- lifecycle -----
+
+    def start(self):
+        """Start the pool; True once it answers /api/health"""
+        with self._lock:
+            if self.running:
+                return True
+            if self.health() is not None:
+                # Someone else already serves this port; our pool couldn't bind it
+                self.log(f"❌ {self.url} уже занят другим сервером")
+                return False
+            self._stopping.clear()
+            self._failures = 0
+            self._spawn()
+            if self._watcher is None or not self._watcher.is_alive():
+                self._watcher = threading.Thread(target=self._watch, name='supervisor', daemon=True)
+                self._watcher.start()
+                # Don't leave an orphaned pool behind if the manager exits
+                atexit.unregister(self.stop)
+                atexit.register(self.stop)
+        return self.wait_ready()
+
+    def reload(self):
+        """Swap in fresh workers (new code) without dropping requests"""
+        with self._lock:
+            if not self.running:
+                return False
+            if not self.use_gunicorn or self.preload:
+                # A single process can't hand over its socket, and a preloaded
+                # master would fork the old code again: plain restart
+                self._terminate()
+                self._spawn()
+                return self.wait_ready()
+            marker = time.time()
+            self.process.send_signal(signal.SIGHUP)
+        return self.wait_ready(newer_than=marker)
+
+    def stop(self):
+        self._stopping.set()
+        with self._lock:
+            self._terminate()
+            self.process = None
+            self.started_at = None
+
+    def _terminate(self):
+        process = self.process
+        if process is None or process.poll() is not None:
+            return
+        # gunicorn treats SIGTERM as a graceful shutdown: workers finish their requests
+        process.terminate()
+        try:
+            process.wait(timeout=GRACEFUL_TIMEOUT + 5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    def _watch(self):
+        while not self._stopping.wait(0.5):
+            with self._lock:
+                process = self.process
+                if process is None or process.poll() is None:
+                    continue
+                if time.monotonic() - self.started_at >= STABLE_AFTER:
+                    self._failures = 0
+                delay = backoff_delay(self._failures)
+                self._failures += 1
+                self.restarts += 1
+            self.log(f"⚠️  Сервер завершился (код {process.returncode}), перезапуск через {delay:.0f} с")
+            if self._stopping.wait(delay):
+                return
+            with self._lock:
+                if self._stopping.is_set() or self.process is not process:
+                    continue
+                self._spawn()
+            if self.wait_ready():
+                self.log("✅ Сервер снова отвечает")
+
+    def status(self):
+        return {
+            'running': self.running,
+            'mode': self.mode,
+            'pid': self.process.pid if self.running else None,
+            'workers': self.workers if self.use_gunicorn else 1,
+            'threads': self.threads if self.use_gunicorn else None,
+            'preload': self.preload and self.use_gunicorn,
+            'restarts': self.restarts,
+            'uptime': round(time.monotonic() - self.started_at) if self.running else 0,
+            'url': self.url,
+        }
@@ -0,0 +1,86 @@
+"""
+Tests of the server-side AI chat history (aichats.ChatHistory): the paged
+chat list, message windows, and two instances standing in for two workers.
+
+    python -m pytest -q
+"""
+
+from aichats import ChatHistory
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def __call__(self):
+        self.now += 1
+        return self.now
+
+
+def history(tmp_path, clock):
+    return ChatHistory(tmp_path / 'ai_chats', clock=clock)
+
+
+def test_chat_list_pages_newest_updated_first(tmp_path):
+    clock = Clock()
+    chats = history(tmp_path, clock)
+    created = [chats.create('anna', f'chat {i}')['id'] for i in range(5)]
+    chats.append('anna', created[0], [{'role': 'user', 'content': 'hi'}])  # now the newest
+
+    titles, cursor = [], None
+    while True:
+        page, cursor = chats.list_chats('anna', limit=2, cursor=cursor)
+        titles += [chat['title'] for chat in page]
+        if cursor is None:
+            break
+    assert titles == ['chat 0', 'chat 4', 'chat 3', 'chat 2', 'chat 1']
+
+    # Another worker sees the same list; other users have their own
+    other = history(tmp_path, clock)
+    page, cursor = other.list_chats('anna', limit=10)
+    assert ([c['id'] for c in page][:1], page[0]['count'], cursor) == (created[:1], 1, None)
+    assert other.list_chats('ivan') == ([], None)
+    assert other.list_chats('anna', cursor='garbage')[0] == page
+
+
+def test_message_windows_from_the_end(tmp_path):
+    chats = history(tmp_path, Clock())
+    chat_id = chats.create('anna')['id']
+    for i in range(0, 120, 30):
+        chats.append('anna', chat_id, [{'role': 'user', 'content': f'm{n}'} for n in range(i, i + 30)])
+
+    window, start, total = chats.messages('anna', chat_id, limit=50)
+    assert (start, total) == (70, 120)
+    assert [m['content'] for m in window] == [f'm{n}' for n in range(70, 120)]
+    window, start, _ = chats.messages('anna', chat_id, before=start, limit=50)
+    assert (window[0]['content'], window[-1]['content'], start) == ('m20', 'm69', 20)
+    window, start, _ = chats.messages('anna', chat_id, before=start, limit=50)
+    assert (len(window), start) == (20, 0)
+    assert chats.messages('anna', chat_id, before=0) == ([], 0, 120)
+    assert chats.messages('anna', 'missing') is None
+
+
+def test_torn_append_is_written_past(tmp_path):
+    chats = history(tmp_path, Clock())
+    chat_id = chats.create('anna')['id']
+    chats.append('anna', chat_id, [{'role': 'user', 'content': 'first'}])
+    # A crash after the message line but before its offset
+    with open(chats.user_dir('anna') / f'{chat_id}.jsonl', 'ab') as log:
+        log.write(b'{"role":"user","content":"lost","ts":0}\n')
+
+    assert chats.append('anna', chat_id, [{'role': 'assistant', 'content': 'second'}]) == 2
+    window, _, total = chats.messages('anna', chat_id)
+    assert [m['content'] for m in window] == ['first', 'second']
+
+
+def test_delete_and_rename_from_another_worker(tmp_path):
+    clock = Clock()
+    first, second = history(tmp_path, clock), history(tmp_path, clock)
+    kept, dropped = first.create('anna', 'kept')['id'], first.create('anna', 'dropped')['id']
+    assert second.get('anna', dropped)['title'] == 'dropped'
+
+    assert second.delete('anna', dropped) is True
+    assert second.rename('anna', kept, 'renamed')['title'] == 'renamed'
+    assert first.get('anna', dropped) is None
+    assert [c['title'] for c in first.list_chats('anna')[0]] == ['renamed']
+    assert first.delete('anna', dropped) is False
@@ -0,0 +1,97 @@
+"""
+Tests of backups (backup.BackupManager): full and incremental archives of
+a data directory, restored chain by chain into a new one.
+
+    python -m pytest -q
+"""
+
+import json
+import time
+
+from aichats import ChatHistory
+from backup import BackupManager
+from storage import MessageStore
+
+
+def message(i, username='anna'):
+    return {'id': f'm{i}', 'username': username, 'avatar': 'A', 'content': f'text {i}',
+            'timestamp': '2025-01-01T10:00:00'}
+
+
+def ids(store):
+    return [json.loads(line)['id'] for line in store.iter_raw()]
+
+
+def test_incremental_chain_restores_every_step(tmp_path):
+    data = tmp_path / 'data'
+    store = MessageStore(data / 'messages')
+    room = MessageStore(data / 'rooms' / 'dev')
+    chats = ChatHistory(data / 'ai_chats')
+    data.mkdir()
+    (data / 'users.json').write_text('{"anna": {}}', encoding='utf-8')
+    backups = BackupManager(data, full_every=10)
+
+    for i in range(3):
+        store.append(message(i))
+    kept = chats.create('anna', 'kept')['id']
+    dropped = chats.create('anna', 'dropped')['id']
+    full = backups.run()
+    assert full.name.endswith('-full.tar.gz')
+
+    store.append(message(3))
+    store.delete('m0')
+    room.append(message(10))
+    chats.append('anna', kept, [{'role': 'user', 'content': 'hi'}])
+    chats.delete('anna', dropped)
+    second = backups.run()
+
+    store.compact()  # rewritten: the next backup copies this log whole
+    store.append(message(4))
+    third = backups.run()
+    assert [p.name for p in backups.chain()] == [full.name, second.name, third.name]
+
+    restored = tmp_path / 'restored'
+    backups.restore(restored)
+    assert ids(MessageStore(restored / 'messages')) == ['m1', 'm2', 'm3', 'm4']
+    assert ids(MessageStore(restored / 'rooms' / 'dev')) == ['m10']
+    assert (restored / 'users.json').read_text(encoding='utf-8') == '{"anna": {}}'
+    history = ChatHistory(restored / 'ai_chats')
+    assert [c['title'] for c in history.list_chats('anna')[0]] == ['kept']
+    assert history.messages('anna', kept)[0][0]['content'] == 'hi'
+
+    earlier = tmp_path / 'earlier'
+    backups.restore(earlier, upto=full.name)
+    assert ids(MessageStore(earlier / 'messages')) == ['m0', 'm1', 'm2']
+    assert len(ChatHistory(earlier / 'ai_chats').list_chats('anna')[0]) == 2
+
+
+def test_only_the_newest_chains_are_kept(tmp_path):
+    store = MessageStore(tmp_path / 'messages')
+    backups = BackupManager(tmp_path, full_every=2, keep_full=2)
+    for i in range(6):
+        store.append(message(i))
+        backups.run()
+
+    names = [p.name for p in backups.chain()]
+    assert [n.split('-')[2] for n in names] == ['full.tar.gz', 'incr.tar.gz']
+    assert len(list(backups.backup_dir.glob('backup-*'))) == 4
+    assert backups.run(only_if_due=True) is None  # taken just now
+
+
+def test_scheduler_survives_errors(tmp_path):
+    backups = BackupManager(tmp_path, interval=0.01)
+    calls = []
+
+    def run(full=False, only_if_due=False):
+        calls.append(1)
+        raise RuntimeError('damaged state')
+
+    backups.run = run
+    backups.ensure_scheduler()
+    deadline = time.monotonic() + 5
+    while len(calls) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    backups.close()
+
+    assert len(calls) >= 2
+    assert backups.stats()['error'] == 'RuntimeError: damaged state'
@@ -0,0 +1,81 @@
+"""
+Tests of POST /api/batch against an app over a temporary data directory
+
+    python -m pytest -q
+"""
+
+import pytest
+
+import server
+
+
+@pytest.fixture
+def client(tmp_path):
+    app = server.create_app({'data': {'data_dir': str(tmp_path), 'auto_backup': False},
+                             'rate_limits': {'enabled': False}})
+    client = app.test_client()
+    response = client.post('/api/auth/register',
+                           json={'username': 'anna', 'email': 'anna@example.com', 'password': 'secret1'})
+    assert response.status_code == 201
+    return client
+
+
+def batch(client, *requests):
+    response = client.post('/api/batch', json={'requests': list(requests)})
+    assert response.status_code == 200
+    return response.get_json()['responses']
+
+
+def test_items_run_in_order(client):
+    sent, listed = batch(
+        client,
+        {'id': 'send', 'method': 'POST', 'path': '/api/chat/messages', 'body': {'content': 'hello'}},
+        {'id': 'list', 'path': '/api/chat/messages', 'params': {'limit': 10}},
+    )
+    assert (sent['id'], sent['status']) == ('send', 201)
+    assert (listed['id'], listed['status']) == ('list', 200)
+    assert [m['content'] for m in listed['body']] == ['hello']
+
+
+@pytest.mark.parametrize('item', [
+    {'id': 1, 'path': '/api/chat/messages', 'params': [1, 2]},
+    {'id': 1, 'path': '/api/chat/messages', 'params': 5},
+    {'id': 1, 'path': 5},
+    {'id': 1, 'path': ['/api/chat/messages']},
+    {'id': 1, 'path': '/api/chat/messages', 'method': ['GET']},
+    {'id': 1, 'path': '/api/chat/messages', 'method': None},
+])
+def test_malformed_item_is_a_400_of_its_own(client, item):
+    bad, good = batch(client, item, {'id': 2, 'path': '/api/health'})
+    assert bad['id'] == 1
+    assert bad['status'] == 400
+    assert 'error' in bad['body']
+    assert (good['id'], good['status']) == (2, 200)
+
+
+@pytest.mark.parametrize('path', ['/api/batch', '/api/chat/stream', '/api/rooms/general/stream', '/health',
+                                  'http://example.com/api/health'])
+def test_excluded_paths(client, path):
+    [result] = batch(client, {'id': 'x', 'path': path})
+    assert result['status'] == 400
+
+
+def test_query_string_params(client):
+    for i in range(3):
+        client.post('/api/chat/messages', json={'content': f'm{i}'})
+    [as_dict, as_string] = batch(
+        client,
+        {'id': 'a', 'path': '/api/chat/messages', 'params': {'limit': 2}},
+        {'id': 'b', 'path': '/api/chat/messages', 'params': 'limit=1'},
+    )
+    assert [m['content'] for m in as_dict['body']] == ['m1', 'm2']
+    assert [m['content'] for m in as_string['body']] == ['m2']
+
+
+def test_not_an_object_and_bad_envelopes(client):
+    [result] = batch(client, 'GET /api/health')
+    assert result['status'] == 400
+    assert client.post('/api/batch', json={'requests': []}).status_code == 400
+    assert client.post('/api/batch', json={'requests': {'id': 1}}).status_code == 400
+    too_many = [{'path': '/api/health'}] * (server.BATCH_MAX_REQUESTS + 1)
+    assert client.post('/api/batch', json={'requests': too_many}).status_code == 400
@@ -0,0 +1,102 @@
+"""
+Tests of the chat analytics (chatstats): aggregates that follow a room's
+log, survive a restart and a compaction, and a catch-up thread that keeps
+going.
+
+    python -m pytest -q
+"""
+
+import time
+
+from chatstats import ChatStats, RoomStats
+from rooms import GENERAL, RoomRegistry
+from storage import MessageStore
+
+
+def message(i, username='anna', timestamp=None):
+    return {'id': f'm{i}', 'username': username, 'avatar': username[:1].upper(), 'content': f'text {i}',
+            'timestamp': timestamp or f'2025-01-0{1 + i % 3}T1{i % 3}:00:00'}
+
+
+def fill(store):
+    for i in range(6):
+        store.append(message(i, 'anna' if i < 4 else 'ivan'))
+    store.delete('m0')
+
+
+def test_aggregates_follow_sends_and_deletes(tmp_path):
+    store = MessageStore(tmp_path / 'log')
+    stats = RoomStats('general', store, tmp_path / 'general.json')
+    fill(stats.store)
+    stats.follow()
+
+    summary = stats.summary()
+    assert (summary['messages'], summary['users']) == (5, 2)
+    assert summary['top_posters'] == [{'username': 'anna', 'messages': 3}, {'username': 'ivan', 'messages': 2}]
+    assert summary['by_day'] == {'2025-01-01': 1, '2025-01-02': 2, '2025-01-03': 2}
+    assert summary['by_hour'][10:13] == [1, 2, 2]
+
+    store.delete_by_author('ivan')
+    stats.follow()
+    assert stats.top_posters(1) == [{'username': 'anna', 'messages': 3}]
+    assert stats.user_messages('ivan') == 0
+
+
+def test_malformed_records_are_skipped(tmp_path):
+    store = MessageStore(tmp_path / 'log')
+    stats = RoomStats('general', store, tmp_path / 'general.json')
+    store.append(message(1, timestamp='2025-01-01T99:00:00'))
+    store.append({**message(2), 'username': ['anna'], 'timestamp': 5})
+    store.append({**message(3), 'timestamp': None})
+    stats.follow()
+
+    assert stats.messages == 2
+    assert sum(stats.by_hour) == 0
+    assert stats.summary()['by_day'] == {'2025-01-01': 1}
+
+
+def test_restart_and_compaction_keep_the_counts(tmp_path):
+    store = MessageStore(tmp_path / 'log')
+    fill(store)
+    stats = RoomStats('general', store, tmp_path / 'general.json')
+    stats.follow()
+    stats.save()
+    expected = stats.summary()
+
+    # A restart picks up the saved file and only reads what came after it
+    store.append(message(7, 'boris'))
+    restarted = RoomStats('general', MessageStore(tmp_path / 'log'), tmp_path / 'general.json')
+    restarted.follow()
+    assert restarted.messages == 6
+    assert restarted.user_messages('boris') == 1
+
+    # A compaction moves the log under it: recounted from the live messages
+    store.delete('m7')
+    store.compact()
+    restarted.follow()
+    assert restarted.summary() == expected
+
+
+def test_catch_up_thread_survives_errors(tmp_path):
+    registry = RoomRegistry(tmp_path / 'rooms', tmp_path / 'messages')
+    chat_stats = ChatStats(registry, tmp_path / 'stats', interval=0.01, persist_interval=0.01)
+    general = chat_stats.room(GENERAL)
+    read_since = general.store.read_since
+    failures = []
+
+    def flaky(position):
+        if len(failures) < 3:
+            failures.append(1)
+            raise RuntimeError('bad batch')
+        return read_since(position)
+
+    general.store.read_since = flaky
+    registry.general.store.append(message(1))
+    deadline = time.monotonic() + 5
+    while (general.messages, chat_stats.stats()['error']) != (1, None) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    chat_stats.close()
+
+    assert len(failures) == 3
+    assert general.messages == 1
+    assert (tmp_path / 'stats' / 'general.json').exists()
@@ -0,0 +1,109 @@
+"""
+Tests of the cross-worker event bus (pubsub.EventBus): two buses over one
+database stand in for two workers, as do two presence registries on them.
+
+    python -m pytest -q
+"""
+
+import time
+
+import pytest
+
+from pubsub import EventBus
+from presence import PresenceRegistry
+
+
+class Sink:
+    """A hub that records what it is handed"""
+
+    def __init__(self, fail=False):
+        self.events = []
+        self.fail = fail
+
+    def start_at(self, event_id):
+        pass
+
+    def deliver(self, events):
+        if self.fail:
+            raise RuntimeError('broken hub')
+        self.events.extend(events)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def buses(tmp_path):
+    buses = [EventBus(tmp_path / 'events.sqlite3', poll_interval=0.01) for _ in range(2)]
+    yield buses
+    for bus in buses:
+        bus.close()
+
+
+def test_events_reach_every_worker_with_the_same_ids(buses):
+    first, second = buses
+    sinks = [Sink(), Sink()]
+    for bus, sink in zip(buses, sinks):
+        bus.attach('general', sink)
+        bus.ensure_relay()
+
+    ids = [first.publish('general', 'message', {'n': 1}), second.publish('general', 'message', {'n': 2})]
+    for sink in sinks:
+        wait_for(lambda: len(sink.events) == 2)
+        assert [(e.id, e.data['n']) for e in sink.events] == list(zip(ids, [1, 2]))
+    assert [e.id for e in second.read_after('general', 0, ids[1])] == ids
+    assert second.read_after('dev', 0, ids[1]) == []
+
+
+def test_bad_rows_and_hubs_do_not_stop_the_relay(buses):
+    first, second = buses
+    good, broken = Sink(), Sink(fail=True)
+    second.attach('general', good)
+    second.attach('dev', broken)
+    second.ensure_relay()
+
+    first.publish('dev', 'message', {})
+    first._connection().execute(
+        "INSERT INTO events (channel, type, data, created) VALUES ('general', 'message', 'not json', ?)",
+        (time.time(),))
+    last = first.publish('general', 'message', {'n': 3})
+
+    wait_for(lambda: good.events)
+    assert [e.id for e in good.events] == [last]
+    wait_for(lambda: second.head() == last)
+    assert second.stats()['errors'] == 2
+
+
+def test_pruned_events_cannot_be_replayed(tmp_path):
+    bus = EventBus(tmp_path / 'events.sqlite3', max_events=2)
+    ids = [bus.publish('general', 'message', {'n': n}) for n in range(5)]
+    bus.prune()  # (the relay may already have)
+    assert bus.read_after('general', 0, ids[-1]) is None
+    assert [e.data['n'] for e in bus.read_after('general', ids[2], ids[-1])] == [3, 4]
+    bus.close()
+
+
+def test_presence_is_shared_between_workers(buses):
+    first, second = (PresenceRegistry(bus=bus, share_interval=0.05) for bus in buses)
+    second.counts()  # the second worker is already following the bus
+
+    client = first.connect('anna', device_info='Firefox')
+    wait_for(lambda: second.get(client.client_id) is not None)
+    assert second.heartbeat([client.client_id]) == []
+    assert second.online_users() == [{'username': 'anna', 'avatar': 'A', 'clients': 1}]
+
+    # A worker started later learns about the client from its heartbeats
+    late = PresenceRegistry(bus=EventBus(buses[0].path, poll_interval=0.01), share_interval=0.05)
+    late.counts()
+    first.heartbeat([client.client_id])
+    wait_for(lambda: late.counts() == (1, 1))
+
+    assert second.disconnect(client.client_id) is True
+    wait_for(lambda: first.counts() == (0, 0) and late.counts() == (0, 0))
+    for registry in (first, second, late):
+        registry.close()
+    late.bus.close()
@@ -0,0 +1,76 @@
+"""
+Tests of the token-bucket rate limits (ratelimit) on a fake clock, and of
+the 429 responses of an app over a temporary data directory.
+
+    python -m pytest -q
+"""
+
+import server
+from ratelimit import RouteRateLimiter, TokenBucketLimiter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_bucket_refills_at_the_rate():
+    clock = Clock()
+    limiter = TokenBucketLimiter(per_minute=60, burst=3, clock=clock)
+
+    assert [limiter.hit('anna')[0] for _ in range(4)] == [True, True, True, False]
+    allowed, remaining, retry_after = limiter.hit('anna')
+    assert (allowed, remaining, retry_after) == (False, 0, 1.0)
+    assert limiter.hit('ivan') == (True, 2, 0.0)  # one bucket per key
+
+    clock.now += 1
+    assert limiter.hit('anna') == (True, 0, 0.0)
+    clock.now += 100
+    assert limiter.hit('anna') == (True, 2, 0.0)  # never more than burst
+
+
+def test_idle_buckets_are_swept():
+    clock = Clock()
+    limiter = TokenBucketLimiter(per_minute=60, burst=2, clock=clock, sweep_interval=1)
+    for key in range(10):
+        limiter.hit(key)
+    assert len(limiter) == 10
+
+    clock.now += 5
+    limiter.hit('new')
+    assert len(limiter) == 1
+
+
+def test_refusal_by_one_scope_keeps_the_others_quota():
+    clock = Clock()
+    limits = RouteRateLimiter({'send': {'user': {'per_minute': 60, 'burst': 1},
+                                        'ip': {'per_minute': 60, 'burst': 2}}}, clock=clock)
+
+    first = limits.check('send', 'anna', '10.0.0.1')
+    assert first.allowed and first.limit == 1 and first.remaining == 0
+    refused = limits.check('send', 'anna', '10.0.0.1')
+    assert not refused.allowed
+    assert refused.headers()['Retry-After'] == '1'
+    # anna's refusal didn't take the IP's second token
+    assert limits.check('send', 'ivan', '10.0.0.1').allowed
+    assert not limits.check('send', 'boris', '10.0.0.1').allowed
+    assert limits.check('other', 'anna', '10.0.0.1') is None
+
+
+def test_app_answers_429_with_headers(tmp_path):
+    app = server.create_app({
+        'data': {'data_dir': str(tmp_path), 'auto_backup': False},
+        'rate_limits': {'routes': {'send_message': {'user': {'per_minute': 1, 'burst': 2}}}},
+    })
+    client = app.test_client()
+    assert client.post('/api/auth/register', json={
+        'username': 'anna', 'email': 'anna@example.com', 'password': 'secret1'}).status_code == 201
+
+    statuses = [client.post('/api/chat/messages', json={'content': f'm{i}'}) for i in range(3)]
+    assert [r.status_code for r in statuses] == [201, 201, 429]
+    assert statuses[0].headers['RateLimit-Limit'] == '2'
+    assert statuses[1].headers['RateLimit-Remaining'] == '0'
+    assert int(statuses[2].headers['Retry-After']) >= 1
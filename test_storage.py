@@ -0,0 +1,224 @@
+"""
+Tests of the message log (storage.MessageStore): appends, tombstones,
+compaction, and two stores over one directory standing in for two workers.
+
+    python -m pytest -q
+"""
+
+import json
+import threading
+
+from chatstats import RoomStats
+from storage import MessageStore, encode_tombstone
+
+
+def message(i, username='anna'):
+    return {'id': f'm{i}', 'username': username, 'avatar': username[:1].upper(),
+            'content': f'text {i}', 'timestamp': f'2025-01-0{1 + i % 5}T1{i % 10}:00:00'}
+
+
+def ids(lines):
+    return [json.loads(line)['id'] for line in lines]
+
+
+def test_append_and_read_back(tmp_path):
+    store = MessageStore(tmp_path)
+    for i in range(5):
+        store.append(message(i))
+
+    assert store.count() == 5
+    assert store.get('m3')['content'] == 'text 3'
+    assert ids(store.recent_lines(2)) == ['m3', 'm4']
+    # Another worker sees the same log
+    assert ids(MessageStore(tmp_path).iter_raw()) == ['m0', 'm1', 'm2', 'm3', 'm4']
+
+
+def test_recent_limit_none_is_every_message(tmp_path):
+    store = MessageStore(tmp_path, recent_size=2)
+    for i in range(5):
+        store.append(message(i))
+    store.delete('m1')
+
+    assert ids(store.recent_lines(None)) == ['m0', 'm2', 'm3', 'm4']
+    assert store.recent_json(0) == b'[]'
+
+
+def test_delete_writes_one_tombstone(tmp_path):
+    store = MessageStore(tmp_path)
+    store.append(message(1))
+    start = store.end_position()
+
+    assert store.delete('m1') is True
+    assert store.delete('m1') is False
+    assert store.delete('missing') is False
+    assert store.get('m1') is None
+
+    records, _ = store.read_since(start)
+    assert records == [('deleted', {'deleted': 'm1', 'at': records[0][1]['at'],
+                                    'username': 'anna', 'timestamp': message(1)['timestamp']})]
+
+
+def test_concurrent_deletes_tombstone_once(tmp_path):
+    MessageStore(tmp_path).append(message(1))
+    start = MessageStore(tmp_path).end_position()
+    workers = [MessageStore(tmp_path) for _ in range(8)]
+    for store in workers:
+        store.count()  # each has indexed m1 as live
+    barrier = threading.Barrier(len(workers))
+    results = []
+
+    def delete(store):
+        barrier.wait()
+        results.append(store.delete('m1'))
+
+    threads = [threading.Thread(target=delete, args=(store,)) for store in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(results) == [False] * 7 + [True]
+    records, _ = MessageStore(tmp_path).read_since(start)
+    assert [kind for kind, _ in records] == ['deleted']
+
+
+def test_delete_by_author_from_two_workers(tmp_path):
+    first, second = MessageStore(tmp_path), MessageStore(tmp_path)
+    for i in range(6):
+        first.append(message(i, 'anna' if i % 2 else 'ivan'))
+    start = first.end_position()
+    second.count()
+
+    assert first.delete_by_author('anna') == 3
+    assert second.delete_by_author('anna') == 0
+    assert ids(second.iter_raw()) == ['m0', 'm2', 'm4']
+    records, _ = second.read_since(start)
+    assert sorted(record['deleted'] for _, record in records) == ['m1', 'm3', 'm5']
+
+
+def test_compaction_keeps_live_messages(tmp_path):
+    store = MessageStore(tmp_path, segment_bytes=512)
+    for i in range(20):
+        store.append(message(i))
+    for i in range(0, 20, 2):
+        store.delete(f'm{i}')
+    other = MessageStore(tmp_path)
+    other.count()
+
+    report = store.compact()
+
+    assert report['messages'] == 10
+    assert report['after']['bytes'] < report['before']['bytes']
+    assert report['after']['records'] == 10  # the tombstones are gone
+    expected = [f'm{i}' for i in range(1, 20, 2)]
+    assert ids(store.iter_raw()) == expected
+    # The other worker re-indexes the rewritten log and can go on writing
+    assert ids(other.iter_raw()) == expected
+    other.append(message(20))
+    assert store.get('m20') is not None
+    assert store.delete('m1') is True
+
+
+def test_read_since_after_compaction_jumps_to_the_end(tmp_path):
+    store = MessageStore(tmp_path)
+    for i in range(4):
+        store.append(message(i))
+    store.delete('m0')
+    position = store.end_position()
+    store.compact()
+
+    records, new_position = store.read_since(position)
+    assert records == []
+    assert new_position == store.end_position()
+
+
+def test_stats_ignore_repeated_tombstones(tmp_path):
+    store = MessageStore(tmp_path / 'log')
+    store.append(message(1))
+    store.append(message(2))
+    stats = RoomStats('general', store, tmp_path / 'general.json')
+    stats.follow()
+    assert stats.messages == 2
+
+    # As a writer without the liveness check under the lock could leave them
+    store._append_lines([encode_tombstone('m1', message(1))] * 3)
+    stats.follow()
+
+    assert stats.messages == 1
+    assert stats.user_messages('anna') == 1
+    assert min(stats.by_hour) == 0
+    assert stats.summary(days=0)['by_day'] == {'2025-01-03': 1}
+
+
+def test_stats_ignore_a_tombstone_repeated_in_a_later_batch(tmp_path):
+    store = MessageStore(tmp_path / 'log')
+    store.append(message(1))
+    store.append(message(2))
+    stats = RoomStats('general', store, tmp_path / 'general.json')
+    stats.follow()
+    store._append_lines([encode_tombstone('m1', message(1))])
+    stats.follow()
+    stats.save()
+
+    store._append_lines([encode_tombstone('m1', message(1))])
+    stats.follow()
+    assert stats.messages == 1
+    # Also after a restart from the saved aggregates
+    store._append_lines([encode_tombstone('m1', message(1))])
+    restarted = RoomStats('general', store, tmp_path / 'general.json')
+    restarted.follow()
+    assert restarted.messages == 1
+    assert restarted.user_messages('anna') == 1
+
+
+def test_by_author_pages_past_a_deleted_cursor(tmp_path):
+    store = MessageStore(tmp_path)
+    for i in range(10):
+        store.append(message(i, 'anna' if i % 2 else 'ivan'))
+
+    lines, cursor, total = store.by_author('anna', limit=2)
+    assert (ids(lines), cursor, total) == (['m7', 'm9'], 'm7', 5)
+
+    # The cursor's message is deleted between two pages, here and by another worker
+    other = MessageStore(tmp_path)
+    store.delete('m7')
+    lines, cursor, _ = store.by_author('anna', limit=2, before='m7')
+    assert (ids(lines), cursor) == (['m3', 'm5'], 'm3')
+    assert ids(other.by_author('anna', limit=2, before='m7')[0]) == ['m3', 'm5']
+    assert ids(MessageStore(tmp_path).by_author('anna', limit=2, before='m7')[0]) == ['m3', 'm5']
+
+    store.delete('m3')
+    store.delete('m1')
+    lines, cursor, total = store.by_author('anna', limit=2, before='m3')
+    assert (ids(lines), cursor, total) == ([], None, 2)
+    assert ids(store.by_author('anna', before='m9')[0]) == ['m5']
+
+
+def test_compaction_to_nothing_keeps_segment_numbering(tmp_path):
+    store = MessageStore(tmp_path)
+    for i in range(3):
+        store.append(message(i))
+    other = MessageStore(tmp_path)
+    assert other.count() == 3
+    for i in range(3):
+        store.delete(f'm{i}')
+
+    store.compact()
+    assert store.count() == 0
+    # The next append must not reuse segment 1: the other worker would take
+    # it for the log it already indexed and miss the new message
+    store.append(message(5))
+    assert ids(other.recent_lines(10)) == ['m5']
+    assert other.count() == 1
+
+
+def test_clear_keeps_segment_numbering(tmp_path):
+    store = MessageStore(tmp_path)
+    store.append(message(1))
+    other = MessageStore(tmp_path)
+    assert other.count() == 1
+
+    store.clear()
+    store.append(message(2))
+    assert ids(other.recent_lines(10)) == ['m2']
+    assert other.get('m1') is None
@@ -0,0 +1,80 @@
+"""
+Tests of the AI proxy's context budget (summarizer.ContextBudget) with the
+summarizer call replaced, driven by hand instead of its background thread.
+
+    python -m pytest -q
+"""
+
+import pytest
+
+from summarizer import SUMMARY_PREFIX, ContextBudget
+
+
+def turn(i):
+    return {'role': 'user' if i % 2 == 0 else 'assistant', 'content': f'turn {i:03d} ' + 'x' * 20}
+
+
+def request(first, last, chat_id='c1'):
+    """What script.js sends: a window of the chat's latest turns"""
+    return {'model': 'llama3', 'chat_id': chat_id, 'messages': [turn(i) for i in range(first, last)]}
+
+
+@pytest.fixture
+def budget():
+    budget = ContextBudget(pool=None, max_tokens=200, keep_recent=4)
+    budget.prompts = []
+
+    def complete(body):
+        budget.prompts.append(body['messages'][1]['content'])
+        return f'summary {len(budget.prompts)}', {'prompt_eval_count': 10, 'eval_count': 5}
+
+    budget._complete = complete
+    budget._ensure_worker = lambda: None
+    return budget
+
+
+def run_summarizer(budget):
+    while budget._pending:
+        key, (model, base, turns) = budget._pending.popitem(last=False)
+        budget._summarize(key, model, base, turns)
+
+
+def test_under_budget_is_forwarded_as_is(budget):
+    data = request(0, 6)
+    assert budget.apply(data, 'anna') is data
+    assert 'chat_id' not in data
+    assert budget.stats()['trimmed'] == 0
+
+
+def test_summary_follows_a_sliding_window(budget):
+    first = budget.apply(request(0, 40), 'anna')
+    assert first['messages'][0] == turn(26)  # no summary yet: the oldest turns are dropped
+    run_summarizer(budget)
+
+    # The chat grew and the window slid: the summary still applies
+    slid = budget.apply(request(2, 42), 'anna')['messages']
+    assert slid[0] == {'role': 'system', 'content': SUMMARY_PREFIX + 'summary 1'}
+    assert slid[1:] == [turn(i) for i in range(36, 42)]
+    assert not budget._pending
+
+    # Far enough that turns would be lost: rolled forward over the new ones only
+    far = budget.apply(request(20, 60), 'anna')['messages']
+    assert far[0]['content'] == SUMMARY_PREFIX + 'summary 1'
+    run_summarizer(budget)
+    assert 'summary 1' in budget.prompts[1]
+    assert 'turn 035' not in budget.prompts[1] and 'turn 036' in budget.prompts[1]
+    assert budget.apply(request(22, 62), 'anna')['messages'][0]['content'] == SUMMARY_PREFIX + 'summary 2'
+
+    stats = budget.stats()
+    assert (stats['summaries'], stats['cached'], stats['failures']) == (2, 1, 0)
+
+
+def test_summary_does_not_apply_to_other_turns(budget):
+    budget.apply(request(0, 40), 'anna')
+    run_summarizer(budget)
+
+    assert budget.apply(request(0, 40, chat_id='c2'), 'anna')['messages'][0] == turn(26)
+    assert budget.apply(request(0, 40), 'ivan')['messages'][0] == turn(26)
+    edited = request(2, 42)
+    edited['messages'][33] = {'role': 'assistant', 'content': 'edited'}
+    assert budget.apply(edited, 'anna')['messages'][0]['role'] != 'system'
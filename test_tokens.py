@@ -0,0 +1,94 @@
+"""
+Tests of the token store (tokens.TokenStore): issue, expiry, revocation
+seen by another worker, and the cleanup thread.
+
+    python -m pytest -q
+"""
+
+import time
+
+from tokens import TokenStore
+
+
+class Clock:
+    def __init__(self, now=1_700_000_000):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def store(tmp_path, **options):
+    options.setdefault('cleanup_interval', 0)
+    return TokenStore(tmp_path / 'tokens.jsonl', **options)
+
+
+def test_issue_and_lookup_from_another_worker(tmp_path):
+    first, second = store(tmp_path), store(tmp_path)
+    token = first.issue('anna', device='Firefox')
+
+    assert first.lookup(token) == 'anna'
+    assert second.lookup(token) == 'anna'
+    assert [record.device for _, record in second.tokens_for('anna')] == ['Firefox']
+    assert second.lookup('missing') is None
+
+
+def test_revoke_is_seen_by_another_worker(tmp_path):
+    first, second = store(tmp_path), store(tmp_path)
+    kept, dropped, other = first.issue('anna'), first.issue('anna'), first.issue('ivan')
+    assert second.count() == 3
+
+    assert second.revoke_user('anna', keep=kept) == 1
+    assert first.lookup(dropped) is None
+    assert first.lookup(kept) == 'anna'
+    assert first.revoke(other) is True
+    assert second.revoke(other) is False
+    assert second.count() == 1
+
+
+def test_tokens_expire_after_ttl_since_last_use(tmp_path):
+    clock = Clock()
+    tokens = store(tmp_path, ttl=100, touch_interval=10, clock=clock)
+    token = tokens.issue('anna')
+
+    clock.now += 90
+    assert tokens.lookup(token) == 'anna'  # used: expiry moves on
+    clock.now += 90
+    assert tokens.lookup(token) == 'anna'
+    clock.now += 101
+    assert tokens.lookup(token) is None
+    clock.now += 10
+    assert tokens.purge_expired() == 1
+    assert tokens.count() == 0
+
+
+def test_malformed_lines_are_skipped(tmp_path):
+    tokens = store(tmp_path)
+    token = tokens.issue('anna')
+    with open(tmp_path / 'tokens.jsonl', 'ab') as f:
+        f.write(b'not json\n[1, 2]\n{"t": "x"}\n')
+
+    reader = store(tmp_path)
+    assert reader.lookup(token) == 'anna'
+    assert reader.count() == 1
+
+
+def test_cleanup_thread_survives_errors(tmp_path):
+    tokens = store(tmp_path, cleanup_interval=0.01)
+    calls = []
+
+    def purge_expired():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError('boom')
+        return 0
+
+    tokens.purge_expired = purge_expired
+    tokens.count()  # starts the thread
+    deadline = time.monotonic() + 5
+    while len(calls) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    tokens.close()
+
+    assert len(calls) >= 3
+    assert tokens.last_error is None
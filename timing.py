@@ -0,0 +1,88 @@
+"""
+Request ids and per-phase timings (Server-Timing)
+
+Every request gets an id: the caller's X-Request-ID if it looks sane, a
+fresh one otherwise. It is echoed back in X-Request-ID and goes into every
+log record of the request, so a slow answer a user reports can be found.
+
+A Timings object collects named phases in milliseconds and renders them as
+a Server-Timing header, which browsers show in the network panel:
+
+    Server-Timing: queue;dur=0.4, connect;dur=812.0, prompt_eval;dur=95.3, ...
+
+Finished requests are logged as one JSON object per line on the "alit"
+logger: into the access log if it is enabled (accesslog.py), else stderr,
+unless the host configures that logger itself.
+"""
+
+import json
+import logging
+import re
+import sys
+import time
+import uuid
+
+REQUEST_ID_RE = re.compile(r'^[A-Za-z0-9._:-]{1,64}$')
+NS_PER_MS = 1_000_000
+
+logger = logging.getLogger('alit')
+
+
+def request_id(incoming=None):
+    """The caller's id if usable, else a new one"""
+    if incoming and REQUEST_ID_RE.match(incoming):
+        return incoming
+    return uuid.uuid4().hex
+
+
+def setup_logging(handler=None):
+    """JSON lines to `handler` (default stderr), unless the host set up "alit" itself"""
+    for previous in list(logger.handlers):
+        if getattr(previous, 'alit_default', False):
+            logger.removeHandler(previous)  # ours, from an earlier app in this process
+    if logger.handlers:
+        return
+    handler = handler or logging.StreamHandler(sys.stderr)
+    handler.alit_default = True
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+def log_event(event, **fields):
+    logger.info(json.dumps({'ts': round(time.time(), 3), 'event': event, **fields},
+                           ensure_ascii=False, separators=(',', ':'), default=str))
+
+
+class Timings:
+    """Phases of one request in milliseconds, in the order they were recorded"""
+
+    __slots__ = ('started', 'last', 'phases')
+
+    def __init__(self, started=None):
+        self.started = started if started is not None else time.perf_counter()
+        self.last = self.started
+        self.phases = {}
+
+    def mark(self, name):
+        """Record the time since the previous mark as phase `name`"""
+        now = time.perf_counter()
+        self.phases[name] = (now - self.last) * 1000
+        self.last = now
+        return now
+
+    def since_start(self, name):
+        """Record the time since the request started as phase `name`"""
+        self.phases[name] = (time.perf_counter() - self.started) * 1000
+
+    def add_ns(self, name, nanoseconds):
+        """A duration reported by someone else (Ollama reports nanoseconds)"""
+        if isinstance(nanoseconds, (int, float)) and nanoseconds >= 0:
+            self.phases[name] = nanoseconds / NS_PER_MS
+
+    def header(self):
+        return ', '.join(f'{name};dur={ms:.1f}' for name, ms in self.phases.items())
+
+    def to_dict(self):
+        return {name: round(ms, 1) for name, ms in self.phases.items()}
@@ -0,0 +1,325 @@
+"""
+Auth tokens, stored apart from users.json in data/tokens.jsonl
+
+One compact line per change, later lines for a token replace earlier ones:
+
+    {"t":"<token>","u":"john","c":1732300000,"s":1732300000,"d":"Firefox"}   issued / last seen
+    {"t":"<token>","x":1}                                                     revoked
+
+Every token is kept in memory (token -> record, username -> tokens), so a
+lookup is a dict hit and login/logout append one line without touching
+user records. A user can hold any number of tokens, one per device.
+
+Tokens expire `ttl` seconds after they were last used. Last-seen times are
+updated in memory on every lookup but written at most once per
+`touch_interval` per token. A background thread drops expired tokens and
+rewrites the file once most of its lines are dead. Other processes
+(gunicorn workers, manage_server.py) share the file: each call first
+reads whatever they appended, a rewrite is noticed by its new inode, and
+writers serialize through the same lock file.
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from storage import FileLock, write_json_atomic
+from timing import log_event
+
+DEFAULT_TTL = 7 * 24 * 60 * 60
+DEFAULT_TOUCH_INTERVAL = 60 * 60
+DEFAULT_CLEANUP_INTERVAL = 10 * 60
+COMPACT_MIN_LINES = 1000
+MAX_DEVICE_LENGTH = 200
+
+
+def _encode(record):
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+class TokenRecord:
+    __slots__ = ('username', 'created', 'last_seen', 'persisted_seen', 'device')
+
+    def __init__(self, username, created, last_seen, device=None):
+        self.username = username
+        self.created = created
+        self.last_seen = last_seen
+        self.persisted_seen = last_seen
+        self.device = device
+
+    def to_line(self, token):
+        record = {'t': token, 'u': self.username, 'c': self.created, 's': self.last_seen}
+        if self.device:
+            record['d'] = self.device
+        return _encode(record)
+
+
+class TokenStore:
+    def __init__(self, path, ttl=DEFAULT_TTL, touch_interval=DEFAULT_TOUCH_INTERVAL,
+                 cleanup_interval=DEFAULT_CLEANUP_INTERVAL, legacy_users_file=None,
+                 users_lock=None, clock=time.time):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.touch_interval = touch_interval
+        self.cleanup_interval = cleanup_interval
+        self.legacy_users_file = Path(legacy_users_file) if legacy_users_file else None
+        self.users_lock = users_lock
+        self.clock = clock
+
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(self.path.with_name(self.path.name + '.lock'))
+        self._opened = False
+        self._cleanup_pid = None
+        self._stop = threading.Event()
+        self.last_error = None
+        self._reset()
+
+    def _reset(self):
+        self._tokens = {}      # token -> TokenRecord
+        self._by_user = {}     # username -> set of tokens
+        self._inode = None
+        self._offset = 0       # bytes of the file applied so far
+        self._lines = 0        # lines in the file (live + dead)
+
+    # ----- file -----
+
+    def _open(self):
+        """First use: migrate tokens out of users.json if there is no token file yet"""
+        if self._opened:
+            return
+        if self.legacy_users_file is None:
+            self._opened = True
+            return
+        # users.json lock before ours, the same order register/login use
+        users_lock = self.users_lock or FileLock(self.legacy_users_file.with_name(self.legacy_users_file.name + '.lock'))
+        with users_lock, self._lock:
+            if not self._opened:
+                if not self.path.exists():
+                    self._migrate_legacy()
+                self._opened = True
+
+    def _ensure(self):
+        self._refresh()
+        if self._cleanup_pid != os.getpid() and self.cleanup_interval:
+            # Threads don't survive fork: every process starts its own
+            self._cleanup_pid = os.getpid()
+            threading.Thread(target=self._cleanup_loop, name='token-cleanup', daemon=True).start()
+
+    def _refresh(self):
+        """Apply whatever this or another process wrote since the last call"""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            if self._inode is not None:
+                self._reset()
+            return
+        if st.st_ino != self._inode or st.st_size < self._offset:
+            self._reset()  # rewritten (compacted or cleared) elsewhere
+            self._inode = st.st_ino
+        if st.st_size == self._offset:
+            return
+
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read(st.st_size - self._offset)
+        end = data.rfind(b'\n') + 1  # a torn last line isn't ours to read yet
+        for line in data[:end].splitlines():
+            if line:
+                try:
+                    self._apply(json.loads(line))
+                except (ValueError, TypeError, KeyError, AttributeError):
+                    pass  # a malformed line is skipped, not a reason to fail every request
+                self._lines += 1
+        self._offset += end
+
+    def _apply(self, record):
+        token = record.get('t')
+        if not token:
+            return
+        if record.get('x'):
+            self._drop(token)
+            return
+        current = self._tokens.get(token)
+        if current is not None:
+            current.last_seen = max(current.last_seen, record['s'])
+            current.persisted_seen = max(current.persisted_seen, record['s'])
+            return
+        self._tokens[token] = TokenRecord(record['u'], record['c'], record['s'], record.get('d'))
+        self._by_user.setdefault(record['u'], set()).add(token)
+
+    def _drop(self, token):
+        record = self._tokens.pop(token, None)
+        if record is not None:
+            tokens = self._by_user.get(record.username)
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    del self._by_user[record.username]
+
+    def _append(self, lines):
+        data = b''.join(lines)
+        with self._lock, self._file_lock:
+            self._refresh()
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                st = os.fstat(fd)
+                if self._inode is None:
+                    self._inode = st.st_ino  # we just created it
+                # A torn line left by a crashed writer would glue onto ours - cut it off
+                if st.st_size > self._offset:
+                    os.ftruncate(fd, self._offset)
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+            self._offset += len(data)
+            self._lines += len(lines)
+
+    def _migrate_legacy(self):
+        """One-time move of the old per-user "token" field out of users.json"""
+        if not self.legacy_users_file.exists():
+            return
+        try:
+            users = json.loads(self.legacy_users_file.read_text(encoding='utf-8') or '{}')
+        except ValueError:
+            return
+        now = int(self.clock())
+        lines = []
+        for username, info in users.items():
+            token = info.pop('token', None)
+            if token:
+                lines.append(TokenRecord(username, now, now).to_line(token))
+        if lines:
+            self._append(lines)
+            self._reset()  # read them back like any other process would
+            write_json_atomic(self.legacy_users_file, users)
+
+    # ----- tokens -----
+
+    def issue(self, username, device=None):
+        """New token for `username` (existing tokens stay valid)"""
+        token = str(uuid.uuid4())
+        now = int(self.clock())
+        record = TokenRecord(username, now, now, (device or '')[:MAX_DEVICE_LENGTH] or None)
+        self._open()
+        with self._lock:
+            self._ensure()
+            self._append([record.to_line(token)])
+            self._tokens[token] = record
+            self._by_user.setdefault(username, set()).add(token)
+        return token
+
+    def lookup(self, token):
+        """Username for a valid token, or None; counts as a use of the token"""
+        now = self.clock()
+        self._open()
+        with self._lock:
+            self._ensure()
+            record = self._tokens.get(token)
+            if record is None or now - record.last_seen > self.ttl:
+                return None
+            record.last_seen = now
+            if now - record.persisted_seen >= self.touch_interval:
+                self._touch(token, record)
+            return record.username
+
+    def _touch(self, token, record):
+        with self._file_lock:
+            self._refresh()
+            # Revoked by another process since our lookup: don't bring it back
+            if self._tokens.get(token) is record:
+                record.last_seen = int(record.last_seen)
+                self._append([record.to_line(token)])
+                record.persisted_seen = record.last_seen
+
+    def revoke(self, token):
+        """Invalidate one token; return False if it wasn't valid"""
+        self._open()
+        with self._lock:
+            self._ensure()
+            if token not in self._tokens:
+                return False
+            self._append([_encode({'t': token, 'x': 1})])
+            self._drop(token)
+            return True
+
+    def revoke_user(self, username, keep=None):
+        """Invalidate every token of a user (except `keep`); return how many"""
+        self._open()
+        with self._lock:
+            self._ensure()
+            tokens = [t for t in self._by_user.get(username, ()) if t != keep]
+            if tokens:
+                self._append([_encode({'t': t, 'x': 1}) for t in tokens])
+                for token in tokens:
+                    self._drop(token)
+            return len(tokens)
+
+    def tokens_for(self, username):
+        """The user's valid tokens as (token, record), most recently used first"""
+        now = self.clock()
+        self._open()
+        with self._lock:
+            self._ensure()
+            found = [(t, self._tokens[t]) for t in self._by_user.get(username, ())
+                     if now - self._tokens[t].last_seen <= self.ttl]
+        found.sort(key=lambda item: item[1].last_seen, reverse=True)
+        return found
+
+    def count(self):
+        self._open()
+        with self._lock:
+            self._ensure()
+            return len(self._tokens)
+
+    # ----- cleanup -----
+
+    def purge_expired(self):
+        """Forget expired tokens; rewrite the file when most of it is dead"""
+        now = self.clock()
+        # Another process may have seen a token up to touch_interval later than
+        # the file says, so only tokens expired by that margin are dropped
+        horizon = self.ttl + self.touch_interval
+        self._open()
+        with self._lock:
+            self._ensure()
+            expired = [t for t, r in self._tokens.items() if now - r.last_seen > horizon]
+            for token in expired:
+                self._drop(token)
+            if self._lines >= COMPACT_MIN_LINES and self._lines > 2 * len(self._tokens):
+                self._compact()
+            return len(expired)
+
+    def _compact(self):
+        with self._file_lock:
+            self._refresh()
+            lines = [record.to_line(token) for token, record in self._tokens.items()]
+            tmp_path = self.path.with_name(f'{self.path.name}.{os.getpid()}.tmp')
+            with open(tmp_path, 'wb') as f:
+                f.write(b''.join(lines))
+            os.replace(tmp_path, self.path)
+            st = os.stat(self.path)
+            self._inode = st.st_ino
+            self._offset = st.st_size
+            self._lines = len(lines)
+
+    def _cleanup_loop(self):
+        while not self._stop.wait(self.cleanup_interval):
+            try:
+                self.purge_expired()
+                self.last_error = None
+            except Exception as e:
+                # Whatever went wrong, the next round tries again
+                self.last_error = f'{type(e).__name__}: {e}'
+                log_event('token_cleanup_error', error=self.last_error)
+
+    def clear(self):
+        """Revoke everything (manage_server.py "clear data")"""
+        with self._lock, self._file_lock:
+            self.path.unlink(missing_ok=True)
+            self._reset()
+
+    def close(self):
+        self._stop.set()
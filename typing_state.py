@@ -0,0 +1,132 @@
+"""
+Typing indicators (features.typing_indicator), in memory only
+
+    POST /api/chat/typing {"typing": true}    a user types in "general"
+    event: typing  data: {"users": ["anna", "ivan"]}    on the room's stream
+
+Nothing here touches the disk or the shared event bus. Each process keeps
+room -> {username: deadline}; an entry is dropped when its `ttl` runs out
+without a refresh, so a closed tab stops "typing" by itself.
+
+Updates are rate-limited per user and room: a "still typing" within
+`min_interval` of the previous accepted update is ignored (the deadline is
+far enough away anyway). Stopping is always accepted. Changes only mark
+the room dirty; one thread per process (started on first use) sends every
+dirty room's list of typers each `interval` seconds, so a room gets at most
+one typing broadcast per interval however many people type in it.
+
+Broadcasts are ephemeral hub events (EventHub.publish_ephemeral): no id,
+not stored, and only in this process. With several workers a stream shows
+the typers whose updates reached the same worker.
+"""
+
+import os
+import threading
+import time
+
+DEFAULT_TTL = 6.0
+DEFAULT_INTERVAL = 0.5
+DEFAULT_MIN_INTERVAL = 2.0
+
+
+class TypingTracker:
+    def __init__(self, publish, ttl=DEFAULT_TTL, interval=DEFAULT_INTERVAL, min_interval=DEFAULT_MIN_INTERVAL,
+                 clock=time.monotonic):
+        self.publish = publish      # (room, users) -> None, called from the flush thread
+        self.ttl = ttl
+        self.interval = interval
+        self.min_interval = min_interval
+        self.clock = clock
+        self._reset_process_state()
+
+    def _reset_process_state(self):
+        self._lock = threading.Lock()
+        self._rooms = {}            # room -> {username: [deadline, last accepted update]}
+        self._dirty = set()
+        self._flusher_pid = None
+        self._stop = threading.Event()
+        self.updates = 0
+        self.rate_limited = 0
+        self.broadcasts = 0
+
+    def update(self, room, username, typing=True):
+        """Record that `username` started/keeps/stopped typing; False if rate-limited"""
+        now = self.clock()
+        with self._lock:
+            typers = self._rooms.get(room)
+            entry = typers.get(username) if typers else None
+            if not typing:
+                if entry is not None:
+                    del typers[username]
+                    if not typers:
+                        del self._rooms[room]
+                    self._dirty.add(room)
+                self.updates += 1
+                return True
+            if entry is not None and now - entry[1] < self.min_interval:
+                self.rate_limited += 1
+                return False
+            if entry is None:
+                self._rooms.setdefault(room, {})[username] = [now + self.ttl, now]
+                self._dirty.add(room)
+            else:
+                entry[0], entry[1] = now + self.ttl, now
+            self.updates += 1
+        self._ensure_flusher()
+        return True
+
+    def typing(self, room):
+        """Users currently typing in `room`, sorted"""
+        now = self.clock()
+        with self._lock:
+            return sorted(name for name, (deadline, _) in self._rooms.get(room, {}).items() if deadline > now)
+
+    # ----- the flush thread -----
+
+    def _ensure_flusher(self):
+        """Start this process's flush thread (threads don't survive a fork)"""
+        if self._flusher_pid == os.getpid() or not self.interval:
+            return
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+        threading.Thread(target=self._flush_loop, name='typing', daemon=True).start()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def flush(self):
+        """Expire stale typers and broadcast every room that changed"""
+        now = self.clock()
+        with self._lock:
+            for room, typers in list(self._rooms.items()):
+                expired = [name for name, (deadline, _) in typers.items() if deadline <= now]
+                for name in expired:
+                    del typers[name]
+                if expired:
+                    self._dirty.add(room)
+                if not typers:
+                    del self._rooms[room]
+            changes = {room: sorted(self._rooms.get(room, ())) for room in self._dirty}
+            self._dirty.clear()
+        for room, users in changes.items():
+            self.publish(room, users)
+            self.broadcasts += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'rooms': len(self._rooms),
+                'typing': sum(len(typers) for typers in self._rooms.values()),
+                'updates': self.updates,
+                'rate_limited': self.rate_limited,
+                'broadcasts': self.broadcasts,
+            }
+
+    def close(self):
+        self._stop.set()
+
+    def after_fork(self):
+        self._reset_process_state()